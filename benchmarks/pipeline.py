@@ -0,0 +1,257 @@
+"""Times each stage of the pipeline on synthetic trips.
+
+The stages are timed separately, on trips generated with a fixed seed (see
+synthetic.py), and the results are written to a JSON file that a later run
+can be compared with:
+
+    python benchmarks/pipeline.py --output before.json
+    ... change something ...
+    python benchmarks/pipeline.py --output after.json --compare before.json
+
+The stages are:
+    ingest_pandas       reading the costs file into a ledger with pandas
+    ingest_core         reading the costs file into a ledger with the csv
+                        module
+    balances            accumulating the balances of each currency
+    settle              settling the balances into transfers
+    matrices            building the dense cost matrices from the transfers
+    reference_matrices  _matrix_maker, the original row by row engine
+                        (without its reduction)
+    reference_reduction _reduction_algorithm, the original reduction
+    render_html         writing the html email body of every participant
+    render_plaintext    writing the plaintext email body of every participant
+    send                writing and sending every email to a null SMTP sink
+
+The reference stages only run with --reference, on trips whose costs split
+evenly into cents (the reference reduction may not terminate otherwise).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'src'))
+
+import reimburser._reimburser_helper as helper  # noqa: E402
+from reimburser._accumulator import BalanceAccumulator  # noqa: E402
+from reimburser._costs import _costs_ledger_reader  # noqa: E402
+from reimburser._emailer import Emailer  # noqa: E402
+from reimburser._ledger import Ledger  # noqa: E402
+from reimburser._reimburser_helper import (  # noqa: E402
+    ReimburserHelper, _costs_table_reader, _matrix_maker,
+    _reduction_algorithm)
+from reimburser._writer import Writer  # noqa: E402
+from synthetic import TripSpec, generate_trip  # noqa: E402
+
+PRESETS: Dict[str, List[TripSpec]] = {
+    'quick': [
+        TripSpec(participants=6, rows=200, currencies=2, even=True),
+        TripSpec(participants=20, rows=5_000, currencies=3, even=True),
+    ],
+    'default': [
+        TripSpec(participants=6, rows=200, currencies=2, even=True),
+        TripSpec(participants=20, rows=5_000, currencies=3, even=True),
+        TripSpec(participants=50, rows=100_000, currencies=5),
+        TripSpec(participants=200, rows=2_000, currencies=3,
+                 mix=(0.1, 0.6, 0.3)),
+    ],
+}
+
+class NullSMTP:
+    """An SMTP client that accepts everything and sends nothing."""
+    def __init__(self, host: str, port: int):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user: str, password: str):
+        pass
+
+    def send_message(self, msg):
+        # The message is still flattened, as smtplib would.
+        msg.as_bytes()
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+def time_stage(
+        run: Callable[[], object],
+        repeat: int,
+        setup: Optional[Callable[[], object]] = None) -> Dict[str, float]:
+    """Times a stage, each run given a fresh input from setup if any."""
+    times = list()
+    for _ in range(repeat):
+        if setup is None:
+            start = time.perf_counter()
+            run()
+        else:
+            arg = setup()
+            start = time.perf_counter()
+            run(arg)
+        times.append(time.perf_counter() - start)
+
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'repeat': repeat,
+    }
+
+def bench_trip(
+        spec: TripSpec,
+        repeat: int,
+        reference: bool,
+        render_max_rows: int) -> Dict[str, Dict[str, float]]:
+    """Times every stage on a single synthetic trip."""
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        participants_file, costs_file = generate_trip(directory, spec)
+        emails = ReimburserHelper.email_getter(participants_file)
+        names = list(emails)
+
+        results['ingest_pandas'] = time_stage(
+            lambda: Ledger.from_frame(
+                _costs_table_reader(costs_file, 'USD'), names),
+            repeat)
+        results['ingest_core'] = time_stage(
+            lambda: _costs_ledger_reader(costs_file, 'USD', names), repeat)
+
+        ledger = _costs_ledger_reader(costs_file, 'USD', names)
+        results['balances'] = time_stage(
+            lambda acc: acc.add(ledger),
+            repeat,
+            lambda: BalanceAccumulator(names))
+
+        accumulator = BalanceAccumulator(names)
+        accumulator.add(ledger)
+        results['settle'] = time_stage(accumulator.settle, repeat)
+        settlements = accumulator.settle()
+        results['matrices'] = time_stage(
+            lambda: [s.to_matrix() for s in settlements.values()],
+            repeat)
+
+        if reference and spec.even:
+            table = _costs_table_reader(costs_file, 'USD')
+            sub_tables = [
+                table[table['currency'] == c][
+                    ['reimbursee', 'cost', 'reimbursers']]
+                for c in table['currency'].unique()]
+            # _matrix_maker reduces the matrix it builds, which is timed as
+            # a stage of its own.
+            with mock.patch.object(helper, '_reduction_algorithm',
+                                   lambda C: None):
+                results['reference_matrices'] = time_stage(
+                    lambda: [_matrix_maker(t, names) for t in sub_tables],
+                    repeat)
+                matrices = [_matrix_maker(t, names) for t in sub_tables]
+            results['reference_reduction'] = time_stage(
+                lambda Cs: [_reduction_algorithm(C) for C in Cs],
+                repeat,
+                lambda: [C.copy() for C in matrices])
+
+        if spec.rows <= render_max_rows:
+            # A fresh Writer each time, so that the sections shared by all
+            # participants are rendered once per run, as in a real run.
+            results['render_html'] = time_stage(
+                lambda w: [w.write_html_body(n) for n in names],
+                repeat,
+                lambda: Writer('Benchmark Trip', ledger, settlements))
+            results['render_plaintext'] = time_stage(
+                lambda w: [w.write_plaintext_body(n) for n in names],
+                repeat,
+                lambda: Writer('Benchmark Trip', ledger, settlements))
+            results['send'] = time_stage(
+                lambda e: e.send(sender_email='bench@example.com',
+                                 password='bench'),
+                repeat,
+                lambda: Emailer('Benchmark Trip', emails, ledger, settlements,
+                                smtp_factory=NullSMTP))
+
+    return results
+
+def environment() -> Dict[str, str]:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BENCHMARKS, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def trip_name(spec: TripSpec) -> str:
+    mix = '/'.join(f'{share:g}' for share in spec.mix)
+    return (f'p{spec.participants}-r{spec.rows}-c{spec.currencies}-m{mix}'
+            + ('-even' if spec.even else '') + f'-s{spec.seed}')
+
+def compare(results: Dict, baseline: Dict) -> None:
+    """Prints the speedup of each stage over the baseline run."""
+    print(f'\nCompared with {baseline["environment"].get("commit")}:')
+    for trip, result in results['trips'].items():
+        old_stages = baseline['trips'].get(trip, {}).get('stages', {})
+        for stage, timing in result['stages'].items():
+            old = old_stages.get(stage)
+            if old is None:
+                continue
+            ratio = old['median'] / max(timing['median'], 1e-12)
+            print(f'{trip:<40} {stage:<20} {ratio:6.2f}x')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times each stage of the pipeline on synthetic trips.')
+    parser.add_argument('--preset', choices=sorted(PRESETS),
+                        default='default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reference', action='store_true',
+                        help='Also time the original row by row engine')
+    parser.add_argument('--render-max-rows', type=int, default=20_000,
+                        help='Skip rendering and sending for larger trips')
+    parser.add_argument('--output', help='The JSON file to write to')
+    parser.add_argument('--compare', help='A JSON file of an earlier run')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'trips': dict()}
+    for spec in PRESETS[args.preset]:
+        name = trip_name(spec)
+        stages = bench_trip(spec, args.repeat, args.reference,
+                            args.render_max_rows)
+        results['trips'][name] = {'spec': spec._asdict(), 'stages': stages}
+        for stage, timing in stages.items():
+            print(f'{name:<40} {stage:<20} '
+                  f'{timing["median"] * 1000:10.2f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        compare(results, baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compares the greedy and optimal settlements on made-up balances.
+
+Trips often split into smaller groups that only share costs among
+themselves (couples, rooms, cars, ...), whose balances add up to zero. The
+balances are made up that way, with a fixed seed: each trip is split into
+groups of 1 to --max-group participants. The number of transfers each
+settlement makes and the time it takes are then reported for each number
+of participants.
+
+Usage:
+    python benchmarks/settle.py [--participants 4,8,12,16,20,24] [--trips N]
+        [--max-group N] [--seed N]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+from reimburser._settlement import _settle, _settle_optimal  # noqa: E402
+
+def grouped_balances(
+        rng: random.Random,
+        participants: int,
+        max_group: int) -> List[int]:
+    """Makes up balances in cents that split into zero-sum groups."""
+    balances = list()
+    while len(balances) < participants:
+        size = min(rng.randint(1, max_group), participants - len(balances))
+        group = [rng.randint(-20_000, 20_000) for _ in range(size - 1)]
+        group.append(-sum(group))
+        balances.extend(group)
+    rng.shuffle(balances)
+
+    return balances
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--participants', default='4,8,12,16,20,24')
+    parser.add_argument('--trips', type=int, default=50)
+    parser.add_argument('--max-group', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f'{"participants":>12} {"greedy":>8} {"optimal":>8} {"saved":>7} '
+          f'{"greedy ms":>10} {"optimal ms":>11}')
+    for participants in map(int, args.participants.split(',')):
+        counts = {'greedy': list(), 'optimal': list()}
+        times = {'greedy': list(), 'optimal': list()}
+        for _ in range(args.trips):
+            balances = grouped_balances(rng, participants, args.max_group)
+            for method, settle in (('greedy', _settle),
+                                   ('optimal', _settle_optimal)):
+                start = time.perf_counter()
+                transfers = settle(balances, exact=True)
+                times[method].append(time.perf_counter() - start)
+                counts[method].append(len(transfers))
+
+        greedy = statistics.mean(counts['greedy'])
+        optimal = statistics.mean(counts['optimal'])
+        print(f'{participants:>12} {greedy:>8.2f} {optimal:>8.2f} '
+              f'{1 - optimal / greedy:>7.1%} '
+              f'{statistics.mean(times["greedy"]) * 1000:>10.3f} '
+              f'{statistics.mean(times["optimal"]) * 1000:>11.3f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Times the startup of the command line and of a small trip.
+
+Each case runs in a fresh interpreter, and the median wall time of a few runs
+is reported along with whether pandas ended up imported. A small trip should
+settle without ever importing pandas.
+
+Usage:
+    python benchmarks/startup.py [--repeat N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+SMALL_TRIP = '''
+import sys
+from reimburser import Reimburser
+reimburser = Reimburser({participants!r}, {costs!r})
+reimburser.write_reimbursements({output!r})
+print('pandas' in sys.modules)
+'''
+
+def write_small_trip(directory: str):
+    participants = os.path.join(directory, 'participants.csv')
+    costs = os.path.join(directory, 'costs.csv')
+    with open(participants, 'w') as f:
+        f.write('participant,email\n')
+        for name in ('Alice', 'Bob', 'Carol', 'Dan'):
+            f.write(f'{name},{name.lower()}@email.com\n')
+    with open(costs, 'w') as f:
+        f.write('reimbursee,cost,currency,reimbursers,notes\n')
+        f.write('Alice,120.00,USD,,dinner\n')
+        f.write('Bob,45.50,USD,"Alice, Carol",taxi\n')
+        f.write('Carol,300.00,EUR,not Dan,hotel\n')
+        f.write('Dan,12.25,,Bob,coffee\n')
+
+    return participants, costs
+
+def time_command(command, repeat: int):
+    env = dict(os.environ, PYTHONPATH=SRC)
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, env=env, capture_output=True,
+                                text=True, check=True)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times), result.stdout.strip().splitlines()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        participants, costs = write_small_trip(directory)
+        small_trip = SMALL_TRIP.format(
+            participants=participants,
+            costs=costs,
+            output=os.path.join(directory, 'reimbursements.csv'))
+        cases = [
+            ('python -c pass', [sys.executable, '-c', 'pass']),
+            ('reimburser --help', [sys.executable, '-m', 'reimburser',
+                                   '--help']),
+            ('import reimburser', [sys.executable, '-c',
+                                   'import reimburser; reimburser.Reimburser']),
+            ('small trip', [sys.executable, '-c', small_trip]),
+        ]
+
+        for name, command in cases:
+            seconds, output = time_command(command, args.repeat)
+            note = ''
+            if name == 'small trip':
+                note = '(pandas imported)' if output[-1] == 'True' \
+                    else '(pandas not imported)'
+            print(f'{name:<20} {seconds * 1000:8.1f} ms {note}')
+
+if __name__ == '__main__':
+    main()
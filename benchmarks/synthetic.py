@@ -0,0 +1,123 @@
+"""A seeded generator of synthetic trips.
+
+The same seed and parameters always give the same trip, so that benchmark
+runs can be compared with each other.
+
+Usage:
+    python benchmarks/synthetic.py directory [--participants N] [--rows N]
+        [--currencies N] [--mix BLANK,LIST,NOT] [--even] [--seed N]
+"""
+import argparse
+import csv
+import os
+import random
+from typing import List, NamedTuple, Tuple
+
+CURRENCIES = ['USD', 'EUR', 'JPY', 'GBP', 'CHF', 'CAD', 'AUD', 'SEK', 'KWD',
+              'MXN']
+
+class TripSpec(NamedTuple):
+    """The parameters of a synthetic trip."""
+    participants: int = 8
+    rows: int = 1000
+    currencies: int = 2
+    # The share of blank, explicit list and "not X" reimbursers cells.
+    mix: Tuple[float, float, float] = (0.5, 0.3, 0.2)
+    # Whether every cost splits evenly into whole cents, which the reference
+    # engine needs to be sure to terminate.
+    even: bool = False
+    seed: int = 0
+
+def participant_names(n: int) -> List[str]:
+    # Single words without "not" in them, which the reference engine needs to
+    # parse the "not X" cells.
+    return [f'P{i:04d}' for i in range(n)]
+
+def generate_trip(directory: str, spec: TripSpec) -> Tuple[str, str]:
+    """Writes a participants.csv and a costs.csv into the directory.
+
+    Args:
+        directory: The directory to write the trip into.
+        spec: The parameters of the trip.
+
+    Returns:
+        The paths of the participants file and of the costs file.
+    """
+    rng = random.Random(spec.seed)
+    names: List[str] = participant_names(spec.participants)
+    currencies: List[str] = CURRENCIES[:spec.currencies]
+    max_group: int = min(5, spec.participants)
+
+    participants_file = os.path.join(directory, 'participants.csv')
+    with open(participants_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['participant', 'email'])
+        for k, name in enumerate(names):
+            writer.writerow([name, f'participant{k}@example.com'])
+
+    costs_file = os.path.join(directory, 'costs.csv')
+    with open(costs_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['reimbursee', 'cost', 'currency', 'reimbursers',
+                         'notes'])
+        for row in range(spec.rows):
+            kind = rng.choices(('blank', 'list', 'not'), spec.mix)[0]
+            if kind == 'blank':
+                reimbursers = ''
+                sharers = spec.participants
+            elif kind == 'list':
+                group = rng.sample(names, rng.randint(1, max_group))
+                reimbursers = ', '.join(group)
+                sharers = len(group)
+            else:
+                excluded = rng.sample(
+                    names,
+                    rng.randint(1, max(1, min(2, spec.participants - 1))))
+                reimbursers = ', '.join(f'not {name}' for name in excluded)
+                sharers = spec.participants - len(excluded)
+
+            if spec.even:
+                cents = sharers * rng.randint(1, 50_000 // sharers + 1)
+            else:
+                cents = rng.randint(100, 50_000)
+            # The first currency is the primary one, and is sometimes left
+            # blank.
+            currency = rng.choice(currencies)
+            if currency == currencies[0] and rng.random() < 0.2:
+                currency = ''
+
+            writer.writerow([
+                rng.choice(names),
+                f'{cents / 100:.2f}',
+                currency,
+                reimbursers,
+                f'expense {row}'])
+
+    return participants_file, costs_file
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--participants', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--currencies', type=int, default=2)
+    parser.add_argument('--mix', default='0.5,0.3,0.2',
+                        help='The share of blank, explicit list and "not X" '
+                             'reimbursers cells')
+    parser.add_argument('--even', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    spec = TripSpec(
+        args.participants,
+        args.rows,
+        args.currencies,
+        tuple(map(float, args.mix.split(','))),
+        args.even,
+        args.seed)
+    for path in generate_trip(args.directory, spec):
+        print(path)
+
+if __name__ == '__main__':
+    main()
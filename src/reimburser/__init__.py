@@ -1 +1,13 @@
-from .reimburser import Reimburser
+# The classes are only imported once they are looked up, so that running the
+# command line (e.g. `python -m reimburser --help`) doesn't pay for NumPy
+# before the arguments are even parsed.
+__all__ = ['BalanceAccumulator', 'Reimburser']
+
+def __getattr__(name: str):
+    if name == 'Reimburser':
+        from .reimburser import Reimburser
+        return Reimburser
+    if name == 'BalanceAccumulator':
+        from ._accumulator import BalanceAccumulator
+        return BalanceAccumulator
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,6 +1,17 @@
 import argparse
+import cProfile
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List
 
-from .reimburser import Reimburser
+# The heavy modules (NumPy, pandas, the email modules) are only imported once
+# the arguments are parsed, and only by the stages that need them.
+if TYPE_CHECKING:
+    from ._delivery import DeliveryReport
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -27,14 +38,579 @@ def parse_args():
         help='Primary currency used during trip',
         metavar='currency',
         default='USD')
+    parser.add_argument(
+        '--exact',
+        help='Compute the reimbursements in integer minor units (e.g. cents)',
+        action='store_true')
+    parser.add_argument(
+        '--minor-digits',
+        help='With --exact, the number of minor unit digits of the '
+            'currencies that differ from the built-in ones, e.g. JPY=0,KWD=3',
+        metavar='CUR=N,...',
+        type=parse_minor_digits,
+        default=None)
+    parser.add_argument(
+        '--settle',
+        help='How to settle each currency: greedy (the default) is fast, '
+            'optimal makes the fewest transfers possible for groups of up to '
+            '20 or so participants',
+        choices=('greedy', 'optimal'),
+        default='greedy')
+    parser.add_argument(
+        '--csv-engine',
+        help='The parser large costs files are read with: c (the default) '
+            'or pyarrow, which is faster but needs pyarrow installed',
+        choices=('c', 'pyarrow'),
+        default='c')
+    parser.add_argument(
+        '--cache',
+        help='Cache the costs read and the reimbursements in a directory (by '
+            'default ~/.cache/reimburser), so that running the same trip '
+            'again skips reading and settling it',
+        metavar='directory',
+        nargs='?',
+        # An empty directory stands for the default one.
+        const='',
+        default=None)
+    parser.add_argument(
+        '--stream',
+        help='Read the costs file in chunks, for costs files too large to '
+            'fit in memory',
+        action='store_true')
+    parser.add_argument(
+        '--state',
+        help='A file to keep the balances in between runs, so that only the '
+            'costs appended since the last run are read',
+        metavar='state_file.json')
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        help='The number of processes the currencies are settled in',
+        metavar='N',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--outbox',
+        help='Write the emails into an outbox first, and send them from '
+            'there. If sending stops halfway, run `reimburser deliver` to '
+            'send the rest.',
+        metavar='outbox.db')
+    parser.add_argument(
+        '--dry-run',
+        help='Only write the emails into the outbox, without sending them',
+        action='store_true')
+    add_smtp_args(parser)
+    add_profile_args(parser)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.dry_run and args.outbox is None:
+        parser.error('--dry-run requires --outbox')
+    if args.minor_digits is not None and not args.exact:
+        parser.error('--minor-digits requires --exact')
+    return args
+
+def parse_minor_digits(value: str) -> Dict[str, int]:
+    """Parses the currencies' minor unit digits, as in JPY=0,KWD=3."""
+    minor_digits = dict()
+    for item in filter(None, value.split(',')):
+        currency, _, digits = item.partition('=')
+        if not currency.strip() or not digits.strip().isdigit():
+            raise argparse.ArgumentTypeError(
+                f'expected CUR=N, e.g. JPY=0, not {item!r}')
+        minor_digits[currency.strip().upper()] = int(digits)
+    return minor_digits
+
+def add_profile_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--profile',
+        help='Print how long each stage took, along with a few counters',
+        action='store_true')
+    parser.add_argument(
+        '--metrics-json',
+        help='Write how long each stage took, along with a few counters, to '
+            'a JSON file',
+        metavar='metrics.json')
+    parser.add_argument(
+        '--cprofile',
+        help='Profile the run with cProfile and write the stats to a file '
+            '(see python -m pstats)',
+        metavar='profile.prof')
+    parser.add_argument(
+        '--verbose',
+        '-v',
+        help='Log what is going on',
+        action='store_true')
+
+def add_smtp_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--smtp-host',
+        help='The SMTP server the emails are sent through',
+        metavar='host',
+        default='smtp.gmail.com')
+    parser.add_argument(
+        '--smtp-port',
+        help='The port of the SMTP server',
+        metavar='port',
+        type=int,
+        default=587)
+    parser.add_argument(
+        '--connections',
+        help='The number of connections the emails are sent over at once',
+        metavar='N',
+        type=int,
+        default=4)
+    parser.add_argument(
+        '--rate',
+        help='The maximum number of emails sent per second',
+        metavar='emails_per_second',
+        type=float,
+        default=None)
+    parser.add_argument(
+        '--retries',
+        help='The number of times a temporarily failed email is retried',
+        metavar='N',
+        type=int,
+        default=3)
+
+
+def smtp_settings(args: argparse.Namespace) -> Dict:
+    return {
+        'smtp_host': args.smtp_host,
+        'smtp_port': args.smtp_port,
+        'connections': args.connections,
+        'rate_limit': args.rate,
+        'retries': args.retries,
+    }
+
+def parse_batch_args(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='reimburser batch',
+        description='Calculates the reimbursements for all the trips listed '
+            'in a manifest and writes them to a csv file for each trip.')
+    parser.add_argument(
+        'manifest_file',
+        help='A csv file listing the trips, either with a "trip" column of '
+            'directories holding a participants.csv and a costs.csv, or with '
+            '"participants" and "costs" columns. The "title", "currency" and '
+            '"output" columns are optional.',
+        metavar='manifest_file.csv')
+    parser.add_argument(
+        '--currency',
+        '-c',
+        help='Primary currency used during the trips that don\'t specify one',
+        metavar='currency',
+        default='USD')
+    parser.add_argument(
+        '--exact',
+        help='Compute the reimbursements in integer minor units (e.g. cents)',
+        action='store_true')
+    parser.add_argument(
+        '--settle',
+        help='How to settle each currency: greedy (the default) is fast, '
+            'optimal makes the fewest transfers possible for groups of up to '
+            '20 or so participants',
+        choices=('greedy', 'optimal'),
+        default='greedy')
+    parser.add_argument(
+        '--csv-engine',
+        help='The parser large costs files are read with: c (the default) '
+            'or pyarrow, which is faster but needs pyarrow installed',
+        choices=('c', 'pyarrow'),
+        default='c')
+    parser.add_argument(
+        '--cache',
+        help='Cache the costs read and the reimbursements in a directory (by '
+            'default ~/.cache/reimburser), so that running the same trip '
+            'again skips reading and settling it',
+        metavar='directory',
+        nargs='?',
+        const='',
+        default=None)
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        help='The number of processes the trips are settled in (defaults to '
+            'the number of CPUs)',
+        metavar='N',
+        type=int,
+        default=None)
+
+    add_profile_args(parser)
+
+    return parser.parse_args(argv)
+
+def parse_deliver_args(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='reimburser deliver',
+        description='Sends the emails of an outbox that haven\'t been sent '
+            'yet.')
+    parser.add_argument(
+        'outbox_file',
+        help='The outbox the emails were written into',
+        metavar='outbox.db')
+    parser.add_argument(
+        '--retry-failed',
+        help='Also send the emails that failed the last time',
+        action='store_true')
+    parser.add_argument(
+        '--dry-run',
+        help='Only count the emails of the outbox, without sending them',
+        action='store_true')
+    add_smtp_args(parser)
+    add_profile_args(parser)
+
+    return parser.parse_args(argv)
+
+def parse_balances_args(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='reimburser balances',
+        description='Accumulates the balances of a shard of a trip\'s costs '
+            '(one or more costs files) without settling them, to be merged '
+            'with the other shards by `reimburser merge`.')
+    parser.add_argument(
+        'participants_file',
+        help='A csv file of the participants',
+        metavar='participants_file.csv')
+    parser.add_argument(
+        'costs_files',
+        help='The csv files listing the costs of the shard, or directories '
+            'of them',
+        metavar='costs_file.csv',
+        nargs='+')
+    parser.add_argument(
+        '--output',
+        '-o',
+        help='The file the balances are written to',
+        metavar='balances.json',
+        required=True)
+    parser.add_argument(
+        '--currency',
+        '-c',
+        help='Primary currency used during trip',
+        metavar='currency',
+        default='USD')
+    parser.add_argument(
+        '--exact',
+        help='Compute the balances in integer minor units (e.g. cents), '
+            'which merge exactly',
+        action='store_true')
+    parser.add_argument(
+        '--minor-digits',
+        help='With --exact, the number of minor unit digits of the '
+            'currencies that differ from the built-in ones, e.g. JPY=0,KWD=3',
+        metavar='CUR=N,...',
+        type=parse_minor_digits,
+        default=None)
+    parser.add_argument(
+        '--csv-engine',
+        help='The parser large costs files are read with: c (the default) '
+            'or pyarrow, which is faster but needs pyarrow installed',
+        choices=('c', 'pyarrow'),
+        default='c')
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        help='The number of processes the costs files are read in',
+        metavar='N',
+        type=int,
+        default=None)
+    add_profile_args(parser)
+
+    args = parser.parse_args(argv)
+    if args.minor_digits is not None and not args.exact:
+        parser.error('--minor-digits requires --exact')
+    return args
+
+def parse_merge_args(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='reimburser merge',
+        description='Merges the balances written by `reimburser balances` '
+            'and writes the reimbursements that settle them to a csv file.')
+    parser.add_argument(
+        'participants_file',
+        help='The csv file of the participants the balances were '
+            'accumulated for',
+        metavar='participants_file.csv')
+    parser.add_argument(
+        'balances_files',
+        help='The balances of each shard',
+        metavar='balances.json',
+        nargs='+')
+    parser.add_argument(
+        '--output',
+        '-o',
+        help='The csv file the reimbursements are written to',
+        metavar='reimbursements.csv',
+        default='reimbursements.csv')
+    parser.add_argument(
+        '--title',
+        '-t',
+        help='The title of the trip',
+        metavar='trip_title',
+        default='Fun Trip')
+    parser.add_argument(
+        '--settle',
+        help='How to settle each currency: greedy (the default) is fast, '
+            'optimal makes the fewest transfers possible for groups of up to '
+            '20 or so participants',
+        choices=('greedy', 'optimal'),
+        default='greedy')
+    parser.add_argument(
+        '--minor-digits',
+        help='The minor unit digits the balances were accumulated with (see '
+            '`reimburser balances`), checked against those of each shard',
+        metavar='CUR=N,...',
+        type=parse_minor_digits,
+        default=None)
+    add_profile_args(parser)
+
+    return parser.parse_args(argv)
+
+def parse_serve_args(argv: List[str]):
+    parser = argparse.ArgumentParser(
+        prog='reimburser serve',
+        description='Settles the trips sent to a local JSON API (POST '
+            '/settle), keeping the engine loaded in between.')
+    parser.add_argument(
+        '--host',
+        help='The address to listen on (by default, only this machine)',
+        metavar='host',
+        default='127.0.0.1')
+    parser.add_argument(
+        '--port',
+        '-p',
+        help='The port to listen on',
+        metavar='port',
+        type=int,
+        default=8765)
+    parser.add_argument(
+        '--socket',
+        help='Listen on a Unix socket instead of a port',
+        metavar='path')
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        help='The number of processes the trips are settled in (defaults to '
+            'the number of CPUs)',
+        metavar='N',
+        type=int,
+        default=None)
+    parser.add_argument(
+        '--outbox-dir',
+        help='Let the jobs write their emails into an outbox in this '
+            'directory, to be sent with `reimburser deliver`. Without it, no '
+            'emails are ever written.',
+        metavar='directory')
+    parser.add_argument(
+        '--verbose',
+        '-v',
+        help='Log each request',
+        action='store_true')
+
+    return parser.parse_args(argv)
+
+def balances(args: argparse.Namespace) -> int:
+    from ._reimburser_helper import ReimburserHelper
+
+    costs_files = list()
+    for path in args.costs_files:
+        if os.path.isdir(path):
+            costs_files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith('.csv')))
+        else:
+            costs_files.append(path)
+
+    participants = list(ReimburserHelper.email_getter(args.participants_file))
+    accumulator = ReimburserHelper.balances_getter(
+        costs_files,
+        participants,
+        args.currency,
+        args.exact,
+        args.minor_digits,
+        workers=args.jobs,
+        csv_engine=args.csv_engine)
+    with open(args.output, 'w') as f:
+        json.dump(accumulator.to_dict(), f)
+    print(f'Wrote the balances of {sum(accumulator.transactions.values())} '
+          f'costs from {len(costs_files)} files to {args.output}.')
+
+    return 0
+
+def merge(args: argparse.Namespace) -> int:
+    from ._accumulator import BalanceAccumulator
+    from ._reimburser_helper import ReimburserHelper
+    from .reimburser import Reimburser
+
+    accumulator = None
+    for balances_file in args.balances_files:
+        with open(balances_file) as f:
+            shard = BalanceAccumulator.from_dict(json.load(f))
+        if args.minor_digits is not None \
+                and shard.minor_digits != args.minor_digits:
+            print(f'{balances_file} was accumulated with other minor unit '
+                  f'digits: {shard.minor_digits}.', file=sys.stderr)
+            return 1
+        accumulator = shard if accumulator is None \
+            else accumulator.merge(shard)
+
+    reimbs = Reimburser.from_balances(
+        ReimburserHelper.email_getter(args.participants_file),
+        accumulator,
+        args.title,
+        settle=args.settle)
+    written: int = reimbs.write_reimbursements(args.output)
+    print(f'Wrote {written} reimbursements settling {reimbs.rows} costs to '
+          f'{args.output}.')
+
+    return 0
+
+def serve(args: argparse.Namespace) -> int:
+    from ._reimburser_helper import FORMAT
+    from ._serve import SettlementServer
+
+    if args.verbose:
+        logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+    address = args.socket or (args.host, args.port)
+    with SettlementServer(address, args.jobs, args.outbox_dir) as server:
+        # Being stopped (e.g. by a service manager) shuts the server down as
+        # cleanly as Ctrl-C.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        where = server.address if args.socket \
+            else 'http://%s:%d' % server.address
+        print(f'Settling trips on {where} with {server.jobs} workers '
+              f'(Ctrl-C to stop).', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+def deliver(args: argparse.Namespace) -> int:
+    from ._outbox import FAILED, PENDING, SENT, Outbox
+
+    with Outbox(args.outbox_file) as outbox:
+        if args.retry_failed:
+            outbox.retry_failed()
+        if args.dry_run:
+            counts = outbox.counts()
+            print(f'{counts[PENDING]} emails to send, {counts[SENT]} sent, '
+                  f'{counts[FAILED]} failed.')
+            return 0
+
+        return delivered(lambda: outbox.deliver(**smtp_settings(args)))
+
+def delivered(send: Callable[[], List['DeliveryReport']]) -> int:
+    """Sends the emails and reports on them, or on the failed login that
+    kept them from being sent."""
+    from smtplib import SMTPAuthenticationError
+
+    try:
+        reports = send()
+    except SMTPAuthenticationError as e:
+        print(f'The SMTP server turned down the login: {e.smtp_code} '
+              f'{e.smtp_error.decode(errors="replace")}', file=sys.stderr)
+        return 1
+
+    return report_deliveries(reports)
+
+def report_deliveries(reports: List['DeliveryReport']) -> int:
+    failures = [report for report in reports if not report.sent]
+    print(f'Sent {len(reports) - len(failures)} of {len(reports)} emails.')
+    for failure in failures:
+        print(f'\t{failure.recipient} <{failure.email}> | {failure.error}')
+
+    return 1 if failures else 0
+
+def batch(args: argparse.Namespace) -> int:
+    from ._batch import _batch_summary, _manifest_reader, _run_batch
+
+    start: float = time.perf_counter()
+    results = _run_batch(
+        _manifest_reader(args.manifest_file, args.currency),
+        args.jobs,
+        args.exact,
+        args.settle,
+        args.cache,
+        args.csv_engine)
+    print(_batch_summary(results, time.perf_counter() - start))
+
+    return 1 if any(result.error for result in results) else 0
+
+def reimburse(args: argparse.Namespace) -> int:
+    from .reimburser import Reimburser
 
-if __name__ == '__main__':
-    args: argparse.Namespace = parse_args()
     reimbs: Reimburser = Reimburser(
         args.participants_file,
         args.costs_file,
         args.title,
-        args.currency)
-    reimbs.send_emails()
+        args.currency,
+        args.exact,
+        args.minor_digits,
+        stream=args.stream,
+        state_file=args.state,
+        workers=args.jobs,
+        settle=args.settle,
+        cache_dir=args.cache,
+        csv_engine=args.csv_engine)
+    if args.outbox is not None:
+        from ._errors import OutboxError
+
+        try:
+            spooled: int = reimbs.spool_emails(args.outbox)
+        except OutboxError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(f'Wrote {spooled} emails into {args.outbox}.')
+        if args.dry_run:
+            return 0
+
+        from ._outbox import Outbox
+
+        with Outbox(args.outbox) as outbox:
+            return delivered(
+                lambda: outbox.deliver(**smtp_settings(args)))
+
+    return delivered(lambda: reimbs.send_emails(**smtp_settings(args)))
+
+def profiled(command: Callable[[argparse.Namespace], int],
+             args: argparse.Namespace) -> int:
+    """Runs a command with the logging, metrics and profiling asked for."""
+    from ._metrics import Metrics, collecting
+    from ._reimburser_helper import FORMAT
+
+    if args.verbose:
+        logging.basicConfig(format=FORMAT, level=logging.DEBUG)
+
+    metrics = Metrics() if args.profile or args.metrics_json else None
+    profiler = cProfile.Profile() if args.cprofile else None
+    with collecting(metrics):
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return command(args)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.cprofile)
+            if args.profile:
+                print(metrics.report(), file=sys.stderr)
+            if args.metrics_json:
+                with open(args.metrics_json, 'w') as f:
+                    json.dump(metrics.to_dict(), f, indent=2)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['batch']:
+        sys.exit(profiled(batch, parse_batch_args(sys.argv[2:])))
+    if sys.argv[1:2] == ['balances']:
+        sys.exit(profiled(balances, parse_balances_args(sys.argv[2:])))
+    if sys.argv[1:2] == ['merge']:
+        sys.exit(profiled(merge, parse_merge_args(sys.argv[2:])))
+    if sys.argv[1:2] == ['serve']:
+        sys.exit(serve(parse_serve_args(sys.argv[2:])))
+    if sys.argv[1:2] == ['deliver']:
+        sys.exit(profiled(deliver, parse_deliver_args(sys.argv[2:])))
+
+    sys.exit(profiled(reimburse, parse_args()))
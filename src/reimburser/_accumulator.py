@@ -0,0 +1,293 @@
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from . import _metrics
+from ._balance import (_array_balance_maker, _currency_partitions,
+                       _participant_index)
+from ._lazy import pd
+from ._ledger import Ledger
+from ._money import _minor_digits
+from ._parallel import _balance_task, _settle_task
+from ._settlement import SETTLE_METHODS, Settlement
+from ._types import Name, Table
+
+class BalanceAccumulator:
+    """Accumulates the participants' net balances of each currency, one cost
+    table (or chunk of a cost table) at a time.
+
+    Since the balances are additive, a cost table can be folded in piece by
+    piece without ever holding the whole table in memory, and settled once
+    all the pieces are in. For the same reason, the costs can be split into
+    shards (files, or the parts of one) that are each folded into their own
+    accumulator, on other processes or machines, then merged in any order
+    and settled. Only the balance vectors, one number per participant and
+    currency, have to travel (see to_dict).
+
+    Attributes:
+        names: The participants' names, ordered by participant id.
+        exact: Whether the balances are in integer minor units.
+        minor_digits: Overrides of the number of minor unit digits of each
+            currency, used in exact mode.
+        balances: A dict mapping a currency code to its balance vector.
+        transactions: A dict mapping a currency code to its number of rows.
+        totals: A dict mapping a currency code to the sum of its costs.
+        add: Folds a cost table into the balances.
+        merge: Folds the balances of another accumulator into these.
+        settle: Settles the balances of each currency.
+        summary: Summarizes the costs folded in so far.
+        to_dict: Lays out the balances as JSON.
+        from_dict: Reads the balances laid out by to_dict.
+    """
+    def __init__(
+            self,
+            names: List[Name],
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None):
+        """Initializes BalanceAccumulator.
+
+        Args:
+            names: The participants' names, ordered by participant id.
+            exact: Whether to accumulate the balances in integer minor units.
+            minor_digits: Overrides of the number of minor unit digits of
+                each currency, used in exact mode.
+        """
+        self.names = names
+        self.exact = exact
+        self.minor_digits = minor_digits
+        self._index: Dict[Name, int] = _participant_index(names)
+        # The ids of each reimbursers cell parsed so far, kept from one table
+        # (or chunk) to the next.
+        self._groups: Dict[Optional[str], np.ndarray] = dict()
+
+        self.balances: Dict[str, np.ndarray] = dict()
+        self.transactions: Dict[str, int] = dict()
+        self.totals: Dict[str, float] = dict()
+
+    def add(
+            self,
+            table: Union[Table, Ledger],
+            executor: Optional[Executor] = None) -> None:
+        """Folds a cost table into the balances.
+
+        The index of the table is taken as the row numbers of the costs
+        file, which is what pd.read_csv gives, chunked or not.
+
+        Args:
+            table: A cost table with at least the columns [reimbursee, cost,
+                currency, reimbursers], or its ledger.
+            executor: A process pool to compute the balance of each currency
+                in parallel, if any.
+
+        Raises:
+            KeyError: A reimbursee or reimburser is not a participant.
+        """
+        with _metrics.timer('balances'):
+            self._add(table, executor)
+
+    def _add(
+            self,
+            table: Union[Table, Ledger],
+            executor: Optional[Executor]) -> None:
+        """Does the actual folding of add."""
+        if isinstance(table, Ledger):
+            ledger: Ledger = table
+        else:
+            ledger = Ledger.from_frame(table, self.names)
+
+        # The ledger is partitioned by currency once, and each currency is
+        # then a contiguous range of the sorted columns.
+        currencies: List[str] = ledger.currencies
+        order, bounds = _currency_partitions(ledger.currency,
+                                             len(currencies))
+        creditors: np.ndarray = ledger.reimbursee[order]
+        if ledger.names != self.names:
+            # The ids of a ledger read for other participants are mapped to
+            # ours, by name.
+            ids = np.array([self._index[name] for name in ledger.names],
+                           dtype=np.int32)
+            creditors = ids[creditors]
+        amounts: np.ndarray = ledger.amount[order]
+        group_codes: np.ndarray = ledger.reimbursers[order]
+        row_numbers: np.ndarray = ledger.rows[order]
+
+        if executor is None:
+            balances = [
+                _array_balance_maker(
+                    creditors[rows], amounts[rows], ledger.scale,
+                    group_codes[rows], ledger.groups, row_numbers[rows],
+                    self._index, self._digits(c), self._groups)
+                for c, rows in _ranges(currencies, bounds)]
+        else:
+            futures = [
+                executor.submit(
+                    _balance_task,
+                    creditors[rows], amounts[rows], ledger.scale,
+                    group_codes[rows], ledger.groups, row_numbers[rows],
+                    self.names, self._digits(c))
+                for c, rows in _ranges(currencies, bounds)]
+            balances = [future.result() for future in futures]
+
+        costs: np.ndarray = amounts / 10.0 ** ledger.scale
+        for (c, rows), balance in zip(_ranges(currencies, bounds), balances):
+            if c in self.balances:
+                self.balances[c] += balance
+            else:
+                self.balances[c] = balance
+            self.transactions[c] = self.transactions.get(c, 0) \
+                + int(rows.stop - rows.start)
+            self.totals[c] = self.totals.get(c, 0.0) \
+                + float(costs[rows].sum())
+
+    def merge(self, other: 'BalanceAccumulator') -> 'BalanceAccumulator':
+        """Folds the balances of another accumulator into these.
+
+        Merging is associative and commutative (exactly so in exact mode,
+        up to float rounding otherwise), so the shards of a trip can be
+        merged in any order or grouping. The currencies keep the order they
+        first appeared in.
+
+        Args:
+            other: The balances of another shard of the same trip.
+
+        Returns:
+            This accumulator, so that merges can be chained.
+
+        Raises:
+            ValueError: The other accumulator is for other participants or
+                settings.
+        """
+        if (other.names != self.names
+                or other.exact != self.exact
+                or other.minor_digits != self.minor_digits):
+            raise ValueError('Only the balances of the same participants and '
+                             'settings can be merged.')
+
+        for c, balance in other.balances.items():
+            if c in self.balances:
+                self.balances[c] = self.balances[c] + balance
+            else:
+                self.balances[c] = balance.copy()
+            self.transactions[c] = self.transactions.get(c, 0) \
+                + other.transactions[c]
+            self.totals[c] = self.totals.get(c, 0.0) + other.totals[c]
+
+        return self
+
+    def settle(
+            self,
+            executor: Optional[Executor] = None,
+            method: str = 'greedy') -> Dict[str, Settlement]:
+        """Settles the balances of each currency.
+
+        Args:
+            executor: A process pool to settle each currency in parallel, if
+                any.
+            method: Either "greedy", which settles the balances in O(N log N)
+                time, or "optimal", which makes the fewest transfers for
+                small groups of participants (see _settle_optimal).
+
+        Returns:
+            A dict mapping a currency code to the corresponding Settlement.
+
+        Raises:
+            ValueError: The method is neither greedy nor optimal.
+        """
+        if method not in SETTLE_METHODS:
+            raise ValueError('Method must either be greedy or optimal.')
+
+        with _metrics.timer('settle'):
+            if executor is None:
+                all_transfers = [_settle_task(balance, self.exact, method)
+                                 for balance in self.balances.values()]
+            else:
+                all_transfers = list(executor.map(
+                    _settle_task,
+                    self.balances.values(),
+                    [self.exact] * len(self.balances),
+                    [method] * len(self.balances)))
+        _metrics.count('transfers', sum(map(len, all_transfers)))
+
+        settlements = dict()
+        for c, transfers in zip(self.balances, all_transfers):
+            if self.exact:
+                settlements[c] = Settlement(c, self.names, transfers,
+                                            self._digits(c), minor_units=True)
+            else:
+                settlements[c] = Settlement(c, self.names, transfers)
+
+        return settlements
+
+    def summary(self) -> Table:
+        """Summarizes the costs folded in so far.
+
+        Returns:
+            A pandas DataFrame with the columns [currency, transactions,
+            cost], with one row per currency.
+        """
+        return pd.DataFrame({
+            'currency': list(self.transactions.keys()),
+            'transactions': list(self.transactions.values()),
+            'cost': list(self.totals.values()),
+        })
+
+    def to_dict(self) -> Dict:
+        """Lays out the balances as JSON, to be saved or sent to the process
+        that merges them.
+
+        The size of the balances only depends on the number of participants
+        and currencies, not on the number of costs folded in. Float balances
+        are written with as many digits as it takes to read them back
+        exactly.
+
+        Returns:
+            A dict of the participants, settings and balances, see from_dict.
+        """
+        return {
+            'exact': self.exact,
+            'minor_digits': self.minor_digits,
+            'names': self.names,
+            'balances': {c: b.tolist() for c, b in self.balances.items()},
+            'transactions': self.transactions,
+            'totals': self.totals,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BalanceAccumulator':
+        """Reads the balances laid out by to_dict.
+
+        Args:
+            data: A dict of the participants, settings and balances (other
+                keys are ignored).
+
+        Returns:
+            The accumulator.
+
+        Raises:
+            KeyError: The dict is missing a key.
+            ValueError: A balance vector doesn't have one number per
+                participant.
+        """
+        accumulator = cls(data['names'], data['exact'], data['minor_digits'])
+        dtype = np.int64 if accumulator.exact else float
+        for c, balance in data['balances'].items():
+            accumulator.balances[c] = np.array(balance, dtype=dtype)
+            if accumulator.balances[c].shape != (len(accumulator.names),):
+                raise ValueError(f'The {c} balances are not one number per '
+                                 'participant.')
+        accumulator.transactions = dict(data['transactions'])
+        accumulator.totals = dict(data['totals'])
+
+        return accumulator
+
+    def _digits(self, currency: str) -> Optional[int]:
+        """The number of minor unit digits of a currency in exact mode."""
+        if self.exact:
+            return _minor_digits(currency, self.minor_digits)
+        return None
+
+def _ranges(currencies: List[str], bounds: np.ndarray):
+    """Pairs each currency with its range of rows, see _currency_partitions."""
+    return [(c, slice(bounds[k], bounds[k + 1]))
+            for k, c in enumerate(currencies)]
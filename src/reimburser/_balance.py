@@ -0,0 +1,262 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ._money import _rescale, _split
+from ._types import Name
+
+def _participant_index(participants: Iterable[Name]) -> Dict[Name, int]:
+    """Maps each participant's name to an integer id.
+
+    The ids follow the iteration order of the participants, so the id of a
+    participant is also its position in any balance vector.
+
+    Args:
+        participants: All the participants of the trip.
+
+    Returns:
+        A dict mapping a participant's name to their id.
+    """
+    return {name: i for i, name in enumerate(participants)}
+
+def _creditor_ids(reimbursees: np.ndarray, names: List[Name]) -> np.ndarray:
+    """Looks up the id of the reimbursee of each transaction in one go.
+
+    Args:
+        reimbursees: The reimbursee of each transaction.
+        names: The participants' names, ordered by participant id.
+
+    Returns:
+        The id of each reimbursee.
+
+    Raises:
+        KeyError: A reimbursee is not a participant.
+    """
+    index: Dict[Name, int] = _participant_index(names)
+    creditors: np.ndarray = np.fromiter(
+        (index.get(reimbursee, -1) for reimbursee in reimbursees),
+        dtype=np.intp,
+        count=len(reimbursees))
+    if (creditors < 0).any():
+        raise KeyError(reimbursees[np.argmin(creditors)])
+
+    return creditors
+
+def _debtor_ids(debtors, index: Dict[Name, int]) -> List[int]:
+    """Parses a reimbursers cell into the ids of the participants who share
+    the cost.
+
+    The rules are the same as the ones used by _matrix_maker: a blank cell
+    means everyone shares the cost, a list of names means only those
+    participants share it, and names prepended with "not " are removed from
+    the list of all participants.
+
+    Args:
+        debtors: The reimbursers cell of a row, either a str or None or NaN
+            if blank.
+        index: The mapping between a participant's name and their id.
+
+    Returns:
+        The ids, in increasing order, of the participants sharing the cost,
+        which may or may not include the creditor.
+    """
+    if not isinstance(debtors, str):
+        return list(index.values())
+
+    debtor_set = set(map(str.strip, debtors.split(',')))
+    if any('not' in debtor for debtor in debtor_set):
+        false_debtors = {debtor[len('not '):].strip()
+                         for debtor in debtor_set
+                         if debtor.startswith('not ')}
+        return [i for name, i in index.items() if name not in false_debtors]
+
+    return sorted(index[debtor] for debtor in debtor_set)
+
+def _group_codes(reimbursers: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+    """Factorizes the reimbursers cells into the distinct groups they name.
+
+    Trips tend to reuse a handful of groups ("Bob, Carol", "not Alice",
+    blank) across all of their costs, so each distinct cell only needs to be
+    parsed once (see _group_members) and the rows can refer to it by code.
+
+    Args:
+        reimbursers: The reimbursers cell of each transaction, either a str
+            or None or NaN if blank.
+
+    Returns:
+        This function returns two objects: the code of each cell, -1 if
+        blank, and the distinct cells ordered by code, like pd.factorize
+        does.
+    """
+    groups: Dict[str, int] = dict()
+    codes: np.ndarray = np.fromiter(
+        (groups.setdefault(cell, len(groups)) if isinstance(cell, str) else -1
+         for cell in reimbursers),
+        dtype=np.intp,
+        count=len(reimbursers))
+
+    return codes, list(groups)
+
+def _group_members(
+        groups: List[str],
+        index: Dict[Name, int],
+        cache: Optional[Dict[Optional[str], np.ndarray]] = None
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parses each distinct reimbursers cell into the ids of the participants
+    sharing its costs.
+
+    The blank group, which everyone shares, is appended after the given
+    groups, so that the -1 code of a blank cell points to it.
+
+    Args:
+        groups: The distinct reimbursers cells, see _group_codes.
+        index: The mapping between a participant's name and their id.
+        cache: The ids of the cells parsed so far, mapping a cell (None for a
+            blank one) to its ids. The newly parsed cells are added to it.
+
+    Returns:
+        This function returns three objects: the ids of every group,
+        concatenated, the position of each group in said ids, and the
+        number of participants sharing the costs of each group (i.e. the
+        divisor of its costs).
+
+    Raises:
+        KeyError: A reimburser is not a participant.
+    """
+    if cache is None:
+        cache = dict()
+
+    members: List[np.ndarray] = list()
+    for group in [*groups, None]:
+        ids = cache.get(group)
+        if ids is None:
+            ids = np.array(_debtor_ids(group, index), dtype=np.intp)
+            cache[group] = ids
+        members.append(ids)
+
+    sizes: np.ndarray = np.fromiter(map(len, members), dtype=np.intp,
+                                    count=len(members))
+    starts: np.ndarray = np.cumsum(sizes) - sizes
+
+    return np.concatenate(members), starts, sizes
+
+def _factorize(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes an array of str as integer codes, in order of first
+    appearance, like pd.factorize does.
+
+    Args:
+        values: The array to encode, without missing values.
+
+    Returns:
+        This function returns two objects: the code of each value, and the
+        distinct values ordered by code.
+    """
+    uniques, first, codes = np.unique(values, return_index=True,
+                                      return_inverse=True)
+    order: np.ndarray = np.argsort(first)
+    ranks: np.ndarray = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+
+    return ranks[codes.ravel()], uniques[order]
+
+def _currency_partitions(
+        codes: np.ndarray,
+        num_currencies: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Partitions the rows of a ledger by currency in a single pass.
+
+    The rows are stably sorted by currency code, so the rows of the k-th
+    currency are then order[bounds[k]:bounds[k+1]], still in their original
+    order.
+
+    Args:
+        codes: The currency code of each row, see Ledger.currency.
+        num_currencies: The number of currencies.
+
+    Returns:
+        This function returns two objects: the row positions sorted by
+        currency, and the bounds of each currency in said positions.
+    """
+    order: np.ndarray = np.argsort(codes, kind='stable')
+    counts: np.ndarray = np.bincount(codes, minlength=num_currencies)
+    bounds: np.ndarray = np.concatenate(([0], np.cumsum(counts)))
+
+    return order, bounds
+
+def _array_balance_maker(
+        creditors: np.ndarray,
+        amounts: np.ndarray,
+        scale: int,
+        group_codes: np.ndarray,
+        groups: List[str],
+        rows: np.ndarray,
+        index: Dict[Name, int],
+        digits: Optional[int] = None,
+        cache: Optional[Dict[Optional[str], np.ndarray]] = None
+        ) -> np.ndarray:
+    """Computes the net balance of every participant for the given columns of
+    a cost table.
+
+    Instead of filling in a cost matrix row by row, each transaction is
+    flattened into arrays of (creditor, debtor, share) and the balances are
+    accumulated in a single batch. The creditor of a transaction is credited
+    the whole cost, while each participant sharing the cost, the creditor
+    included, is debited their share. This gives the same balance as summing
+    the rows and columns of the cost matrix built by _matrix_maker.
+
+    The reimbursers cells come factorized (see _group_codes), and each
+    distinct cell is only parsed once, so the debtors of every transaction
+    are gathered from the ids of its group without going back to the str.
+
+    If the number of minor unit digits is given, the amounts are converted to
+    integer minor units and split exactly (see _money._split), so the
+    balances are integers that sum to exactly zero.
+
+    Args:
+        creditors: The id of the reimbursee of each transaction.
+        amounts: The cost of each transaction, in units of 10 ** -scale.
+        scale: The number of decimal digits of the amounts.
+        group_codes: The code of the reimbursers cell of each transaction,
+            -1 if blank.
+        groups: The distinct reimbursers cells the codes point to.
+        rows: The row number of each transaction in the cost table.
+        index: The mapping between a participant's name and their id.
+        digits: The number of minor unit digits of the currency, or None to
+            compute the balances with floats.
+        cache: The ids of the cells parsed so far, see _group_members.
+
+    Returns:
+        The balance vector, where a positive element is a credit and a
+        negative element is a debt, ordered by participant id. The vector is
+        of int64 minor units if the number of digits is given, else of
+        floats.
+
+    Raises:
+        KeyError: A reimburser is not a participant.
+    """
+    num_participants = len(index)
+
+    members, starts, sizes = _group_members(groups, index, cache)
+    group_sizes: np.ndarray = sizes[group_codes]
+    # The debtor at position p of the flattened transactions is the
+    # (p - row_start)-th member of the group of its row.
+    row_starts: np.ndarray = np.cumsum(group_sizes) - group_sizes
+    debtors: np.ndarray = members[
+        np.repeat(starts[group_codes] - row_starts, group_sizes)
+        + np.arange(int(group_sizes.sum()))]
+
+    if digits is not None:
+        costs = _rescale(amounts, scale, digits)
+        shares = _split(costs, group_sizes, rows)
+        balance = np.zeros(num_participants, dtype=np.int64)
+        np.add.at(balance, creditors, costs)
+        np.subtract.at(balance, debtors, shares)
+        return balance
+
+    costs = amounts / 10.0 ** scale
+    shares = np.repeat(costs / group_sizes, group_sizes)
+
+    credits = np.bincount(creditors, weights=costs,
+                          minlength=num_participants)
+    debts = np.bincount(debtors, weights=shares, minlength=num_participants)
+
+    return credits - debts
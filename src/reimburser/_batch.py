@@ -0,0 +1,209 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from . import _metrics
+from ._errors import FieldError, FileFormatError
+from ._types import FilePath
+from .reimburser import Reimburser
+
+class Trip(NamedTuple):
+    """A trip listed in a batch manifest."""
+    title: str
+    participants_file: FilePath
+    costs_file: FilePath
+    primary_currency: str
+    reimbursements_file: FilePath
+
+class TripResult(NamedTuple):
+    """The outcome of settling a trip of a batch."""
+    title: str
+    rows: int
+    reimbursements: int
+    seconds: float
+    error: Optional[str] = None
+
+def _manifest_reader(
+        manifest_file: FilePath,
+        primary_currency: str = 'USD') -> List[Trip]:
+    """Reads a csv file listing the trips of a batch.
+
+    Each row of the manifest is a trip, given either by a "trip" directory
+    holding a participants.csv and a costs.csv, or by the "participants" and
+    "costs" files themselves. The optional columns "title", "currency" and
+    "output" give the title of the trip, its primary currency and the csv
+    file its reimbursements are written to (by default, reimbursements.csv
+    next to the costs file). Relative paths are relative to the manifest.
+
+    Args:
+        manifest_file: The csv file listing the trips.
+        primary_currency: The primary currency of the trips that don't
+            specify one.
+
+    Returns:
+        The list of trips.
+
+    Raises:
+        FieldError: The manifest has neither a trip column nor participants
+            and costs columns.
+        FileFormatError: The manifest is not formatted as a csv.
+    """
+    if not manifest_file.endswith('.csv'):
+        raise FileFormatError('The input file is not formatted as a csv.')
+    root: str = os.path.dirname(os.path.abspath(manifest_file))
+
+    def resolve(path: str) -> FilePath:
+        return FilePath(os.path.join(root, path.strip()))
+
+    trips = list()
+    with open(manifest_file, newline='') as csv_f:
+        csv_reader = csv.DictReader(csv_f)
+        csv_reader.fieldnames = [field.strip().lower()
+                                 for field in csv_reader.fieldnames or []]
+        fields = set(csv_reader.fieldnames)
+        if 'trip' not in fields and not {'participants', 'costs'} <= fields:
+            raise FieldError('The manifest is missing required columns.')
+
+        for row in csv_reader:
+            if row.get('trip'):
+                trip_dir: FilePath = resolve(row['trip'])
+                participants_file = os.path.join(trip_dir, 'participants.csv')
+                costs_file = os.path.join(trip_dir, 'costs.csv')
+            else:
+                participants_file = resolve(row['participants'])
+                costs_file = resolve(row['costs'])
+
+            if row.get('output'):
+                reimbursements_file = resolve(row['output'])
+            else:
+                reimbursements_file = os.path.join(
+                    os.path.dirname(costs_file),
+                    'reimbursements.csv')
+            title: str = row.get('title') \
+                or os.path.basename(os.path.dirname(costs_file))
+
+            trips.append(Trip(
+                title.strip(),
+                participants_file,
+                costs_file,
+                (row.get('currency') or primary_currency).strip(),
+                reimbursements_file))
+
+    return trips
+
+def _batch_trip(
+        trip: Trip,
+        exact: bool = False,
+        settle: str = 'greedy',
+        cache_dir: Optional[FilePath] = None,
+        csv_engine: str = 'c') -> TripResult:
+    """Settles a single trip of a batch and writes its reimbursements.
+
+    Any error is caught and reported in the result, so that one faulty trip
+    doesn't take the rest of the batch down with it.
+
+    Args:
+        trip: The trip to settle.
+        exact: Whether to compute the reimbursements in integer minor units.
+        settle: How to settle each currency, either greedy or optimal.
+        cache_dir: The directory the trips are cached in, if any.
+        csv_engine: The parser large costs files are read with, either c or
+            pyarrow.
+
+    Returns:
+        The outcome of settling the trip.
+    """
+    start: float = time.perf_counter()
+    try:
+        reimburser = Reimburser(
+            trip.participants_file,
+            trip.costs_file,
+            trip.title,
+            trip.primary_currency,
+            exact,
+            settle=settle,
+            cache_dir=cache_dir,
+            csv_engine=csv_engine)
+        reimbursements: int = reimburser.write_reimbursements(
+            trip.reimbursements_file)
+    except Exception as e:
+        return TripResult(trip.title, 0, 0, time.perf_counter() - start,
+                          f'{type(e).__name__}: {e}')
+
+    return TripResult(
+        trip.title,
+        reimburser.rows,
+        reimbursements,
+        time.perf_counter() - start)
+
+def _run_batch(
+        trips: List[Trip],
+        jobs: Optional[int] = None,
+        exact: bool = False,
+        settle: str = 'greedy',
+        cache_dir: Optional[FilePath] = None,
+        csv_engine: str = 'c') -> List[TripResult]:
+    """Settles all the trips of a batch in a pool of worker processes.
+
+    Args:
+        trips: The trips to settle.
+        jobs: The number of worker processes, defaults to the number of
+            CPUs. With 1, the trips are settled in this process.
+        exact: Whether to compute the reimbursements in integer minor units.
+        settle: How to settle each currency, either greedy or optimal.
+        cache_dir: The directory the trips are cached in, if any.
+        csv_engine: The parser large costs files are read with, either c or
+            pyarrow.
+
+    Returns:
+        The outcome of each trip, in the order of the trips.
+    """
+    if jobs == 1:
+        return [_batch_trip(trip, exact, settle, cache_dir, csv_engine)
+                for trip in trips]
+
+    results = list()
+    with ProcessPoolExecutor(jobs) as executor:
+        # The metrics of each trip are handed back along with its result.
+        futures = [executor.submit(_metrics.collected, _metrics.active(),
+                                   _batch_trip, trip, exact, settle,
+                                   cache_dir, csv_engine)
+                   for trip in trips]
+        for trip, future in zip(trips, futures):
+            try:
+                result, metrics = future.result()
+                results.append(result)
+                _metrics.merge(metrics)
+            except Exception as e:
+                # e.g. a worker process died
+                results.append(TripResult(trip.title, 0, 0, 0.0,
+                                          f'{type(e).__name__}: {e}'))
+
+    return results
+
+def _batch_summary(results: List[TripResult], seconds: float) -> str:
+    """Writes the throughput summary of a batch.
+
+    Args:
+        results: The outcome of each trip.
+        seconds: The wall time of the whole batch.
+
+    Returns:
+        The summary, with one line per failed trip.
+    """
+    failures: List[TripResult] = [r for r in results if r.error is not None]
+    settled: int = len(results) - len(failures)
+    rows: int = sum(r.rows for r in results)
+    reimbursements: int = sum(r.reimbursements for r in results)
+    seconds = max(seconds, 1e-9)
+
+    summary: str = f'Settled {settled} of {len(results)} trips ' \
+        + f'({len(failures)} failed) in {seconds:.2f} s: ' \
+        + f'{settled / seconds:.1f} trips/s, {rows / seconds:.0f} rows/s, ' \
+        + f'{reimbursements} reimbursements.'
+    for failure in failures:
+        summary += f'\n\t{failure.title} | {failure.error}'
+
+    return summary
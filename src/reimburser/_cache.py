@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from . import _metrics
+from ._ledger import Ledger
+from ._settlement import Settlement, Transfer
+from ._types import Email, FilePath, Name
+
+# Bumped whenever reading the costs or settling them changes, so that the
+# entries written by an older version are never read (they age out).
+CACHE_VERSION = 1
+# The entries beyond this size in total, or this old, are evicted.
+DEFAULT_MAX_BYTES = 256 << 20
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+# The ledger columns kept as .npy files, which are memory-mapped when read.
+_LEDGER_ARRAYS = ('reimbursee', 'amount', 'currency', 'reimbursers', 'rows')
+_SETTLEMENT_ARRAYS = ('debtors', 'creditors', 'amounts')
+
+class CachedTrip(NamedTuple):
+    """A trip read from the cache."""
+    emails: Dict[Name, Email]
+    ledger: Ledger
+    settlements: Dict[str, Settlement]
+
+def default_cache_dir() -> FilePath:
+    """The directory the cache is kept in by default, ~/.cache/reimburser
+    (or $XDG_CACHE_HOME/reimburser)."""
+    root = os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return FilePath(os.path.join(root, 'reimburser'))
+
+class TripCache:
+    """An on-disk cache of parsed ledgers and their settlements.
+
+    Each entry is addressed by a hash of everything the settlements depend
+    on: the content of the participants and costs files, the settings and
+    the cache version. An edited file (or a different setting) therefore
+    never hits a stale entry, whatever its name or modification time.
+
+    An entry is a directory holding the ledger columns and the transfers as
+    .npy files, which are memory-mapped when read, and the str tables in a
+    json file. Entries are written to a temporary directory first and
+    renamed into place, so a reader never sees half an entry. Every write
+    evicts the entries older than max_age, then the least recently used
+    ones until the cache fits in max_bytes.
+
+    Attributes:
+        directory: The directory the entries are kept in.
+        max_bytes: The most bytes the entries take up in total.
+        max_age: The most seconds an entry is kept since it was last used.
+        key: Hashes the files and settings of a trip.
+        load: Reads a trip from the cache.
+        store: Writes a trip into the cache.
+        prune: Evicts the entries that are too old or too many.
+    """
+    def __init__(
+            self,
+            directory: Optional[FilePath] = None,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            max_age: float = DEFAULT_MAX_AGE):
+        """Initializes TripCache.
+
+        Args:
+            directory: The directory to keep the entries in, created if need
+                be, by default ~/.cache/reimburser.
+            max_bytes: The most bytes the entries take up in total.
+            max_age: The most seconds an entry is kept since it was last
+                used.
+        """
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(
+            participants_file: FilePath,
+            costs_file: FilePath,
+            primary_currency: str,
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            settle: str = 'greedy') -> str:
+        """Hashes the files and settings of a trip.
+
+        Args:
+            participants_file: The csv file listing the participants.
+            costs_file: The csv file listing the costs.
+            primary_currency: The primary currency used during the trip.
+            exact: Whether the reimbursements are in integer minor units.
+            minor_digits: Overrides of the number of minor unit digits.
+            settle: How each currency is settled.
+
+        Returns:
+            The hex digest addressing the entry of the trip.
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps({
+            'version': CACHE_VERSION,
+            'primary_currency': primary_currency,
+            'exact': exact,
+            'minor_digits': minor_digits,
+            'settle': settle,
+        }, sort_keys=True).encode())
+        for path in (participants_file, costs_file):
+            with open(path, 'rb') as f:
+                # The size goes first, so that the boundary between the two
+                # files can't be shifted.
+                digest.update(os.fstat(f.fileno()).st_size.to_bytes(8, 'big'))
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+
+        return digest.hexdigest()
+
+    def load(self, key: str) -> Optional[CachedTrip]:
+        """Reads a trip from the cache.
+
+        Args:
+            key: The key of the trip, see key.
+
+        Returns:
+            The trip, or None if it isn't cached (or its entry is unreadable,
+            in which case the entry is dropped).
+        """
+        entry: str = os.path.join(self.directory, key)
+        if not os.path.isdir(entry):
+            _metrics.count('cache_misses')
+            return None
+
+        try:
+            with _metrics.timer('cache'):
+                trip: CachedTrip = _read_entry(entry)
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(entry, ignore_errors=True)
+            _metrics.count('cache_misses')
+            return None
+
+        # The modification time of an entry is when it was last used.
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        _metrics.count('cache_hits')
+
+        return trip
+
+    def store(
+            self,
+            key: str,
+            emails: Dict[Name, Email],
+            ledger: Ledger,
+            settlements: Dict[str, Settlement]) -> None:
+        """Writes a trip into the cache, then evicts what needs to be.
+
+        Args:
+            key: The key of the trip, see key.
+            emails: The participants' emails.
+            ledger: The ledger of the trip.
+            settlements: The settlement of each currency.
+        """
+        entry: str = os.path.join(self.directory, key)
+        with _metrics.timer('cache'):
+            temp_entry: str = tempfile.mkdtemp(prefix=f'.{key}.',
+                                               dir=self.directory)
+            try:
+                _write_entry(temp_entry, emails, ledger, settlements)
+                os.rename(temp_entry, entry)
+            except (OSError, TypeError, ValueError):
+                # e.g. another process just wrote the same entry, or the
+                # notes aren't all str and numbers.
+                shutil.rmtree(temp_entry, ignore_errors=True)
+
+            self.prune()
+
+    def prune(self) -> None:
+        """Evicts the entries that are too old, then the least recently used
+        ones until the entries fit in max_bytes."""
+        now: float = time.time()
+        entries = list()
+        for name in os.listdir(self.directory):
+            path: str = os.path.join(self.directory, name)
+            try:
+                used: float = os.stat(path).st_mtime
+                size: int = sum(
+                    os.path.getsize(os.path.join(path, f))
+                    for f in os.listdir(path))
+            except OSError:
+                continue
+            if name.startswith('.'):
+                # The temporary directory of a write, left alone while it
+                # may still be under way.
+                if now - used > 60 * 60:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            entries.append((used, size, path))
+
+        entries.sort()
+        total: int = sum(size for _, size, _ in entries)
+        for used, size, path in entries:
+            if now - used <= self.max_age and total <= self.max_bytes:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            _metrics.count('cache_evictions')
+
+def _write_entry(
+        entry: str,
+        emails: Dict[Name, Email],
+        ledger: Ledger,
+        settlements: Dict[str, Settlement]) -> None:
+    """Writes the files of a cache entry into a directory."""
+    for name in _LEDGER_ARRAYS:
+        np.save(os.path.join(entry, f'{name}.npy'), getattr(ledger, name))
+
+    currencies: List[str] = list(settlements)
+    for name in _SETTLEMENT_ARRAYS:
+        np.save(os.path.join(entry, f'{name}.npy'), np.concatenate(
+            [getattr(settlements[c], name) for c in currencies]
+            or [np.empty(0)]))
+
+    tables = {
+        'emails': emails,
+        'names': ledger.names,
+        'currencies': ledger.currencies,
+        'groups': ledger.groups,
+        'scale': ledger.scale,
+        'notes': None if ledger.notes is None else ledger.notes.tolist(),
+        'settlements': [
+            {'currency': c,
+             'transfers': len(settlements[c]),
+             'digits': settlements[c].digits}
+            for c in currencies],
+    }
+    with open(os.path.join(entry, 'tables.json'), 'w') as f:
+        json.dump(tables, f)
+
+def _read_entry(entry: str) -> CachedTrip:
+    """Reads the files of a cache entry."""
+    with open(os.path.join(entry, 'tables.json')) as f:
+        tables: Dict = json.load(f)
+    arrays = {name: np.load(os.path.join(entry, f'{name}.npy'),
+                            mmap_mode='r')
+              for name in _LEDGER_ARRAYS + _SETTLEMENT_ARRAYS}
+
+    names: List[Name] = tables['names']
+    notes: Optional[np.ndarray] = None
+    if tables['notes'] is not None:
+        notes = np.empty(len(tables['notes']), dtype=object)
+        notes[:] = tables['notes']
+    ledger = Ledger(
+        names,
+        tables['currencies'],
+        tables['groups'],
+        arrays['reimbursee'],
+        arrays['amount'],
+        tables['scale'],
+        arrays['currency'],
+        arrays['reimbursers'],
+        arrays['rows'],
+        notes)
+
+    settlements = dict()
+    start = 0
+    for settlement in tables['settlements']:
+        stop: int = start + settlement['transfers']
+        transfers: List[Transfer] = [
+            Transfer(debtor, creditor, amount)
+            for debtor, creditor, amount in zip(
+                arrays['debtors'][start:stop].tolist(),
+                arrays['creditors'][start:stop].tolist(),
+                arrays['amounts'][start:stop].tolist())]
+        settlements[settlement['currency']] = Settlement(
+            settlement['currency'],
+            names,
+            transfers,
+            settlement['digits'])
+        start = stop
+
+    return CachedTrip(tables['emails'], ledger, settlements)
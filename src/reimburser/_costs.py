@@ -0,0 +1,562 @@
+import codecs
+import csv
+import io
+import itertools
+import math
+from contextlib import contextmanager
+from typing import (
+    IO, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional,
+    Sequence, Tuple, Union)
+
+import numpy as np
+
+from . import _metrics
+from ._errors import FieldError, FileFormatError, RowError
+from ._lazy import pd
+from ._ledger import Ledger
+from ._types import FilePath, Name, Table
+
+# The cells pd.read_csv reads as missing by default, so that both readers
+# agree on what a blank cell is.
+NA_VALUES = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan',
+    'null',
+})
+
+# Costs files up to this size are read with the csv module rather than with
+# pandas, which takes longer to import than such files take to read.
+CORE_MAX_BYTES = 1 << 20
+
+# The parsers pandas can read the larger costs files with. pyarrow parses on
+# several threads, but is only there if it is installed.
+CSV_ENGINES = ('c', 'pyarrow')
+
+class Column(NamedTuple):
+    """A column of the costs file."""
+    name: str
+    dtype: str
+    required: bool
+
+# The columns read from the costs file, in the order of the cost table. Any
+# other column is left out of the reading altogether. The reimbursees and
+# currency codes are read as categoricals, whose codes Ledger.from_frame then
+# takes as they are. The reimbursers cells aren't, as a categorical sorts its
+# categories, and a large trip can have thousands of distinct cells.
+COSTS_SCHEMA: Tuple[Column, ...] = (
+    Column('reimbursee', 'category', True),
+    Column('cost', 'float64', True),
+    Column('currency', 'category', False),
+    Column('reimbursers', 'object', True),
+    Column('notes', 'object', False),
+)
+
+def _costs_header(costs_file: FilePath) -> List[str]:
+    """Reads the header of the costs file, see _validate_header.
+
+    Raises:
+        FieldError: The costs file is missing required columns.
+    """
+    with open(costs_file, newline='') as csv_f:
+        return _validate_header(next(csv.reader(csv_f), []))
+
+def _validate_header(header: List[str]) -> List[str]:
+    """Checks a header of the costs file against COSTS_SCHEMA.
+
+    Args:
+        header: The fields of the first line of the costs file.
+
+    Returns:
+        The lowercased header, with the blank fields named as pandas does.
+
+    Raises:
+        FieldError: The costs file is missing required columns.
+    """
+    header = [field.lower() or f'unnamed: {k}'
+              for k, field in enumerate(header)]
+    missing: List[str] = [column.name for column in COSTS_SCHEMA
+                          if column.required and column.name not in header]
+    if missing:
+        raise FieldError('The input table is missing required columns: '
+                         f'{", ".join(missing)}.')
+
+    return header
+
+def _read_options(header: List[str], engine: str = 'c') -> Dict:
+    """The options of pd.read_csv reading only the columns of COSTS_SCHEMA,
+    with their dtypes and lowercased names.
+
+    Args:
+        header: The header of the costs file, see _validate_header.
+        engine: The parser used by pandas, see CSV_ENGINES.
+
+    Returns:
+        The keyword arguments of pd.read_csv, for a costs file starting with
+        its header.
+    """
+    columns: List[Column] = [column for column in COSTS_SCHEMA
+                             if column.name in header]
+    options = {
+        'names': header,
+        'dtype': {column.name: column.dtype for column in columns},
+        'engine': engine,
+    }
+    if engine == 'pyarrow':
+        # pyarrow only picks the columns by their names in the file, so it
+        # reads them all, named after the header by pandas. It also skips
+        # blank lines, as the c parser does.
+        options.update(header=None, skiprows=1)
+    else:
+        options.update(header=0, usecols=[column.name for column in columns])
+
+    return options
+
+def _malformed_row(
+        costs_file: FilePath,
+        header: List[str],
+        start: int = 0) -> Optional[RowError]:
+    """Looks for the first malformed row of the costs file.
+
+    The readers parse all the rows in one go, and only fall back on this once
+    they have failed (see _row_errors), so that the rows are never checked
+    one at a time unless one of them is malformed.
+
+    Args:
+        costs_file: The csv file listing the trip costs information.
+        header: The header of the costs file, see _validate_header.
+        start: The byte to start looking from, 0 to look past the header.
+
+    Returns:
+        The error pointing at the line of the malformed row, or None if there
+        is none.
+    """
+    k: int = header.index('cost')
+    with open(costs_file, 'rb') as f:
+        # The lines before start are only counted.
+        lines = 0
+        while f.tell() < start:
+            block: bytes = f.read(min(1 << 20, start - f.tell()))
+            if not block:
+                break
+            lines += block.count(b'\n')
+
+        csv_reader = csv.reader(io.TextIOWrapper(f, newline=''))
+        if start == 0:
+            next(csv_reader, None)
+        # A row is pointed at by the line it starts on, which is only
+        # different from csv_reader.line_num (the line it ends on) if a
+        # quoted field spans several lines.
+        end: int = csv_reader.line_num
+        for row in csv_reader:
+            row_start, end = end + 1, csv_reader.line_num
+            if not row:
+                continue
+            problem: Optional[str] = _cost_problem(row[k] if k < len(row)
+                                                   else '')
+            if problem is not None:
+                return RowError(costs_file, lines + row_start, problem)
+
+    return None
+
+@contextmanager
+def _row_errors(
+        costs_file: FilePath,
+        header: List[str],
+        start: int = 0) -> Iterator[None]:
+    """Turns the errors raised while reading a malformed row of the costs
+    file into a RowError pointing at its line.
+
+    Args:
+        costs_file: The csv file listing the trip costs information.
+        header: The header of the costs file, see _validate_header.
+        start: The byte the rows being read start from.
+
+    Raises:
+        RowError: A row of the costs file is malformed.
+    """
+    try:
+        yield
+    except ValueError as error:
+        row_error: Optional[RowError] = _malformed_row(costs_file, header,
+                                                       start)
+        if row_error is None:
+            raise
+        raise row_error from error
+
+def _costs_ledger_reader(
+        costs_file: FilePath,
+        primary_currency: str,
+        names: List[Name]) -> Ledger:
+    """Reads the costs file into a ledger with the csv module.
+
+    This is the pandas-free counterpart of _costs_table_reader, meant for
+    small costs files.
+
+    Args:
+        costs_file: the csv file listing the trip costs information.
+        primary_currency: the primary currency used on the trip
+        names: the participants' names, ordered by id
+
+    Returns:
+        The ledger of the costs.
+
+    Raises:
+        FieldError: The input table is missing required columns.
+        FileFormatError: The input file is not formatted as a csv.
+        KeyError: A reimbursee is not a participant.
+        RowError: A cost is missing or not a number.
+    """
+    if not costs_file.endswith('.csv'):
+        raise FileFormatError('The input file is not formatted as a csv.')
+
+    with _metrics.timer('read'):
+        ledger: Ledger = _ledger_reader(costs_file, primary_currency, names)
+    _metrics.count('rows_parsed', len(ledger))
+
+    return ledger
+
+def _ledger_reader(
+        costs_file: FilePath,
+        primary_currency: str,
+        names: List[Name]) -> Ledger:
+    """Does the actual reading of _costs_ledger_reader."""
+    with open(costs_file, newline='') as csv_f:
+        csv_reader = csv.reader(csv_f)
+        header: List[str] = _validate_header(next(csv_reader, []))
+        # Blank lines are skipped, as pd.read_csv does.
+        table: List[List[str]] = [row for row in csv_reader if row]
+
+    with _row_errors(costs_file, header):
+        return _rows_ledger(header, table, primary_currency, names)
+
+def _rows_ledger(
+        header: List[str],
+        table: List[Sequence],
+        primary_currency: str,
+        names: List[Name]) -> Ledger:
+    """Encodes the rows of a costs file (or records) into a ledger.
+
+    Args:
+        header: The header of the rows, see _validate_header.
+        table: The rows, whose blank cells are either in NA_VALUES or None.
+        primary_currency: The primary currency used on the trip.
+        names: The participants' names, ordered by id.
+
+    Returns:
+        The ledger of the costs.
+
+    Raises:
+        KeyError: A reimbursee is not a participant.
+        ValueError: A cost is missing or not a number.
+    """
+    def column(name: str) -> List[Optional[str]]:
+        k = header.index(name)
+        return [row[k] if k < len(row) and row[k] not in NA_VALUES else None
+                for row in table]
+
+    if 'currency' in header:
+        currencies = [c or primary_currency for c in column('currency')]
+    else:
+        currencies = [primary_currency] * len(table)
+    notes: Optional[np.ndarray] = None
+    if 'notes' in header:
+        notes = np.array([n or '' for n in column('notes')], dtype=object)
+
+    return Ledger.from_columns(
+        names,
+        np.array(column('reimbursee'), dtype=object),
+        np.array([np.nan if c is None else float(c)
+                  for c in column('cost')], dtype=float),
+        np.array(currencies, dtype=object),
+        np.array(column('reimbursers'), dtype=object),
+        notes=notes)
+
+def _costs_records_reader(
+        records: Union[Iterable, IO],
+        primary_currency: str,
+        names: List[Name],
+        columns: Optional[Sequence[str]] = None) -> Ledger:
+    """Reads costs held in memory, or streamed in csv, into a ledger.
+
+    The records go through the same steps as the rows of a small costs file
+    (see _costs_ledger_reader), without ever being written to a file.
+
+    Args:
+        records: Either a csv stream (text or binary) laid out like the costs
+            file, an iterable of dicts keyed by column name, or an iterable
+            of sequences whose first one is the header, unless columns is
+            given. Blank cells may also be None or NaN.
+        primary_currency: the primary currency used on the trip
+        names: the participants' names, ordered by id
+        columns: the names of the columns of sequence records, if the first
+            record isn't the header
+
+    Returns:
+        The ledger of the costs.
+
+    Raises:
+        FieldError: The records are missing required columns.
+        KeyError: A reimbursee is not a participant.
+        RowError: A cost is missing or not a number.
+    """
+    with _metrics.timer('read'):
+        # Where each row of the table came from, for the error messages: the
+        # line of the stream, or the position of the record (counting the
+        # header, if it is the first record).
+        lines: List[int] = list()
+        table: List[Sequence] = list()
+        if hasattr(records, 'read'):
+            source: str = getattr(records, 'name', '<stream>')
+            unit = 'Line'
+            csv_reader = csv.reader(_csv_lines(records))
+            header: List[str] = _validate_header(next(csv_reader, []))
+            # Each row is pointed at by the line it starts on, see
+            # _malformed_row.
+            end: int = csv_reader.line_num
+            for row in csv_reader:
+                line, end = end + 1, csv_reader.line_num
+                if row:
+                    table.append(row)
+                    lines.append(line)
+        else:
+            source = '<records>'
+            unit = 'Record'
+            rows: Iterator = iter(records)
+            first = next(rows, None)
+            start = 1
+            if isinstance(first, Mapping):
+                keys: List = list(first)
+                header = _validate_header(list(map(str, keys)))
+                rows = ([record.get(key) for key in keys]
+                        for record in itertools.chain([first], rows))
+            elif columns is not None:
+                header = _validate_header(list(columns))
+                rows = itertools.chain([] if first is None else [first], rows)
+            else:
+                header = _validate_header(list(first or []))
+                start = 2
+            for line, row in enumerate(rows, start):
+                if len(row):
+                    # NaN stands for a blank cell too, as in a DataFrame.
+                    table.append([None if value != value else value
+                                  for value in row])
+                    lines.append(line)
+
+        try:
+            ledger: Ledger = _rows_ledger(header, table, primary_currency,
+                                          names)
+        except (TypeError, ValueError) as error:
+            k: int = header.index('cost')
+            for i, row in enumerate(table):
+                problem: Optional[str] = _cost_problem(
+                    row[k] if k < len(row) else None)
+                if problem is not None:
+                    raise RowError(source, lines[i], problem,
+                                   unit) from error
+            raise
+    _metrics.count('rows_parsed', len(ledger))
+
+    return ledger
+
+def _csv_lines(stream: IO) -> Iterable[str]:
+    """The lines of a csv stream, decoded from UTF-8 if it is binary."""
+    if isinstance(stream.read(0), bytes):
+        return codecs.iterdecode(stream, 'utf-8')
+    return stream
+
+def _cost_problem(cell) -> Optional[str]:
+    """What is wrong with a cost cell, if anything.
+
+    Args:
+        cell: The cost cell, either a str or a number, None if blank.
+
+    Returns:
+        The problem, as worded in a RowError, or None if the cost is fine.
+    """
+    if cell is None or cell in NA_VALUES:
+        return 'the cost is missing'
+    try:
+        if math.isfinite(float(cell)):
+            return None
+    except (TypeError, ValueError):
+        pass
+
+    return f'the cost {cell!r} is not a number'
+
+def _costs_table_reader(
+        costs_file: FilePath,
+        primary_currency: str,
+        engine: str = 'c') -> Table:
+    """Reads the costs file into the cost table.
+
+    The header is checked before anything else is read, and only the columns
+    of COSTS_SCHEMA are then parsed, with their dtypes.
+
+    Args:
+        costs_file: the csv file listing the trip costs information.
+        primary_currency: the primary currency used on the trip
+        engine: the parser used by pandas, see CSV_ENGINES
+
+    Returns:
+        The cost table, with the columns [reimbursee, cost, currency,
+        reimbursers(, notes)] lowercased, indexed by row number.
+
+    Raises:
+        FieldError: The input table is missing required columns.
+        FileFormatError: The input file is not formatted as a csv.
+        RowError: A cost is missing or not a number.
+    """
+    if not costs_file.endswith('.csv'):
+        raise FileFormatError('The input file is not formatted as a csv.')
+
+    header: List[str] = _costs_header(costs_file)
+    with _metrics.timer('read'), _row_errors(costs_file, header):
+        table: Table = pd.read_csv(costs_file,
+                                   **_read_options(header, engine))
+        if engine == 'pyarrow':
+            table = _blank_na_values(table)
+        table = _costs_table_cleaner(table, primary_currency)
+    _metrics.count('rows_parsed', len(table))
+
+    return table
+
+def _blank_na_values(table: Table) -> Table:
+    """Makes the cells of NA_VALUES missing in a cost table that wasn't read
+    by the c parser, i.e. read by pyarrow (which only does so in number
+    columns) or built in memory."""
+    na_values: List[str] = list(NA_VALUES)
+    for column in COSTS_SCHEMA:
+        if column.name not in table:
+            continue
+        values = table[column.name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories
+            table[column.name] = values.cat.remove_categories(
+                categories[categories.isin(na_values)])
+        elif values.dtype == object:
+            table[column.name] = values.mask(values.isin(na_values))
+
+    return table
+
+def _costs_frame_reader(costs, primary_currency: str) -> Table:
+    """Reads a cost table held in memory, as _costs_table_reader reads the
+    costs file.
+
+    Args:
+        costs: A pandas DataFrame with the columns of the costs file (in any
+            case), or anything pd.DataFrame takes as such, e.g. a structured
+            NumPy array or a dict of arrays.
+        primary_currency: the primary currency used on the trip
+
+    Returns:
+        The cost table, see _costs_table_reader, indexed by position.
+
+    Raises:
+        FieldError: The table is missing required columns.
+        RowError: A cost is missing or not a number.
+    """
+    with _metrics.timer('read'):
+        if not isinstance(costs, pd.DataFrame):
+            costs = pd.DataFrame(costs)
+        header: List[str] = _validate_header(list(map(str, costs.columns)))
+        positions: List[int] = [header.index(column.name)
+                                for column in COSTS_SCHEMA
+                                if column.name in header]
+        # The columns are taken rather than renamed in place, so that the
+        # caller's table is left as it is.
+        table: Table = costs.take(positions, axis=1)
+        table.columns = [header[k] for k in positions]
+        table = _blank_na_values(table)
+        try:
+            table = _costs_table_cleaner(
+                table.astype({column.name: column.dtype
+                              for column in COSTS_SCHEMA
+                              if column.name in table}),
+                primary_currency)
+        except (TypeError, ValueError) as error:
+            for label, cell in zip(table.index, table['cost']):
+                problem: Optional[str] = _cost_problem(
+                    None if cell != cell else cell)
+                if problem is not None:
+                    raise RowError('<frame>', label, problem,
+                                   'Row') from error
+            raise
+        table.index = pd.RangeIndex(len(table))
+    _metrics.count('rows_parsed', len(table))
+
+    return table
+
+def _costs_chunks_reader(
+        costs_file: FilePath,
+        primary_currency: str,
+        chunksize: int) -> Iterator[Table]:
+    """Reads the costs file into the cost table, chunksize rows at a time.
+
+    The index of each chunk carries on from the previous one, so it is still
+    the row number of each cost.
+
+    Args:
+        costs_file: the csv file listing the trip costs information.
+        primary_currency: the primary currency used on the trip
+        chunksize: the number of rows read at a time
+
+    Yields:
+        The chunks of the cost table, see _costs_table_reader.
+
+    Raises:
+        FieldError: The input table is missing required columns.
+        FileFormatError: The input file is not formatted as a csv.
+        RowError: A cost is missing or not a number.
+    """
+    if not costs_file.endswith('.csv'):
+        raise FileFormatError('The input file is not formatted as a csv.')
+
+    header: List[str] = _costs_header(costs_file)
+    # Only the c parser reads in chunks.
+    chunks = iter(pd.read_csv(costs_file, chunksize=chunksize,
+                              **_read_options(header)))
+    while True:
+        # Only the reading is timed, not what is done with each chunk.
+        with _metrics.timer('read'), _row_errors(costs_file, header):
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            chunk = _costs_table_cleaner(chunk, primary_currency)
+        _metrics.count('rows_parsed', len(chunk))
+        yield chunk
+
+def _costs_table_cleaner(table: Table, primary_currency: str) -> Table:
+    """Fills in the blanks of a cost table (or chunk of it) read with
+    _read_options.
+
+    Args:
+        table: the cost table as read from the costs file.
+        primary_currency: the primary currency used on the trip
+
+    Returns:
+        The cost table, see _costs_table_reader.
+
+    Raises:
+        ValueError: A cost is missing.
+    """
+    cost: np.ndarray = table['cost'].to_numpy(dtype=float)
+    finite: np.ndarray = np.isfinite(cost)
+    if not finite.all():
+        raise ValueError(
+            f'The cost of row {table.index[np.argmin(finite)]} is missing.')
+
+    if 'currency' not in table:
+        table['currency'] = pd.Categorical.from_codes(
+            np.zeros(len(table), dtype=np.int8),
+            [primary_currency])
+    elif table['currency'].hasnans:
+        currency = table['currency']
+        if primary_currency not in currency.cat.categories:
+            currency = currency.cat.add_categories([primary_currency])
+        table['currency'] = currency.fillna(primary_currency)
+
+    if 'notes' in table:
+        table.fillna(value={'notes': ''}, inplace=True)
+
+    return table[[column.name for column in COSTS_SCHEMA
+                  if column.name in table]]
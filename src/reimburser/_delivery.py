@@ -0,0 +1,362 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from smtplib import (SMTP, SMTPAuthenticationError, SMTPException,
+                     SMTPRecipientsRefused, SMTPResponseException,
+                     SMTPServerDisconnected)
+from typing import (Callable, Dict, Iterable, List, NamedTuple, Optional,
+                    Tuple)
+
+from . import _metrics
+from ._types import Name
+
+class DeliveryReport(NamedTuple):
+    """The outcome of delivering the email of a participant."""
+    recipient: Name
+    email: str
+    sent: bool
+    attempts: int
+    error: Optional[str] = None
+
+class RateLimiter:
+    """Spaces out events so that no more than rate of them happen per second.
+
+    The limiter is thread-safe: concurrent callers are queued one after the
+    other.
+    """
+    def __init__(self, rate: Optional[float]):
+        """Initializes RateLimiter.
+
+        Args:
+            rate: The maximum number of events per second, or None for no
+                limit.
+        """
+        self.interval: float = 1.0 / rate if rate else 0.0
+        self._next: float = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocks until the next event is allowed."""
+        if not self.interval:
+            return
+
+        with self._lock:
+            now: float = time.monotonic()
+            slot: float = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class SMTPPool:
+    """A pool of authenticated connections to a single SMTP server.
+
+    Connections are opened lazily, up to the size of the pool, and reused
+    from one message to the next. A connection that fails is dropped rather
+    than returned to the pool. Once a login is turned down, no other is
+    attempted. Messages sent through the pool are subject to the rate limit
+    of the server.
+
+    Attributes:
+        send_message: Sends a message over one of the connections.
+        close: Closes all the connections.
+    """
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            sender_email: str,
+            password: str,
+            size: int = 4,
+            rate_limit: Optional[float] = None,
+            starttls: bool = True,
+            smtp_factory: Callable[..., SMTP] = SMTP):
+        """Initializes SMTPPool.
+
+        Args:
+            host: The SMTP server.
+            port: The port of the SMTP server.
+            sender_email: The email account to log in with.
+            password: The password of said email account.
+            size: The maximum number of connections open at once.
+            rate_limit: The maximum number of messages sent per second, or
+                None for no limit.
+            starttls: Whether to upgrade the connections with STARTTLS.
+            smtp_factory: Opens a connection given (host, port), which is
+                where a stand-in SMTP client can be plugged in.
+        """
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self._sender_email = sender_email
+        self._password = password
+        self._smtp_factory = smtp_factory
+        self._limiter = RateLimiter(rate_limit)
+
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        # One token per connection that may still be opened.
+        self._slots = threading.BoundedSemaphore(size)
+        self._connections: List[SMTP] = list()
+        self._lock = threading.Lock()
+        self._login_error: Optional[SMTPAuthenticationError] = None
+
+    def __enter__(self) -> 'SMTPPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def send_message(self, msg: Message) -> None:
+        """Sends a message over one of the connections.
+
+        Args:
+            msg: The message, with its From and To headers set.
+
+        Raises:
+            SMTPAuthenticationError: The login was turned down, now or for an
+                earlier connection.
+            SMTPException: The message could not be sent.
+            OSError: The connection failed.
+        """
+        self._limiter.wait()
+        server: SMTP = self._acquire()
+        start: float = time.perf_counter()
+        try:
+            server.send_message(msg)
+        except SMTPResponseException as e:
+            # 421 means the server is closing the connection.
+            if e.smtp_code == 421:
+                self._discard(server)
+            else:
+                self._idle.put(server)
+            raise
+        except (SMTPServerDisconnected, OSError):
+            self._discard(server)
+            raise
+        except BaseException:
+            self._idle.put(server)
+            raise
+        else:
+            self._idle.put(server)
+            _metrics.observe('smtp_send', time.perf_counter() - start)
+
+    def close(self) -> None:
+        """Closes all the connections."""
+        with self._lock:
+            connections, self._connections = self._connections, list()
+        for server in connections:
+            try:
+                server.quit()
+            except (SMTPException, OSError):
+                server.close()
+
+    def _acquire(self) -> SMTP:
+        """Takes an idle connection, or opens a new one if the pool isn't
+        full yet, or else waits for either to be possible."""
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            if self._slots.acquire(blocking=False):
+                try:
+                    return self._connect()
+                except BaseException:
+                    self._slots.release()
+                    raise
+
+            # A connection may be either released or discarded meanwhile, so
+            # both are checked again every now and then.
+            try:
+                return self._idle.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+    def _connect(self) -> SMTP:
+        """Opens and authenticates a new connection."""
+        if self._login_error is not None:
+            raise self._login_error
+
+        start: float = time.perf_counter()
+        server: SMTP = self._smtp_factory(self.host, self.port)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            server.login(self._sender_email, self._password)
+        except SMTPAuthenticationError as e:
+            # The same credentials would only be turned down again.
+            self._login_error = e
+            server.close()
+            raise
+        except BaseException:
+            server.close()
+            raise
+        _metrics.observe('smtp_connect', time.perf_counter() - start)
+        _metrics.count('smtp_connections')
+
+        with self._lock:
+            self._connections.append(server)
+        return server
+
+    def _discard(self, server: SMTP) -> None:
+        """Drops a failed connection, making room for a new one."""
+        with self._lock:
+            if server in self._connections:
+                self._connections.remove(server)
+        server.close()
+        self._slots.release()
+
+class Deliverer:
+    """Delivers messages concurrently through an SMTP pool, retrying the
+    transient failures with exponential backoff.
+
+    The messages are pipelined: while the sender threads drain a bounded
+    queue, the messages are written into it ahead of them, so that rendering
+    a message overlaps with sending the previous ones and only a bounded
+    number of messages is ever held in memory.
+
+    Attributes:
+        deliver: Delivers the messages and reports on each of them.
+    """
+    def __init__(
+            self,
+            pool: SMTPPool,
+            workers: int = 4,
+            retries: int = 3,
+            backoff: float = 1.0,
+            queue_size: int = 64):
+        """Initializes Deliverer.
+
+        Args:
+            pool: The pool of connections to send the messages through.
+            workers: The number of messages sent at once.
+            retries: The number of times a transient failure is retried.
+            backoff: The delay before the first retry, in seconds, doubled
+                for every retry after that.
+            queue_size: The maximum number of messages written ahead of
+                delivery.
+        """
+        self.pool = pool
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.queue_size = queue_size
+
+    def deliver(
+            self,
+            messages: Iterable[Tuple[Name, Message]],
+            on_report: Optional[Callable[[int, DeliveryReport], None]] = None) \
+            -> List[DeliveryReport]:
+        """Delivers the messages and reports on each of them.
+
+        The messages are pulled from the iterable in this thread (so a
+        generator renders each message just ahead of its delivery) and sent
+        by the worker threads. A failed message doesn't stop the others from
+        being delivered, but a failed login stops the delivery altogether.
+
+        Args:
+            messages: The (recipient, message) pairs to deliver.
+            on_report: Called from a sender thread with the position of each
+                message and its report as soon as the message is done with,
+                e.g. to record its delivery.
+
+        Returns:
+            The delivery report of each message, in the order of the
+            messages.
+
+        Raises:
+            SMTPAuthenticationError: The login was turned down.
+            Exception: Whatever on_report raised, once the messages being
+                sent are done with.
+        """
+        pending: queue.Queue = queue.Queue(self.queue_size)
+        reports: Dict[int, DeliveryReport] = dict()
+        # Set once every message is queued, and as soon as a sender fails
+        # (e.g. on_report couldn't record a delivery), so that neither side
+        # is ever left waiting on the other. Both check them every now and
+        # then, as in SMTPPool._acquire.
+        done = threading.Event()
+        failed = threading.Event()
+
+        def send() -> None:
+            try:
+                while not failed.is_set():
+                    try:
+                        k, message = pending.get(timeout=0.05)
+                    except queue.Empty:
+                        # The last messages may be queued just before done
+                        # is set, so the queue is checked once more.
+                        if done.is_set() and pending.empty():
+                            return
+                        continue
+                    reports[k] = self._deliver_one(message)
+                    if on_report is not None:
+                        on_report(k, reports[k])
+            except BaseException:
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            senders = [executor.submit(send) for _ in range(self.workers)]
+            try:
+                count: int = 0
+                for message in messages:
+                    while not failed.is_set():
+                        try:
+                            pending.put((count, message), timeout=0.05)
+                            break
+                        except queue.Full:
+                            pass
+                    if failed.is_set():
+                        break
+                    count += 1
+            finally:
+                # Even if writing a message failed, the senders stop once
+                # they are done with the queue.
+                done.set()
+            # The first sender that failed takes the delivery down with it;
+            # the messages it didn't get to are left undelivered.
+            for sender in senders:
+                sender.result()
+
+        return [reports[k] for k in range(count)]
+
+    def _deliver_one(self, message: Tuple[Name, Message]) -> DeliveryReport:
+        """Delivers a single message, retrying transient failures."""
+        recipient, msg = message
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                self.pool.send_message(msg)
+                _metrics.count('messages_sent')
+                return DeliveryReport(recipient, msg['To'], True, attempts)
+            except SMTPAuthenticationError:
+                # Not the message's fault, and every other one would fail
+                # the same way.
+                raise
+            except Exception as e:
+                if attempts > self.retries or not _is_transient(e):
+                    _metrics.count('messages_failed')
+                    return DeliveryReport(recipient, msg['To'], False,
+                                          attempts, f'{type(e).__name__}: {e}')
+            _metrics.count('smtp_retries')
+            time.sleep(self.backoff * 2 ** (attempts - 1))
+
+def _is_transient(error: Exception) -> bool:
+    """Tells whether a failure to send a message is worth retrying.
+
+    Dropped connections and 4xx replies are transient, while 5xx replies (a
+    bad address, a message too large, ...) and any other error are
+    permanent.
+    """
+    if isinstance(error, SMTPRecipientsRefused):
+        return all(400 <= code < 500
+                   for code, _ in error.recipients.values())
+    if isinstance(error, SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (SMTPServerDisconnected, OSError))
@@ -2,23 +2,39 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from getpass import getpass
 from smtplib import SMTP
-from typing import Dict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from ._types import Matrix, Table
+from . import _metrics
+from ._delivery import Deliverer, DeliveryReport, SMTPPool
+from ._ledger import Ledger
+from ._outbox import Outbox
+from ._settlement import Settlement, StatementIndex
+from ._types import FilePath, Name, Table
 from ._writer import Writer
 
 class Emailer:
     """A helper class to set up and send emails out.
 
     Attributes:
+        messages: Writes the email of each participant.
         send: Sends out the emails to all participants.
+        spool: Writes the emails of all participants into an outbox.
     """
     def __init__(
             self,
             trip_title: str,
             emails: Dict,
-            table: Table,
-            reimbursement_matrices: Dict[str, Matrix]):
+            table: Union[Ledger, Table],
+            settlements: Dict[str, Settlement],
+            summarized: bool = False,
+            statements: Optional[StatementIndex] = None,
+            smtp_host: str = 'smtp.gmail.com',
+            smtp_port: int = 587,
+            connections: int = 4,
+            rate_limit: Optional[float] = None,
+            retries: int = 3,
+            queue_size: int = 64,
+            smtp_factory: Callable[..., SMTP] = SMTP):
         """Initializes Emailer.
 
         Args:
@@ -26,25 +42,60 @@ class Emailer:
                 subject).
             emails: A mapping between the participant's name and the
                 participant's email.
-            reimbursement_matrices: A dict that maps a currency code to its
-                respective cost matrix.
+            table: The ledger of the trip, or a summary of the costs when
+                summarized.
+            settlements: A dict that maps a currency code to its respective
+                settlement.
+            summarized: Whether the table is a summary of the costs rather
+                than the ledger.
+            statements: The settlements indexed by participant, built from
+                the settlements if not given.
+            smtp_host: The SMTP server the emails are sent through.
+            smtp_port: The port of the SMTP server.
+            connections: The number of connections the emails are sent over
+                concurrently.
+            rate_limit: The maximum number of emails sent per second, or None
+                for no limit.
+            retries: The number of times a transient failure is retried.
+            queue_size: The maximum number of emails written ahead of
+                delivery.
+            smtp_factory: Opens a connection given (host, port), e.g. a
+                stand-in for smtplib.SMTP when testing.
         """
         self.trip_title = trip_title
         self.emails = emails
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.connections = connections
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.queue_size = queue_size
+        self.smtp_factory = smtp_factory
 
         #self._max_name_len: int = max(map(len, self.emails.keys()))
 
         self.writer = Writer(
             self.trip_title,
             table,
-            reimbursement_matrices)
+            settlements,
+            summarized,
+            statements)
 
-    def send(self, subject: str = 'reimbursements', text_type='html') -> None:
-        """Sends out the emails to all participants.
+    def messages(
+            self,
+            sender_email: str,
+            subject: str = 'reimbursements',
+            text_type: str = 'html') -> Iterator[Tuple[Name, MIMEMultipart]]:
+        """Writes the email of each participant.
 
         Args:
+            sender_email: The email account the emails are sent from.
             subject: The secondary title of the email subject (next to the trip
-            title).
+                title).
+            text_type: Either html or plain.
+
+        Yields:
+            The (recipient, message) pair of each participant.
 
         Raises:
             Exception: Text type must either be html or plaintext
@@ -56,30 +107,111 @@ class Emailer:
         else:
             raise Exception('Text type must either be html or plain.')
 
-        sender_email = input('Please enter your email account: ')
-        password = getpass('Please enter your password: ')
-
-        # TODO: add support for other email servers
-        # Currently, this application only supports gmail. Also, the user must
-        # give permission for "less secure apps" to access gmail account.
-        with SMTP('smtp.gmail.com', 587) as server:
-            server.ehlo()
-            server.starttls()
-            server.ehlo()
-            server.login(sender_email, password)
-
-            for recipient, recipient_email in self.emails.items():
+        for recipient, recipient_email in self.emails.items():
+            with _metrics.timer('render'):
                 msg = MIMEMultipart()
                 msg['From'] = sender_email
                 msg['To'] = recipient_email
                 msg['Subject'] = f'{self.trip_title} {subject}'
 
-                body = MIMEText(write_body(recipient), text_type.lower())
+                text: str = write_body(recipient)
+                body = MIMEText(text, text_type.lower())
                 msg.attach(body)
+            if _metrics.active():
+                _metrics.count('bytes_rendered', len(text.encode()))
+
+            yield recipient, msg
+
+    def send(
+            self,
+            subject: str = 'reimbursements',
+            text_type: str = 'html',
+            sender_email: Optional[str] = None,
+            password: Optional[str] = None) -> List[DeliveryReport]:
+        """Sends out the emails to all participants.
+
+        The emails are sent concurrently over a pool of connections while
+        the next ones are being written, and a participant whose email fails
+        doesn't keep the others from getting theirs.
 
-                server.send_message(msg)
+        Args:
+            subject: The secondary title of the email subject (next to the trip
+            title).
+            text_type: Either html or plain.
+            sender_email: The email account to send from, prompted for if not
+                given.
+            password: The password of said email account, prompted for if not
+                given.
 
+        Returns:
+            The delivery report of each participant.
+
+        Raises:
+            Exception: Text type must either be html or plaintext
+            SMTPAuthenticationError: The login was turned down.
+        """
+        if text_type.lower() not in ('html', 'plain'):
+            raise Exception('Text type must either be html or plain.')
+
+        if sender_email is None:
+            sender_email = input('Please enter your email account: ')
+        if password is None:
+            password = getpass('Please enter your password: ')
+
+        # Gmail requires the user to give permission for "less secure apps"
+        # (or an app password) to access the account.
+        pool = SMTPPool(
+            self.smtp_host,
+            self.smtp_port,
+            sender_email,
+            password,
+            self.connections,
+            self.rate_limit,
+            smtp_factory=self.smtp_factory)
         # I think this is redundant, but to be sure the sender email
         # information is deleted.
-        del sender_email
         del password
+
+        with pool, _metrics.timer('deliver'):
+            deliverer = Deliverer(
+                pool,
+                self.connections,
+                self.retries,
+                queue_size=self.queue_size)
+            return deliverer.deliver(
+                self.messages(sender_email, subject, text_type))
+
+    def spool(
+            self,
+            outbox_file: FilePath,
+            subject: str = 'reimbursements',
+            text_type: str = 'html',
+            sender_email: Optional[str] = None) -> int:
+        """Writes the emails of all participants into an outbox, to be sent
+        later on with Outbox.deliver (or `reimburser deliver`).
+
+        Args:
+            outbox_file: The sqlite file the outbox is kept in.
+            subject: The secondary title of the email subject (next to the trip
+                title).
+            text_type: Either html or plain.
+            sender_email: The email account to send from, prompted for if not
+                given.
+
+        Returns:
+            The number of emails written.
+
+        Raises:
+            Exception: Text type must either be html or plaintext
+            OutboxError: The outbox already holds emails.
+        """
+        if text_type.lower() not in ('html', 'plain'):
+            raise Exception('Text type must either be html or plain.')
+
+        if sender_email is None:
+            sender_email = input('Please enter your email account: ')
+
+        with Outbox(outbox_file) as outbox, _metrics.timer('spool'):
+            return outbox.put(
+                self.messages(sender_email, subject, text_type),
+                sender_email)
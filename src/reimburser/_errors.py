@@ -5,3 +5,24 @@ class FieldError(Exception):
 class FileFormatError(Exception):
     """Raised when the file is not the appropriate format"""
     pass
+
+class StateError(Exception):
+    """Raised when the state file does not match the trip"""
+    pass
+
+class OutboxError(Exception):
+    """Raised when the outbox cannot be written to or read from"""
+    pass
+
+class RowError(ValueError):
+    """Raised when a row of the file (or record) is malformed"""
+    def __init__(self, file: str, line: int, problem: str, unit='Line'):
+        super().__init__(f'{unit} {line} of {file}: {problem}.')
+        self.file = file
+        self.line = line
+        self.problem = problem
+        self.unit = unit
+
+    def __reduce__(self):
+        # So that it makes it back from a worker process.
+        return type(self), (self.file, self.line, self.problem, self.unit)
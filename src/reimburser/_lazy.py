@@ -0,0 +1,24 @@
+import importlib
+from types import ModuleType
+
+class _LazyModule:
+    """Stands in for a module that is only imported once one of its
+    attributes is first looked up.
+
+    Importing pandas alone takes longer than most trips take to settle, so
+    the modules that only need it for some stages refer to it through this
+    proxy instead of importing it up front.
+    """
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not found on the proxy itself, i.e. the
+        # attributes of the module.
+        module: ModuleType = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+pd = _LazyModule('pandas')
@@ -0,0 +1,245 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ._balance import _creditor_ids, _factorize, _group_codes
+from ._lazy import pd
+from ._money import _fixed_point
+from ._types import Name, Table
+
+class Ledger:
+    """The costs of a trip, as compact arrays of integer codes.
+
+    Each cost is a row of fixed width numbers: the id of its reimbursee in
+    the name table, its amount as a fixed point integer, the code of its
+    currency and the code of its reimbursers cell. The str behind the codes
+    are kept once each, in the name, currency and group tables. This is all
+    every stage needs from the cost table, from the balances to the emails,
+    and the cost table itself is only built (with to_frame) on demand.
+
+    Attributes:
+        names: The name table, i.e. the participants' names ordered by id.
+        currencies: The currency codes, ordered by currency code.
+        groups: The distinct reimbursers cells, ordered by group code.
+        reimbursee: The int32 id of the reimbursee of each cost.
+        amount: The int64 amount of each cost, in units of 10 ** -scale.
+        scale: The number of decimal digits of the amounts.
+        currency: The int16 currency code of each cost.
+        reimbursers: The int32 group code of the reimbursers cell of each
+            cost, -1 if blank.
+        rows: The row number of each cost in the costs file.
+        notes: The notes of each cost, if the costs file has any.
+        from_columns: Encodes the columns of a cost table.
+        from_frame: Encodes a cost table.
+        costs: The amount of each cost, as floats.
+        to_frame: Builds the cost table.
+    """
+    __slots__ = ('names', 'currencies', 'groups', 'reimbursee', 'amount',
+                 'scale', 'currency', 'reimbursers', 'rows', 'notes')
+
+    def __init__(
+            self,
+            names: List[Name],
+            currencies: List[str],
+            groups: List[str],
+            reimbursee: np.ndarray,
+            amount: np.ndarray,
+            scale: int,
+            currency: np.ndarray,
+            reimbursers: np.ndarray,
+            rows: Optional[np.ndarray] = None,
+            notes: Optional[np.ndarray] = None):
+        """Initializes Ledger.
+
+        Args:
+            names: The participants' names, ordered by id.
+            currencies: The currency codes, ordered by currency code.
+            groups: The distinct reimbursers cells, ordered by group code.
+            reimbursee: The id of the reimbursee of each cost.
+            amount: The amount of each cost, in units of 10 ** -scale.
+            scale: The number of decimal digits of the amounts.
+            currency: The currency code of each cost.
+            reimbursers: The group code of each cost, -1 if blank.
+            rows: The row number of each cost, by default 0, 1, 2, ...
+            notes: The notes of each cost, if any.
+        """
+        self.names = names
+        self.currencies = currencies
+        self.groups = groups
+        self.reimbursee = reimbursee.astype(np.int32, copy=False)
+        self.amount = amount.astype(np.int64, copy=False)
+        self.scale = scale
+        self.currency = currency.astype(np.int16, copy=False)
+        self.reimbursers = reimbursers.astype(np.int32, copy=False)
+        if rows is None:
+            rows = np.arange(len(amount))
+        self.rows = rows.astype(np.int64, copy=False)
+        self.notes = notes
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    @classmethod
+    def from_columns(
+            cls,
+            names: List[Name],
+            reimbursee: np.ndarray,
+            cost: np.ndarray,
+            currency: np.ndarray,
+            reimbursers: np.ndarray,
+            rows: Optional[np.ndarray] = None,
+            notes: Optional[np.ndarray] = None) -> 'Ledger':
+        """Encodes the columns of a cost table.
+
+        Args:
+            names: The participants' names, ordered by id.
+            reimbursee: The reimbursee of each cost.
+            cost: The amount of each cost.
+            currency: The currency of each cost.
+            reimbursers: The reimbursers cell of each cost, None or NaN if
+                blank.
+            rows: The row number of each cost, by default 0, 1, 2, ...
+            notes: The notes of each cost, if any.
+
+        Returns:
+            The ledger of the costs.
+
+        Raises:
+            KeyError: A reimbursee is not a participant.
+            ValueError: A cost is missing.
+        """
+        amount, scale = _amounts(cost, rows)
+        currency_codes, currencies = _factorize(np.asarray(currency))
+        group_codes, groups = _group_codes(reimbursers)
+
+        return cls(
+            names,
+            list(currencies),
+            groups,
+            _creditor_ids(np.asarray(reimbursee), names),
+            amount,
+            scale,
+            currency_codes,
+            group_codes,
+            rows,
+            notes)
+
+    @classmethod
+    def from_frame(cls, table: Table, names: List[Name]) -> 'Ledger':
+        """Encodes a cost table.
+
+        The reimbursee and currency columns of a table read with
+        _costs_table_reader are categoricals, which are already encoded: only
+        their categories are then looked up, rather than every cell.
+
+        Args:
+            table: A cost table with at least the columns [reimbursee, cost,
+                currency, reimbursers], indexed by row number.
+            names: The participants' names, ordered by id.
+
+        Returns:
+            The ledger of the costs.
+
+        Raises:
+            KeyError: A reimbursee is not a participant.
+            ValueError: A cost is missing.
+        """
+        reimbursee, currency = table['reimbursee'], table['currency']
+        if not (isinstance(reimbursee.dtype, pd.CategoricalDtype)
+                and isinstance(currency.dtype, pd.CategoricalDtype)):
+            return cls.from_columns(
+                names,
+                reimbursee.to_numpy(),
+                table['cost'].to_numpy(dtype=float),
+                currency.to_numpy(),
+                table['reimbursers'].to_numpy(),
+                table.index.to_numpy(),
+                table['notes'].to_numpy() if 'notes' in table else None)
+
+        rows: np.ndarray = table.index.to_numpy()
+        amount, scale = _amounts(table['cost'].to_numpy(dtype=float), rows)
+        reimbursee_codes, reimbursees = _category_codes(reimbursee)
+        if (reimbursee_codes < 0).any():
+            raise KeyError(np.nan)
+        currency_codes, currencies = _category_codes(currency)
+        group_codes, groups = _group_codes(table['reimbursers'].to_numpy())
+
+        return cls(
+            names,
+            list(currencies),
+            groups,
+            _creditor_ids(reimbursees, names)[reimbursee_codes],
+            amount,
+            scale,
+            currency_codes,
+            group_codes,
+            rows,
+            table['notes'].to_numpy() if 'notes' in table else None)
+
+    def costs(self) -> np.ndarray:
+        """The amount of each cost, as the floats read from the costs file."""
+        return self.amount / 10.0 ** self.scale
+
+    def to_frame(self) -> Table:
+        """Builds the cost table, as read by _costs_table_reader.
+
+        Returns:
+            A pandas DataFrame with the columns [reimbursee, cost, currency,
+            reimbursers(, notes)], indexed by row number.
+        """
+        # Blank cells are NaN in a table read by pandas, which is what the
+        # -1 codes point to.
+        groups = np.empty(len(self.groups) + 1, dtype=object)
+        groups[:len(self.groups)] = self.groups
+        groups[-1] = np.nan
+
+        columns = {
+            'reimbursee': np.array(self.names, dtype=object)[self.reimbursee],
+            'cost': self.costs(),
+            'currency': np.array(self.currencies,
+                                 dtype=object)[self.currency],
+            'reimbursers': groups[self.reimbursers],
+        }
+        if self.notes is not None:
+            columns['notes'] = self.notes
+
+        return pd.DataFrame(columns, index=self.rows)
+
+def _amounts(
+        cost: np.ndarray,
+        rows: Optional[np.ndarray]) -> Tuple[np.ndarray, int]:
+    """Converts the costs to fixed point, see _fixed_point.
+
+    Raises:
+        ValueError: A cost is missing.
+    """
+    cost = np.asarray(cost, dtype=float)
+    finite: np.ndarray = np.isfinite(cost)
+    if not finite.all():
+        row = np.argmin(finite) if rows is None else rows[np.argmin(finite)]
+        raise ValueError(f'The cost of row {row} is missing.')
+
+    return _fixed_point(cost)
+
+def _category_codes(column) -> Tuple[np.ndarray, np.ndarray]:
+    """Recodes a categorical column in order of first appearance, as
+    _factorize and _group_codes do, with -1 for missing values.
+
+    Args:
+        column: A pandas Series of dtype category.
+
+    Returns:
+        This function returns two objects: the code of each value, and the
+        categories that appear, ordered by code.
+    """
+    codes: np.ndarray = column.cat.codes.to_numpy()
+    categories: np.ndarray = column.cat.categories.to_numpy(dtype=object)
+    used, first = np.unique(codes, return_index=True)
+    if len(used) and used[0] == -1:
+        used, first = used[1:], first[1:]
+    used = used[np.argsort(first)]
+    # The last rank is the one missing values (code -1) look up.
+    ranks: np.ndarray = np.full(len(categories) + 1, -1, dtype=np.int32)
+    ranks[used] = np.arange(len(used))
+
+    return ranks[codes], categories[used]
@@ -0,0 +1,206 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import (
+    Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple)
+
+class Metrics:
+    """The stage timers, counters and latencies of a run.
+
+    The timers add up the wall time spent in each stage. Stages may overlap
+    (e.g. the emails are written while the previous ones are being sent, or
+    several trips are settled in worker processes at once), so their times
+    don't necessarily add up to the time of the run.
+
+    Attributes:
+        timers: A dict mapping a stage to its [seconds, calls].
+        counters: A dict mapping a counter to its value.
+        latencies: A dict mapping an operation to the seconds each call took.
+        merge: Adds the metrics of another run to these.
+        to_dict: Turns the metrics into plain dicts, e.g. to dump as JSON.
+        report: Writes the metrics as a human readable breakdown.
+    """
+    def __init__(self):
+        """Initializes Metrics."""
+        self.timers: Dict[str, List[float]] = dict()
+        self.counters: Dict[str, int] = dict()
+        self.latencies: Dict[str, List[float]] = dict()
+        self.start: float = time.perf_counter()
+        # The emails are sent from several threads.
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        # The metrics of a worker process are pickled back to the parent,
+        # which the lock can't be.
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Adds the time spent in the with block to a stage."""
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds: float = time.perf_counter() - start
+            with self._lock:
+                timer = self.timers.setdefault(stage, [0.0, 0])
+                timer[0] += seconds
+                timer[1] += 1
+
+    def count(self, counter: str, n: int = 1) -> None:
+        """Adds n to a counter."""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def observe(self, operation: str, seconds: float) -> None:
+        """Records the time a call of an operation took."""
+        with self._lock:
+            self.latencies.setdefault(operation, list()).append(seconds)
+
+    def merge(self, other: 'Metrics') -> None:
+        """Adds the metrics of another run (e.g. of a worker process) to
+        these. The wall time stays that of this run."""
+        with self._lock:
+            for stage, (seconds, calls) in other.timers.items():
+                timer = self.timers.setdefault(stage, [0.0, 0])
+                timer[0] += seconds
+                timer[1] += calls
+            for counter, value in other.counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + value
+            for operation, samples in other.latencies.items():
+                self.latencies.setdefault(operation, list()).extend(samples)
+
+    def to_dict(self) -> Dict:
+        """Turns the metrics into plain dicts, e.g. to dump as JSON.
+
+        Returns:
+            A dict with the wall time of the run and the stages, counters and
+            latencies.
+        """
+        latencies = dict()
+        for operation, samples in self.latencies.items():
+            ordered = sorted(samples)
+            latencies[operation] = {
+                'calls': len(ordered),
+                'mean': sum(ordered) / len(ordered),
+                'p50': ordered[len(ordered) // 2],
+                'p95': ordered[min(len(ordered) - 1,
+                                   int(len(ordered) * 0.95))],
+                'max': ordered[-1],
+            }
+
+        return {
+            'wall_seconds': time.perf_counter() - self.start,
+            'stages': {stage: {'seconds': seconds, 'calls': calls}
+                       for stage, (seconds, calls) in self.timers.items()},
+            'counters': dict(self.counters),
+            'latencies': latencies,
+        }
+
+    def report(self) -> str:
+        """Writes the metrics as a human readable breakdown.
+
+        Returns:
+            The breakdown, one line per stage, counter and latency.
+        """
+        metrics: Dict = self.to_dict()
+        lines = [f'{"stage":<20} {"seconds":>10} {"calls":>8}']
+        for stage, timer in metrics['stages'].items():
+            lines.append(f'{stage:<20} {timer["seconds"]:>10.4f} '
+                         f'{timer["calls"]:>8}')
+        lines.append(f'{"(wall)":<20} {metrics["wall_seconds"]:>10.4f}')
+
+        if metrics['counters']:
+            lines.append('')
+            lines.append(f'{"counter":<20} {"value":>10}')
+            for counter, value in metrics['counters'].items():
+                lines.append(f'{counter:<20} {value:>10}')
+
+        if metrics['latencies']:
+            lines.append('')
+            lines.append(f'{"latency (ms)":<20} {"calls":>8} {"mean":>8} '
+                         f'{"p50":>8} {"p95":>8} {"max":>8}')
+            for operation, latency in metrics['latencies'].items():
+                lines.append(
+                    f'{operation:<20} {latency["calls"]:>8} '
+                    + ' '.join(f'{latency[k] * 1000:>8.2f}'
+                               for k in ('mean', 'p50', 'p95', 'max')))
+
+        return '\n'.join(lines)
+
+# The metrics of the current run, if they are being collected. Everything
+# below is a no-op otherwise, so that the instrumentation costs next to
+# nothing when it is off.
+_metrics: Optional[Metrics] = None
+
+@contextmanager
+def collecting(metrics: Optional[Metrics]) -> Iterator[Optional[Metrics]]:
+    """Collects the metrics of everything run in the with block.
+
+    Args:
+        metrics: The metrics to collect into, or None not to collect any.
+
+    Yields:
+        The metrics.
+    """
+    global _metrics
+    previous, _metrics = _metrics, metrics
+    try:
+        yield metrics
+    finally:
+        _metrics = previous
+
+def active() -> bool:
+    """Whether metrics are being collected, e.g. before measuring something
+    that is costly to measure."""
+    return _metrics is not None
+
+def timer(stage: str) -> ContextManager[None]:
+    """Adds the time spent in the with block to a stage."""
+    if _metrics is None:
+        return nullcontext()
+    return _metrics.timer(stage)
+
+def count(counter: str, n: int = 1) -> None:
+    """Adds n to a counter."""
+    if _metrics is not None:
+        _metrics.count(counter, n)
+
+def observe(operation: str, seconds: float) -> None:
+    """Records the time a call of an operation took."""
+    if _metrics is not None:
+        _metrics.observe(operation, seconds)
+
+def collected(
+        collect: bool,
+        function: Callable,
+        *args) -> Tuple[Any, Optional[Metrics]]:
+    """Runs a function on metrics of its own, e.g. the task of a worker
+    process, whose metrics would otherwise never make it back to the parent
+    process (see merge).
+
+    Args:
+        collect: Whether to collect the metrics, i.e. whether the parent
+            process does (see active).
+        function: The function to run.
+        *args: The arguments of the function.
+
+    Returns:
+        What the function returned, and its metrics (None if not collected).
+    """
+    metrics: Optional[Metrics] = Metrics() if collect else None
+    with collecting(metrics):
+        result = function(*args)
+
+    return result, metrics
+
+def merge(metrics: Optional[Metrics]) -> None:
+    """Adds the metrics of a function run by collected to the current run."""
+    if _metrics is not None and metrics is not None:
+        _metrics.merge(metrics)
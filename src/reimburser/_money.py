@@ -0,0 +1,107 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Number of minor units digits of the currencies that don't use cents. Any
+# currency not listed here is assumed to have 2 minor digits.
+DEFAULT_MINOR_DIGITS = 2
+MINOR_DIGITS: Dict[str, int] = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0,
+    'KRW': 0, 'PYG': 0, 'RWF': 0, 'UGX': 0, 'UYI': 0, 'VND': 0, 'VUV': 0,
+    'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+
+def _minor_digits(
+        currency: str,
+        minor_digits: Optional[Dict[str, int]] = None) -> int:
+    """Looks up the number of minor unit digits of a currency.
+
+    Args:
+        currency: The currency code.
+        minor_digits: Overrides of the default number of digits, mapping a
+            currency code to its number of digits.
+
+    Returns:
+        The number of digits after the decimal point of said currency.
+    """
+    if minor_digits and currency in minor_digits:
+        return minor_digits[currency]
+    return MINOR_DIGITS.get(currency, DEFAULT_MINOR_DIGITS)
+
+# The most decimal digits a cost is kept with, see _fixed_point.
+MAX_SCALE = 9
+
+def _fixed_point(amounts: np.ndarray) -> Tuple[np.ndarray, int]:
+    """Converts float amounts to int64 fixed point numbers.
+
+    The scale is the fewest decimal digits that represent every amount
+    exactly, i.e. such that fixed / 10 ** scale gives back the very same
+    float. For costs written with cents, that is 2 (or less), so the floats
+    are not changed in any way by the round trip.
+
+    Args:
+        amounts: The finite amounts, in major units.
+
+    Returns:
+        This function returns two objects: the int64 amounts, in units of
+        10 ** -scale, and the scale. Amounts with more than MAX_SCALE digits
+        are rounded to MAX_SCALE digits.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    for scale in range(MAX_SCALE + 1):
+        fixed = np.round(amounts * 10.0 ** scale)
+        if (fixed / 10.0 ** scale == amounts).all():
+            break
+
+    return fixed.astype(np.int64), scale
+
+def _rescale(amounts: np.ndarray, scale: int, digits: int) -> np.ndarray:
+    """Converts fixed point amounts to integer minor units, rounding half up
+    (away from zero), just like _hround.
+
+    Args:
+        amounts: The int64 amounts, in units of 10 ** -scale.
+        scale: The number of decimal digits of the amounts.
+        digits: The number of minor unit digits of the currency.
+
+    Returns:
+        The amounts as int64 minor units.
+    """
+    if scale <= digits:
+        return amounts * 10 ** (digits - scale)
+
+    unit = 10 ** (scale - digits)
+    return np.sign(amounts) * ((np.abs(amounts) + unit // 2) // unit)
+
+def _split(
+        amounts: np.ndarray,
+        group_sizes: np.ndarray,
+        rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """Splits each integer amount into equal integer shares.
+
+    The remainder of each division is handed out one minor unit at a time to
+    members of the group, so the shares always add up to the amount. To keep
+    the split deterministic without always charging the same participants the
+    extra minor units, the member the remainder starts from rotates with the
+    row number of the amount.
+
+    Args:
+        amounts: The int64 amounts to split.
+        group_sizes: The number of shares of each amount.
+        rows: The row number of each amount, defaults to 0, 1, 2, ...
+
+    Returns:
+        The flattened shares, group by group.
+    """
+    if rows is None:
+        rows = np.arange(len(amounts))
+
+    base, remainder = np.divmod(amounts, group_sizes)
+    starts = np.cumsum(group_sizes) - group_sizes
+    positions = np.arange(group_sizes.sum()) - np.repeat(starts, group_sizes)
+    rotated = (positions - np.repeat(rows, group_sizes)) \
+        % np.repeat(group_sizes, group_sizes)
+
+    return np.repeat(base, group_sizes) \
+        + (rotated < np.repeat(remainder, group_sizes))
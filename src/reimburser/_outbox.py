@@ -0,0 +1,241 @@
+import sqlite3
+import threading
+from email import message_from_bytes
+from email.message import Message
+from getpass import getpass
+from smtplib import SMTP
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import _metrics
+from ._delivery import Deliverer, DeliveryReport, SMTPPool
+from ._errors import OutboxError
+from ._types import FilePath, Name
+
+# Bumped whenever the layout of the outbox changes.
+OUTBOX_VERSION = 1
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+class Outbox:
+    """An on-disk spool of fully written emails, backed by sqlite.
+
+    The emails of a trip are written into the outbox all at once, and then
+    delivered from it in a separate step. Each email is marked as sent as
+    soon as it is delivered, so that a delivery that dies halfway through can
+    be picked up where it stopped without mailing anyone twice.
+
+    Attributes:
+        outbox_file: The sqlite file the outbox is kept in.
+        sender_email: The email account the emails are sent from.
+        put: Writes emails into the outbox.
+        counts: Counts the emails of the outbox by status.
+        retry_failed: Puts the emails that failed back in line.
+        deliver: Delivers the pending emails.
+        close: Closes the outbox.
+    """
+    def __init__(self, outbox_file: FilePath):
+        """Initializes Outbox, creating the outbox file if needed.
+
+        Args:
+            outbox_file: The sqlite file the outbox is kept in.
+
+        Raises:
+            OutboxError: The file was written by another version of
+                reimburser.
+        """
+        self.outbox_file = outbox_file
+        # The connection is shared by the sender threads, which take turns.
+        self._db = sqlite3.connect(outbox_file, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS meta ('
+                'key TEXT PRIMARY KEY, value TEXT)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'id INTEGER PRIMARY KEY, '
+                'recipient TEXT NOT NULL, '
+                'email TEXT NOT NULL, '
+                'message BLOB NOT NULL, '
+                f"status TEXT NOT NULL DEFAULT '{PENDING}', "
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'error TEXT)')
+            self._db.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('version', ?)",
+                (str(OUTBOX_VERSION),))
+
+        if self._meta('version') != str(OUTBOX_VERSION):
+            self.close()
+            raise OutboxError('The outbox was written by another version of '
+                              'reimburser.')
+
+    def __enter__(self) -> 'Outbox':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(self.counts().values())
+
+    @property
+    def sender_email(self) -> Optional[str]:
+        """The email account the emails are sent from."""
+        return self._meta('sender_email')
+
+    def put(
+            self,
+            messages: Iterable[Tuple[Name, Message]],
+            sender_email: str) -> int:
+        """Writes emails into the outbox, all in one transaction.
+
+        Args:
+            messages: The (recipient, message) pairs to write.
+            sender_email: The email account the emails are sent from.
+
+        Returns:
+            The number of emails written.
+
+        Raises:
+            OutboxError: The outbox still holds emails that weren't sent,
+                which would then be sent twice.
+        """
+        counts: Dict[str, int] = self.counts()
+        if counts[PENDING] or counts[FAILED]:
+            raise OutboxError('The outbox still holds emails that weren\'t '
+                              'sent. Please deliver them (`reimburser deliver '
+                              f'{self.outbox_file}`) or remove the outbox '
+                              'first.')
+
+        rows = ((recipient, msg['To'], msg.as_bytes())
+                for recipient, msg in messages)
+        with self._lock, self._db:
+            # The emails of a delivery that went through are forgotten.
+            self._db.execute('DELETE FROM messages WHERE status = ?', (SENT,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('sender_email', ?)",
+                (sender_email,))
+            cursor = self._db.executemany(
+                'INSERT INTO messages (recipient, email, message) '
+                'VALUES (?, ?, ?)',
+                rows)
+
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """Counts the emails of the outbox by status.
+
+        Returns:
+            A dict mapping each status (pending, sent, failed) to its number
+            of emails.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT status, COUNT(*) FROM messages GROUP BY status')
+            counts = dict(rows.fetchall())
+
+        return {status: counts.get(status, 0)
+                for status in (PENDING, SENT, FAILED)}
+
+    def retry_failed(self) -> int:
+        """Puts the emails that failed back in line.
+
+        Returns:
+            The number of emails put back in line.
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'UPDATE messages SET status = ?, error = NULL '
+                'WHERE status = ?',
+                (PENDING, FAILED))
+
+        return cursor.rowcount
+
+    def deliver(
+            self,
+            password: Optional[str] = None,
+            smtp_host: str = 'smtp.gmail.com',
+            smtp_port: int = 587,
+            connections: int = 4,
+            rate_limit: Optional[float] = None,
+            retries: int = 3,
+            smtp_factory: Callable[..., SMTP] = SMTP) -> List[DeliveryReport]:
+        """Delivers the pending emails, marking each one as it goes.
+
+        Args:
+            password: The password of the sender email account, prompted for
+                if not given.
+            smtp_host: The SMTP server the emails are sent through.
+            smtp_port: The port of the SMTP server.
+            connections: The number of connections the emails are sent over
+                concurrently.
+            rate_limit: The maximum number of emails sent per second, or None
+                for no limit.
+            retries: The number of times a transient failure is retried.
+            smtp_factory: Opens a connection given (host, port), e.g. a
+                stand-in for smtplib.SMTP when testing.
+
+        Returns:
+            The delivery report of each email that was pending.
+
+        Raises:
+            SMTPAuthenticationError: The login was turned down. The emails
+                not sent yet are left pending.
+        """
+        with self._lock:
+            ids: List[int] = [id_ for id_, in self._db.execute(
+                'SELECT id FROM messages WHERE status = ? ORDER BY id',
+                (PENDING,))]
+        if not ids:
+            return list()
+
+        if password is None:
+            password = getpass(
+                f'Please enter the password of {self.sender_email}: ')
+        pool = SMTPPool(
+            smtp_host,
+            smtp_port,
+            self.sender_email,
+            password,
+            connections,
+            rate_limit,
+            smtp_factory=smtp_factory)
+        del password
+
+        def mark(k: int, report: DeliveryReport) -> None:
+            with self._lock, self._db:
+                self._db.execute(
+                    'UPDATE messages '
+                    'SET status = ?, attempts = attempts + ?, error = ? '
+                    'WHERE id = ?',
+                    (SENT if report.sent else FAILED, report.attempts,
+                     report.error, ids[k]))
+
+        with pool, _metrics.timer('deliver'):
+            deliverer = Deliverer(pool, connections, retries)
+            return deliverer.deliver(self._messages(ids), mark)
+
+    def close(self) -> None:
+        """Closes the outbox."""
+        self._db.close()
+
+    def _messages(self, ids: List[int]) -> Iterator[Tuple[Name, Message]]:
+        """Reads the emails with the given ids, one at a time."""
+        for id_ in ids:
+            with self._lock:
+                recipient, data = self._db.execute(
+                    'SELECT recipient, message FROM messages WHERE id = ?',
+                    (id_,)).fetchone()
+            yield Name(recipient), message_from_bytes(data)
+
+    def _meta(self, key: str) -> Optional[str]:
+        """Reads a value of the meta table."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM meta WHERE key = ?',
+                (key,)).fetchone()
+
+        return None if row is None else row[0]
@@ -0,0 +1,83 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import ContextManager, List, Optional
+
+import numpy as np
+
+from ._balance import _array_balance_maker, _participant_index
+from ._settlement import Transfer, _hround, _settle, _settle_optimal
+from ._types import Name
+
+def _executor(workers: Optional[int]) -> ContextManager[Optional[Executor]]:
+    """Creates the process pool the currencies are fanned out to.
+
+    Args:
+        workers: The number of worker processes. No pool is created if it is
+            None or 1, and the currencies are then processed serially.
+
+    Returns:
+        A context manager giving either the process pool or None.
+    """
+    if workers is None or workers == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(workers)
+
+def _balance_task(
+        creditors: np.ndarray,
+        amounts: np.ndarray,
+        scale: int,
+        group_codes: np.ndarray,
+        groups: List[str],
+        rows: np.ndarray,
+        names: List[Name],
+        digits: Optional[int]) -> np.ndarray:
+    """Computes the balance vector of a single currency in a worker process.
+
+    The transactions are handed over as plain arrays: the reimbursers cells
+    are factorized into codes into the list of distinct cells (with -1 for a
+    blank cell, see _group_codes), so that only numbers and a few strings
+    are pickled.
+
+    Args:
+        creditors: The id of the reimbursee of each transaction.
+        amounts: The cost of each transaction, in units of 10 ** -scale.
+        scale: The number of decimal digits of the amounts.
+        group_codes: The code of the reimbursers cell of each transaction.
+        groups: The distinct reimbursers cells.
+        rows: The row number of each transaction in the cost table.
+        names: The participants' names, ordered by participant id.
+        digits: The number of minor unit digits of the currency, or None to
+            compute the balances with floats.
+
+    Returns:
+        The balance vector, see _array_balance_maker.
+    """
+    return _array_balance_maker(
+        creditors,
+        amounts,
+        scale,
+        group_codes,
+        groups,
+        rows,
+        _participant_index(names),
+        digits)
+
+def _settle_task(
+        balance: np.ndarray,
+        exact: bool,
+        method: str = 'greedy') -> List[Transfer]:
+    """Settles the balance vector of a single currency in a worker process.
+
+    Args:
+        balance: The balance vector of the currency.
+        exact: Whether the balance is made of integer minor units.
+        method: Either "greedy" (see _settle) or "optimal" (see
+            _settle_optimal).
+
+    Returns:
+        The transfers, see _settle.
+    """
+    settle = _settle_optimal if method == 'optimal' else _settle
+    if exact:
+        return settle(balance.tolist(), exact=True)
+    return settle(list(map(_hround, balance)))
@@ -1,17 +1,28 @@
 import csv
 import logging
-from typing import Dict, NewType, Set
+import os
+from typing import IO, Dict, Iterable, List, Mapping, Optional, Set, Union
 
 import numpy as np
-import pandas as pd
 
-from ._errors import FieldError, FileFormatError
+from . import _metrics
+from ._accumulator import BalanceAccumulator
+from ._costs import (
+    CORE_MAX_BYTES, _costs_chunks_reader, _costs_ledger_reader,
+    _costs_table_reader, _csv_lines)
+from ._errors import FileFormatError, RowError
+from ._lazy import pd
+from ._ledger import Ledger
+from ._parallel import _executor
+from ._settlement import Settlement, _hround
 from ._types import Email, Matrix, Name, Table
 
 FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-logging.basicConfig(format=FORMAT, level=logging.INFO)
+# The logger is silent unless the application configures logging (e.g. with
+# `reimburser --verbose`), and the messages are only formatted if they are
+# actually logged.
 logger = logging.getLogger(__name__)
-logger.disabled = True
+logger.addHandler(logging.NullHandler())
 
 class ReimburserHelper:
     """A helper class containing all the helper functions used in Reimburser. 
@@ -35,39 +46,322 @@ class ReimburserHelper:
 
         Raises:
             FileFormatError: The input file is not formatted as a csv.
+            RowError: A row doesn't have exactly 2 fields.
         """
         if not participants_file.endswith('.csv'):
             raise FileFormatError('The input file is not formatted as a csv.')
-        emails = dict()
 
-        participants = pd.read_csv(participants_file)
-        for i, (participant, email) in participants.iterrows():
-            emails[participant.strip()] = email.strip()
+        with _metrics.timer('read_participants'), \
+                open(participants_file, newline='') as csv_f:
+            emails: Dict[Name, Email] = _emails_reader(csv_f,
+                                                       participants_file)
 
+        return emails
+
+    @staticmethod
+    def email_records_getter(
+            participants: Union[Mapping, Table, Iterable, IO]) \
+            -> Dict[Name, Email]:
+        """Reads the participants and their emails from memory, or from a csv
+        stream.
+
+        Args:
+            participants: Either a dict mapping each participant's name to
+                their email, a pandas DataFrame with the columns
+                [participant, email], an iterable of (participant, email)
+                pairs, or a csv stream (text or binary) laid out like the
+                participants file.
+
+        Returns:
+            A dict mapping each participant's name to the accompanying email.
+
+        Raises:
+            RowError: A record doesn't have exactly 2 fields.
         """
-        with open(participants_file, 'r') as csv_f:
-            header_bool = csv.Sniffer().has_header(csv_f.read(1024))
-            csv_f.seek(0)
-            csv_reader = csv.reader(csv_f)
-            if header_bool:
-                logger.info('header detected')
-                next(csv_reader) # ignore header
+        with _metrics.timer('read_participants'):
+            if hasattr(participants, 'read'):
+                return _emails_reader(
+                    _csv_lines(participants),
+                    getattr(participants, 'name', '<stream>'))
+
+            if isinstance(participants, Mapping):
+                records: Iterable = participants.items()
+            elif hasattr(participants, 'itertuples'):
+                records = participants.itertuples(index=False)
             else:
-                logger.info('header not detected')
+                records = participants
+            emails = dict()
+            for i, record in enumerate(records, 1):
+                if len(record) != 2:
+                    raise RowError('<records>', i,
+                                   f'expected 2 fields, saw {len(record)}',
+                                   'Record')
+                participant, email = record
+                emails[str(participant).strip()] = str(email).strip()
+
+        return emails
+
+    @staticmethod
+    def settlements_getter(
+            costs_file: str,
+            participants: List[Name],
+            primary_currency: str,
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            workers: Optional[int] = None,
+            settle: str = 'greedy',
+            csv_engine: str = 'c') -> (Ledger, Dict[str, Settlement]):
+        """Reads a csv file listing the trip costs information and settles
+        each currency.
+
+        See reimbs_mats_getter for the format of the csv file. Rather than a
+        dense cost matrix, each currency is settled into a sparse list of
+        transfers, which can be turned into a cost matrix on demand.
+
+        The costs are encoded into a Ledger, with the participants as its
+        name table. Small costs files are read without pandas, see
+        _costs_ledger_reader, and the larger ones with csv_engine, see
+        _costs_table_reader.
+        By default, the balances are computed with floats and rounded to the
+        cent. In exact mode, the costs are converted to integer minor units
+        instead, and split, balanced and settled with integers only.
+
+        Args:
+            costs_file: the csv file listing the trip costs information.
+            participants: the participants of the trip, ordered by id
+            primary_currency: the primary currency used on the trip
+            exact: whether to compute the settlements in integer minor units
+            minor_digits: overrides of the number of minor unit digits of
+                each currency, used in exact mode (see _money.MINOR_DIGITS)
+            workers: the number of processes the currencies are fanned out
+                to, or None to process them serially
+            settle: how to settle each currency, either "greedy" or
+                "optimal" (see BalanceAccumulator.settle)
+            csv_engine: the parser pandas reads large costs files with,
+                either "c" or "pyarrow" (see _costs.CSV_ENGINES)
+
+        Returns:
+            This function returns two objects. The first object is the
+            ledger of the costs, which turns into the cost table described in
+            reimbs_mats_getter with to_frame. The second object is a dict
+            mapping a currency code to the corresponding Settlement.
+
+        Raises:
+            FieldError: The input table is missing required columns.
+            FileFormatError: The input file is not formatted as a csv.
+            KeyError: A reimbursee or reimburser is not a participant.
+            RowError: A cost is missing or not a number.
+        """
+        ledger: Ledger = ReimburserHelper.ledger_getter(
+            costs_file,
+            participants,
+            primary_currency,
+            csv_engine)
+
+        return ledger, ReimburserHelper.ledger_settlements_getter(
+            ledger,
+            exact,
+            minor_digits,
+            workers,
+            settle)
+
+    @staticmethod
+    def ledger_getter(
+            costs_file: str,
+            participants: List[Name],
+            primary_currency: str,
+            csv_engine: str = 'c') -> Ledger:
+        """Reads a csv file listing the trip costs information into a
+        Ledger, see settlements_getter.
+
+        Args:
+            costs_file: the csv file listing the trip costs information.
+            participants: the participants of the trip, ordered by id
+            primary_currency: the primary currency used on the trip
+            csv_engine: the parser pandas reads large costs files with,
+                either "c" or "pyarrow" (see _costs.CSV_ENGINES)
+
+        Returns:
+            The ledger of the costs, with the participants as its name table.
 
-            for row in csv_reader:
-                participant, email = map(str.strip, row) # remove whitespace
-                logger.info(f'recording {participant}, email {email}')
-                emails[participant] = email
+        Raises:
+            FieldError: The input table is missing required columns.
+            FileFormatError: The input file is not formatted as a csv.
+            KeyError: A reimbursee is not a participant.
+            RowError: A cost is missing or not a number.
         """
+        if not costs_file.endswith('.csv'):
+            raise FileFormatError('The input file is not formatted as a csv.')
+
+        names: List[Name] = list(participants)
+        if os.path.getsize(costs_file) <= CORE_MAX_BYTES:
+            return _costs_ledger_reader(costs_file, primary_currency, names)
+        return Ledger.from_frame(
+            _costs_table_reader(costs_file, primary_currency, csv_engine),
+            names)
+
+    @staticmethod
+    def balances_getter(
+            costs_files: List[str],
+            participants: List[Name],
+            primary_currency: str,
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            workers: Optional[int] = None,
+            csv_engine: str = 'c') -> BalanceAccumulator:
+        """Reads the shards of a trip's costs and accumulates their balances,
+        without settling them.
+
+        Each costs file is read and balanced on its own, in a pool of
+        worker processes if workers is given, and only its balances make
+        it back to be merged (see BalanceAccumulator.merge). In exact mode,
+        the minor units left over from splitting a cost rotate with its row
+        number within its own file, so the files may settle a few minor
+        units apart from their concatenation (though always to the same
+        transfers, whichever way they are grouped).
+
+        Args:
+            costs_files: the csv files listing the trip costs information.
+            participants: the participants of the trip, ordered by id
+            primary_currency: the primary currency used on the trip
+            exact: whether to compute the balances in integer minor units
+            minor_digits: overrides of the number of minor unit digits of
+                each currency, used in exact mode (see _money.MINOR_DIGITS)
+            workers: the number of processes the files are fanned out to, or
+                None to read them serially
+            csv_engine: the parser pandas reads large costs files with,
+                either "c" or "pyarrow" (see _costs.CSV_ENGINES)
+
+        Returns:
+            The balances of all the costs files.
+
+        Raises:
+            FieldError: An input table is missing required columns.
+            FileFormatError: An input file is not formatted as a csv.
+            KeyError: A reimbursee or reimburser is not a participant.
+            RowError: A cost is missing or not a number.
+        """
+        names: List[Name] = list(participants)
+        accumulator = BalanceAccumulator(names, exact, minor_digits)
+        with _executor(workers) as executor:
+            if executor is None:
+                shards: Iterable = (
+                    (_file_balances(costs_file, names, primary_currency,
+                                    exact, minor_digits, csv_engine), None)
+                    for costs_file in costs_files)
+            else:
+                # The metrics of each file are handed back along with its
+                # balances.
+                n: int = len(costs_files)
+                shards = executor.map(
+                    _metrics.collected,
+                    [_metrics.active()] * n,
+                    [_file_balances] * n,
+                    costs_files,
+                    [names] * n,
+                    [primary_currency] * n,
+                    [exact] * n,
+                    [minor_digits] * n,
+                    [csv_engine] * n)
+            for shard, metrics in shards:
+                accumulator.merge(BalanceAccumulator.from_dict(shard))
+                _metrics.merge(metrics)
+
+        return accumulator
+
+    @staticmethod
+    def ledger_settlements_getter(
+            ledger: Ledger,
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            workers: Optional[int] = None,
+            settle: str = 'greedy') -> Dict[str, Settlement]:
+        """Settles each currency of a ledger, however it was read.
+
+        Args:
+            ledger: the costs of the trip, with the participants as its name
+                table
+            exact: whether to compute the settlements in integer minor units
+            minor_digits: overrides of the number of minor unit digits of
+                each currency, used in exact mode (see _money.MINOR_DIGITS)
+            workers: the number of processes the currencies are fanned out
+                to, or None to process them serially
+            settle: how to settle each currency, either "greedy" or
+                "optimal" (see BalanceAccumulator.settle)
+
+        Returns:
+            A dict mapping a currency code to the corresponding Settlement.
+
+        Raises:
+            KeyError: A reimburser is not a participant.
+        """
+        accumulator = BalanceAccumulator(ledger.names, exact, minor_digits)
+        with _executor(workers) as executor:
+            accumulator.add(ledger, executor)
+            return accumulator.settle(executor, settle)
+
+    @staticmethod
+    def streamed_settlements_getter(
+            costs_file: str,
+            participants: List[Name],
+            primary_currency: str,
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            chunksize: int = 100_000,
+            workers: Optional[int] = None,
+            settle: str = 'greedy') -> (Table, Dict[str, Settlement]):
+        """Reads a csv file listing the trip costs information in chunks and
+        settles each currency.
+
+        This is the same as settlements_getter, except that the costs file is
+        read chunksize rows at a time, and each chunk is folded into the
+        balances of its currencies before the next one is read. The cost
+        table is therefore never held in memory as a whole, and a summary of
+        the costs is returned in its stead.
+
+        Args:
+            costs_file: the csv file listing the trip costs information.
+            participants: the participants of the trip, ordered by id
+            primary_currency: the primary currency used on the trip
+            exact: whether to compute the settlements in integer minor units
+            minor_digits: overrides of the number of minor unit digits of
+                each currency, used in exact mode (see _money.MINOR_DIGITS)
+            chunksize: the number of rows read at a time
+            workers: the number of processes the currencies are fanned out
+                to, or None to process them serially
+            settle: how to settle each currency, either "greedy" or
+                "optimal" (see BalanceAccumulator.settle)
+
+        Returns:
+            This function returns two objects. The first object is a summary
+            of the cost table, a pandas DataFrame with the columns [currency,
+            transactions, cost]. The second object is a dict mapping a
+            currency code to the corresponding Settlement.
+
+        Raises:
+            FieldError: The input table is missing required columns.
+            FileFormatError: The input file is not formatted as a csv.
+            RowError: A cost is missing or not a number.
+        """
+        accumulator = BalanceAccumulator(
+            list(participants),
+            exact,
+            minor_digits)
+        with _executor(workers) as executor:
+            for chunk in _costs_chunks_reader(costs_file, primary_currency,
+                                              chunksize):
+                accumulator.add(chunk, executor)
+            settlements = accumulator.settle(executor, settle)
+
+        return accumulator.summary(), settlements
 
-        return emails
 
     @staticmethod
     def reimbs_mats_getter(
             costs_file: str, 
             participants: Set[str], 
-            primary_currency: str) -> (Table, Dict[str, Matrix]):
+            primary_currency: str,
+            engine: str = 'vectorized') -> (Table, Dict[str, Matrix]):
         """Reads a csv file listing the trip costs information.
 
         Takes in a csv file that should at least have the columns [reimbursee,
@@ -78,6 +372,9 @@ class ReimburserHelper:
             costs_file: the csv file listing the trip costs information.
             participants: the set of participants of the trip
             primary_currency: the primary currency used on the trip
+            engine: the engine used to build the cost matrices, either
+                "vectorized" (batched balance accumulation) or "reference"
+                (the original row by row _matrix_maker)
 
         Returns:
             This function returns two objects. The first object is a pandas
@@ -89,57 +386,55 @@ class ReimburserHelper:
         Raises:
             FieldError: The input table is missing required columns.
             FileFormatError: The input file is not formatted as a csv.
+            ValueError: The engine is neither vectorized nor reference.
         """
-        if not costs_file.endswith('.csv'):
-            raise FileFormatError('The input file is not formatted as a csv.')
-
+        if engine not in ('vectorized', 'reference'):
+            raise ValueError('Engine must either be vectorized or reference.')
+
+        if engine == 'vectorized':
+            ledger, settlements = ReimburserHelper.settlements_getter(
+                costs_file,
+                list(participants),
+                primary_currency)
+            reimbs_matrices = {c: settlement.to_matrix()
+                               for c, settlement in settlements.items()}
+            return ledger.to_frame(), reimbs_matrices
+
+        names: List[Name] = list(participants)
         reimbs_matrices = dict()
-        table: pd.DataFrame = pd.read_csv(costs_file)
-        # Ensure the table columns are lowercase for simplified operations later.
-        lowercased = dict(zip(table.columns, map(str.lower, table.columns)))
-        table.rename(columns=lowercased, inplace=True)
-
-        columns = [
-            'reimbursee', 
-            'cost',
-            'currency',
-            'reimbursers',
-        ]
-
-        if 'notes' in table:
-            table.fillna(value={'notes': ''}, inplace=True)
-            columns.append('notes')
-
-        if 'currency' not in table:
-            logger.info('table does not have the column "currency"')
-            table['currency'] = primary_currency
-        else:
-            logger.info('table has the column "currency"')
-            table.fillna(
-                    value={'currency': primary_currency},
-                    inplace=True)
-
-
-        table = table[columns]
-
-        table_columns = set(table.columns)
-        # It doesn't really matter if there are extra columns, since the code
-        # will just ignore them. However, there will be a problem if the input
-        # file doesn't have the required columns.
-        if not table_columns >= set(columns):
-            raise FieldError('The input table is missing required columns.')
+        table: Table = _costs_table_reader(costs_file, primary_currency)
 
         all_currencies: np.ndarray = table['currency'].drop_duplicates().values
         for c in all_currencies:
             sub_table = table.query(f'currency == "{c}"').drop(columns=['currency'])
             # Make sure the order is right
             sub_table = sub_table[['reimbursee', 'cost', 'reimbursers']]
-            logger.info(f'making {c} cost matrix') 
-            reimbs_matrices[c] = _matrix_maker(sub_table, participants)
+            logger.info('making %s cost matrix', c)
+            reimbs_matrices[c] = _matrix_maker(sub_table, names)
 
         return table, reimbs_matrices
 
-def _matrix_maker(sub_table: Table, participants: Set[str]) -> Matrix:
+def _emails_reader(lines: Iterable[str], source: str) -> Dict[Name, Email]:
+    """Reads the lines of a participants file, see email_getter.
+
+    Raises:
+        RowError: A row doesn't have exactly 2 fields.
+    """
+    emails = dict()
+    # As with pd.read_csv, the first row is taken as the header, and blank
+    # lines are skipped.
+    csv_reader = csv.reader(lines)
+    next(csv_reader, None)
+    for row in filter(None, csv_reader):
+        if len(row) != 2:
+            raise RowError(source, csv_reader.line_num,
+                           f'expected 2 fields, saw {len(row)}')
+        participant, email = row
+        emails[participant.strip()] = email.strip()
+
+    return emails
+
+def _matrix_maker(sub_table: Table, participants: List[str]) -> Matrix:
     """Creates the cost matrix for a given cost table for all participants.
 
     Suppose there are N participants. Then the cost matrix C is defined as an 
@@ -159,11 +454,14 @@ def _matrix_maker(sub_table: Table, participants: Set[str]) -> Matrix:
     who benefited from the transaction). Finally, a reduction algorithm is run
     over the cost matrix to reduce the number of reimbursements.
 
+    This is the reference implementation of the vectorized engine in
+    _balance, and is kept around to check the latter against.
+
     Args:
         sub_table: A pandas DataFrame with the columns [reimbursee, cost,
         reimbursers]. This table should contain all transactions related to a
         specific currency. 
-        participants: A set of all the participants.
+        participants: A list of all the participants.
 
     Returns:
         Returns the cost matrix, which is a pandas DataFrame.
@@ -174,9 +472,12 @@ def _matrix_maker(sub_table: Table, participants: Set[str]) -> Matrix:
         return True if 'not' in string else False
 
     num_participants = len(participants)
+    # Checked once rather than for every row.
+    debug: bool = logger.isEnabledFor(logging.DEBUG)
     for (i, (creditor, credit, debtors)) in sub_table.iterrows():
-        logger.info(f'{creditor} is the reimbursee with {credit} currency'
-                    + ' credits')
+        if debug:
+            logger.debug('%s is the reimbursee with %s currency credits',
+                         creditor, credit)
         #reimbursers = set(participants)
         if debtors is np.nan:
             # If the creditor paid for everyone, the debt is equally split
@@ -202,10 +503,11 @@ def _matrix_maker(sub_table: Table, participants: Set[str]) -> Matrix:
                 debt = credit / len(debtor_set)
                 reimbursers: Set = debtor_set - {creditor}
 
-        logger.info(f'the reimbursers are {", ".join(reimbursers)},'
-                    + f' each of them owe the reimbursee {debt}')
+        if debug:
+            logger.debug('the reimbursers are %s, each of them owe the '
+                         'reimbursee %s', ', '.join(reimbursers), debt)
 
-        C.loc[creditor, reimbursers] += debt
+        C.loc[creditor, list(reimbursers)] += debt
 
     _reduction_algorithm(C)
 
@@ -235,39 +537,56 @@ def _reduction_algorithm(C: Matrix) -> None:
     balance = (credits - debts).apply(_hround)
 
     C.loc[:, :] = np.nan # reset the matrix
+    debug: bool = logger.isEnabledFor(logging.DEBUG)
 
-    logger.info(f'the balance is zero: {abs(_hround(sum(balance))) == 0.0}')
+    if logger.isEnabledFor(logging.INFO):
+        logger.info('the balance is zero: %s',
+                    abs(_hround(sum(balance))) == 0.0)
     
     while not (balance == 0.0).all():
         debtor: str = balance.idxmin()
-        logger.info(f'{debtor}\'s total debt amounts to {balance[debtor]}' \
-                    + ' currency credits')
+        if debug:
+            logger.debug('%s\'s total debt amounts to %s currency credits',
+                         debtor, balance[debtor])
 
         while balance[debtor] < 0.0:
             creditor: str = balance.idxmax()
-            logger.info(f'{creditor} has been chosen')
+            if debug:
+                logger.debug('%s has been chosen', creditor)
 
             if balance[creditor] < abs(balance[debtor]):
-                logger.info(f'{debtor}\'s debt will be partially repaid by' \
-                            + f' paying {creditor} {balance[creditor]}' \
-                            + ' currency credits')
+                if debug:
+                    logger.debug('%s\'s debt will be partially repaid by '
+                                 'paying %s %s currency credits',
+                                 debtor, creditor, balance[creditor])
                 C.loc[creditor, debtor] = balance[creditor]
                 balance[debtor] = _hround(balance[debtor] 
                         + balance[creditor])
                 balance[creditor] = 0.0
             else:
-                logger.info(f'{debtor}\'s debt will be fully repaid by' \
-                            + f' paying {creditor} {-balance[debtor]}' \
-                            + ' currency credits')
+                if debug:
+                    logger.debug('%s\'s debt will be fully repaid by paying '
+                                 '%s %s currency credits',
+                                 debtor, creditor, -balance[debtor])
                 C.loc[creditor, debtor] = -balance[debtor]
                 balance[creditor] = _hround(balance[creditor] 
                         + balance[debtor])
                 balance[debtor] = 0.0
 
-def _hround(n: float, r: int = 2) -> float:
-    """Implements half round up."""
-    diff = round((round(n, r+1) - round(n, r)) * 10 ** (r+1))
-    if diff >= 5:
-        return n + (10 - diff) * 10 ** -(r+1)
-    else:
-        return round(n, r)
+def _file_balances(
+        costs_file: str,
+        names: List[Name],
+        primary_currency: str,
+        exact: bool,
+        minor_digits: Optional[Dict[str, int]],
+        csv_engine: str) -> Dict:
+    """Accumulates the balances of a single costs file, in a worker process
+    of balances_getter, and hands them back laid out by to_dict."""
+    accumulator = BalanceAccumulator(names, exact, minor_digits)
+    accumulator.add(ReimburserHelper.ledger_getter(
+        costs_file,
+        names,
+        primary_currency,
+        csv_engine))
+
+    return accumulator.to_dict()
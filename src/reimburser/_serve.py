@@ -0,0 +1,359 @@
+import io
+import json
+import logging
+import os
+import signal
+import socketserver
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from ._errors import FieldError, FileFormatError, OutboxError
+from ._types import FilePath
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# The largest job accepted, in bytes of JSON.
+DEFAULT_MAX_BYTES = 64 << 20
+
+# The errors a job raises because of what it was given, answered with a 400
+# rather than a 500. RowError is a ValueError.
+_JOB_ERRORS = (FieldError, FileFormatError, OutboxError, KeyError, TypeError,
+               ValueError)
+
+def _warm_up() -> None:
+    """Imports the engine in a worker process, so that the first job it runs
+    doesn't pay for it."""
+    # Ctrl-C reaches the workers as well, but it's up to the server to stop
+    # them.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from . import _emailer, reimburser  # noqa: F401
+
+def _ready() -> bool:
+    return True
+
+def _settle_job(job: Dict, outbox_dir: Optional[FilePath] = None) -> Dict:
+    """Settles a trip sent to the server, in one of its worker processes.
+
+    Args:
+        job: The JSON object of the request, see SettlementServer.
+        outbox_dir: The directory the outboxes are written into, if spooling
+            emails is allowed.
+
+    Returns:
+        The JSON object of the response.
+
+    Raises:
+        FieldError: The costs are missing required columns.
+        KeyError: A field of the job is missing, or a reimbursee or
+            reimburser is not a participant.
+        OutboxError: The outbox already holds emails.
+        RowError: A cost or participant is malformed.
+        TypeError: A field of the job is of the wrong type.
+        ValueError: A setting of the job is invalid.
+    """
+    from .reimburser import Reimburser
+
+    if not isinstance(job, dict):
+        raise TypeError('The job must be a JSON object.')
+    # A csv document is read just like a csv stream.
+    participants = job['participants']
+    if isinstance(participants, str):
+        participants = io.StringIO(participants)
+    costs = job['costs']
+    if isinstance(costs, str):
+        costs = io.StringIO(costs)
+
+    reimbs: Reimburser = Reimburser.from_records(
+        participants,
+        costs,
+        job.get('title', 'Fun Trip'),
+        job.get('currency', 'USD'),
+        bool(job.get('exact', False)),
+        job.get('minor_digits'),
+        settle=job.get('settle', 'greedy'),
+        columns=job.get('columns'))
+    response: Dict = _trip_response(reimbs)
+
+    if job.get('outbox') is not None:
+        response['spooled'] = reimbs.spool_emails(
+            _outbox_file(outbox_dir, job['outbox']),
+            job['sender'])
+
+    return response
+
+def _trip_response(reimbs) -> Dict:
+    """Lays out the transfers and the statements of a trip as JSON."""
+    settlements = dict()
+    for currency, settlement in reimbs.settlements.items():
+        names: List[str] = settlement.names
+        settlements[currency] = {
+            'digits': settlement.digits,
+            'transfers': [
+                {'debtor': names[debtor],
+                 'creditor': names[creditor],
+                 'amount': round(amount, settlement.digits)}
+                for debtor, creditor, amount in zip(
+                    settlement.debtors.tolist(),
+                    settlement.creditors.tolist(),
+                    settlement.amounts.tolist())],
+        }
+
+    statements = {
+        name: {
+            'payables': [
+                {'counterparty': statement.counterparty,
+                 'amount': round(statement.amount, statement.digits),
+                 'currency': statement.currency}
+                for statement in reimbs.statements.payables(name)],
+            'receivables': [
+                {'counterparty': statement.counterparty,
+                 'amount': round(statement.amount, statement.digits),
+                 'currency': statement.currency}
+                for statement in reimbs.statements.receivables(name)],
+        }
+        for name in reimbs.emails
+    }
+
+    return {
+        'title': reimbs.trip_title,
+        'rows': reimbs.rows,
+        'settlements': settlements,
+        'statements': statements,
+    }
+
+def _outbox_file(outbox_dir: Optional[FilePath], outbox: str) -> FilePath:
+    """Resolves the outbox a job asks for, which has to be a plain file name
+    within the outbox directory."""
+    if outbox_dir is None:
+        raise ValueError('Spooling emails requires the server to be started '
+                         'with an outbox directory.')
+    if not isinstance(outbox, str) or not outbox \
+            or os.path.basename(outbox) != outbox or outbox.startswith('.'):
+        raise ValueError('The outbox must be a file name.')
+
+    return FilePath(os.path.join(outbox_dir, outbox))
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _JobHandler(BaseHTTPRequestHandler):
+    """Answers the requests sent to a SettlementServer."""
+    server_version = 'reimburser'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        if self.path != '/health':
+            self._reply(404, {'error': f'No such endpoint: {self.path}.'})
+            return
+
+        self._reply(200, {'status': 'ok',
+                          'jobs': self.server.settlement_server.jobs})
+
+    def do_POST(self) -> None:
+        if self.path != '/settle':
+            self._reply(404, {'error': f'No such endpoint: {self.path}.'})
+            return
+
+        settlement_server: SettlementServer = self.server.settlement_server
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self._reply(411, {'error': 'The job needs a Content-Length.'})
+            self.close_connection = True
+            return
+        if length < 0:
+            self._reply(400, {'error': 'The Content-Length is negative.'})
+            self.close_connection = True
+            return
+        if length > settlement_server.max_bytes:
+            self._reply(413, {'error': 'The job is too large.'})
+            self.close_connection = True
+            return
+
+        try:
+            job = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._reply(400, {'error': f'The job is not valid JSON: {e}.'})
+            return
+
+        try:
+            response: Dict = settlement_server.settle(job)
+        except _JOB_ERRORS as e:
+            self._reply(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+        except Exception as e:
+            logger.exception('job failed')
+            self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+
+        self._reply(200, response)
+
+    def _reply(self, status: int, body: Dict) -> None:
+        data: bytes = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # The clients of a Unix socket have no address.
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return 'local'
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info('%s %s', self.address_string(), format % args)
+
+class SettlementServer:
+    """A local JSON API that settles trips in a pool of warm worker
+    processes.
+
+    The engine is imported once in each worker process when the server
+    starts, rather than on every request. Requests are answered
+    concurrently, each on its own thread, and as many trips as there are
+    workers are settled at once (the others wait for a worker to be free).
+
+    POST /settle takes a JSON object with the trip:
+
+        participants: An object mapping each participant to their email, a
+            list of [participant, email] pairs, or the participants file as
+            a string.
+        costs: A list of objects keyed by the columns of the costs file, a
+            list of lists whose first one is the header (unless columns is
+            given), or the costs file as a string.
+        columns, title, currency, exact, minor_digits, settle: Optional, see
+            Reimburser.from_records.
+        outbox, sender: Optional, the file name of an outbox in the outbox
+            directory to write the emails into (sent later on by `reimburser
+            deliver`), and the email account they are sent from.
+
+    and answers with the transfers of each currency and the statement of
+    each participant. GET /health answers whether the server is up.
+
+    Attributes:
+        jobs: The number of worker processes.
+        outbox_dir: The directory the outboxes are written into, if any.
+        max_bytes: The largest job accepted, in bytes.
+        address: Either the (host, port) or the Unix socket the server
+            listens on.
+        settle: Settles a job in the worker pool.
+        serve_forever: Answers requests until shut down.
+        shutdown: Stops serve_forever.
+        close: Closes the socket and the worker pool.
+    """
+    def __init__(
+            self,
+            address: Union[Tuple[str, int], FilePath] = (DEFAULT_HOST,
+                                                         DEFAULT_PORT),
+            jobs: Optional[int] = None,
+            outbox_dir: Optional[FilePath] = None,
+            max_bytes: int = DEFAULT_MAX_BYTES):
+        """Initializes SettlementServer, and starts its workers.
+
+        Args:
+            address: Either the (host, port) to listen on (port 0 picks a
+                free one) or the path of a Unix socket.
+            jobs: The number of worker processes (defaults to the number of
+                CPUs).
+            outbox_dir: The directory the outboxes are written into. Emails
+                are only spooled if it is given.
+            max_bytes: The largest job accepted, in bytes.
+        """
+        self.jobs: int = jobs or os.cpu_count() or 1
+        self.outbox_dir = outbox_dir
+        self.max_bytes = max_bytes
+
+        self._pool = ProcessPoolExecutor(self.jobs, initializer=_warm_up)
+        self._pool_lock = threading.Lock()
+        # The jobs submitted and not done yet, cancelled on close if they
+        # haven't started.
+        self._futures: Set[Future] = set()
+        # The workers are started (and the engine imported) right away.
+        for future in [self._pool.submit(_ready) for _ in range(self.jobs)]:
+            future.result()
+
+        try:
+            if isinstance(address, tuple):
+                self._httpd: socketserver.BaseServer = ThreadingHTTPServer(
+                    address, _JobHandler)
+                self.address = self._httpd.server_address[:2]
+            else:
+                # A socket left behind by a server that didn't shut down.
+                if os.path.exists(address):
+                    os.unlink(address)
+                self._httpd = _UnixHTTPServer(address, _JobHandler)
+                os.chmod(address, 0o600)
+                self.address = address
+        except BaseException:
+            self._pool.shutdown()
+            raise
+        self._httpd.settlement_server = self
+
+    def __enter__(self) -> 'SettlementServer':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def settle(self, job: Dict) -> Dict:
+        """Settles a job in the worker pool.
+
+        Args:
+            job: The JSON object of the request.
+
+        Returns:
+            The JSON object of the response.
+        """
+        pool: ProcessPoolExecutor = self._pool
+        try:
+            future: Future = pool.submit(_settle_job, job, self.outbox_dir)
+            with self._pool_lock:
+                self._futures.add(future)
+            future.add_done_callback(self._forget)
+            return future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for running out of memory), which
+            # breaks the pool for good, so a new one takes its place (once).
+            with self._pool_lock:
+                if self._pool is pool:
+                    logger.error('worker pool broken, restarting it')
+                    self._pool = ProcessPoolExecutor(self.jobs,
+                                                     initializer=_warm_up)
+            raise
+
+    def _forget(self, future: Future) -> None:
+        with self._pool_lock:
+            self._futures.discard(future)
+
+    def serve_forever(self) -> None:
+        """Answers requests until shutdown is called (or the process is
+        interrupted)."""
+        self._httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        """Stops serve_forever, from another thread."""
+        self._httpd.shutdown()
+
+    def close(self) -> None:
+        """Closes the socket and the worker pool."""
+        self._httpd.server_close()
+        if not isinstance(self.address, tuple):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+        # The jobs still waiting for a worker are dropped, rather than
+        # settled for clients that won't get an answer.
+        with self._pool_lock:
+            futures: List[Future] = list(self._futures)
+        for future in futures:
+            future.cancel()
+        self._pool.shutdown()
@@ -0,0 +1,352 @@
+import heapq
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from ._lazy import pd
+from ._types import Matrix, Name
+
+class Transfer(NamedTuple):
+    """A single reimbursement: the debtor pays the creditor the amount."""
+    debtor: int
+    creditor: int
+    amount: float
+
+class Settlement:
+    """The reimbursements of a single currency, stored sparsely.
+
+    The greedy reduction makes at most N-1 transfers between N participants,
+    so instead of an N-by-N cost matrix, the transfers are stored as three
+    parallel arrays (debtor id, creditor id, amount). The transfers of each
+    participant are looked up in a StatementIndex.
+
+    Attributes:
+        currency: The currency code of the reimbursements.
+        names: The participants' names, ordered by participant id.
+        debtors: The id of the debtor of each transfer.
+        creditors: The id of the creditor of each transfer.
+        amounts: The amount of each transfer.
+        digits: The number of minor unit digits the amounts are given to.
+        to_matrix: Builds the dense cost matrix.
+    """
+    def __init__(
+            self,
+            currency: str,
+            names: List[Name],
+            transfers: List[Transfer],
+            digits: int = 2,
+            minor_units: bool = False):
+        """Initializes Settlement.
+
+        Args:
+            currency: The currency code of the reimbursements.
+            names: The participants' names, ordered by participant id.
+            transfers: The transfers settling the participants' balances.
+            digits: The number of minor unit digits of the currency.
+            minor_units: Whether the transfer amounts are integer minor units,
+                in which case they are converted back to major units.
+        """
+        self.currency = currency
+        self.names = names
+        self.digits = digits
+
+        self.debtors = np.fromiter((t.debtor for t in transfers),
+                                   dtype=np.intp, count=len(transfers))
+        self.creditors = np.fromiter((t.creditor for t in transfers),
+                                     dtype=np.intp, count=len(transfers))
+        self.amounts = np.fromiter((t.amount for t in transfers),
+                                   dtype=float, count=len(transfers))
+        if minor_units:
+            self.amounts /= 10 ** digits
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def __repr__(self):
+        return f'{self.currency} settlement with {len(self)} reimbursements'
+
+    def to_matrix(self) -> Matrix:
+        """Builds the dense cost matrix, as described in _matrix_maker.
+
+        Returns:
+            The cost matrix, which is a pandas DataFrame.
+        """
+        C = np.full((len(self.names), len(self.names)), np.nan)
+        C[self.creditors, self.debtors] = self.amounts
+
+        return pd.DataFrame(C, index=self.names, columns=self.names)
+
+class Statement(NamedTuple):
+    """A reimbursement as seen by one of its two participants."""
+    counterparty: Name
+    amount: float
+    currency: str
+    digits: int
+
+class StatementIndex:
+    """The reimbursements of each participant, across all currencies.
+
+    The index is built once from the settlements, so that writing a
+    participant's statement only takes as long as their own reimbursements.
+
+    Attributes:
+        payables: Lists the reimbursements a participant has to pay.
+        receivables: Lists the reimbursements a participant is owed.
+    """
+    def __init__(self, settlements: Dict[str, Settlement]):
+        """Initializes StatementIndex.
+
+        Args:
+            settlements: A dict mapping a currency code to its settlement.
+        """
+        self._payables: Dict[Name, List[Statement]] = dict()
+        self._receivables: Dict[Name, List[Statement]] = dict()
+
+        # The statements are grouped by currency, then sorted by counterparty
+        # id, as in the matrices.
+        for currency, settlement in settlements.items():
+            names: List[Name] = settlement.names
+            debtors: List[int] = settlement.debtors.tolist()
+            creditors: List[int] = settlement.creditors.tolist()
+            amounts: List[float] = settlement.amounts.tolist()
+
+            for k in np.lexsort((settlement.creditors, settlement.debtors)):
+                self._payables.setdefault(names[debtors[k]], []).append(
+                    Statement(names[creditors[k]], amounts[k], currency,
+                              settlement.digits))
+            for k in np.lexsort((settlement.debtors, settlement.creditors)):
+                self._receivables.setdefault(names[creditors[k]], []).append(
+                    Statement(names[debtors[k]], amounts[k], currency,
+                              settlement.digits))
+
+    def payables(self, name: Name) -> List[Statement]:
+        """Lists the reimbursements a participant has to pay.
+
+        Args:
+            name: The name of the participant.
+
+        Returns:
+            The statements, where the counterparty is the creditor.
+        """
+        return self._payables.get(name, [])
+
+    def receivables(self, name: Name) -> List[Statement]:
+        """Lists the reimbursements a participant is owed.
+
+        Args:
+            name: The name of the participant.
+
+        Returns:
+            The statements, where the counterparty is the debtor.
+        """
+        return self._receivables.get(name, [])
+
+def _settle(balance: Sequence[float], exact: bool = False) -> List[Transfer]:
+    """Computes the reimbursements that settle the participants' balances.
+
+    This is the same greedy algorithm as _reduction_algorithm: the largest
+    debt is repaid with the largest credit(s) until the debt is repaid, and
+    this process continues until all debts are repaid. Ties are broken in
+    favor of the smallest id, just as idxmin and idxmax favor the first
+    label.
+
+    Instead of searching the whole balance for the largest debt and credit
+    for each transfer, the debtors and creditors are kept in two heaps, so
+    settling N participants takes O(N log N) time.
+
+    Args:
+        balance: The rounded net balance of each participant, ordered by
+            participant id. A positive element is a credit and a negative
+            element is a debt.
+        exact: Whether the balance is made of integer minor units, in which
+            case there is no need to round after each transfer.
+
+    Returns:
+        The list of transfers, in the order they were made.
+    """
+    rounder = _identity if exact else _hround
+
+    debtors = [(b, i) for i, b in enumerate(balance) if b < 0.0]
+    creditors = [(-b, i) for i, b in enumerate(balance) if b > 0.0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers: List[Transfer] = list()
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+
+        while debt < 0.0 and creditors:
+            credit, creditor = creditors[0]
+            credit = -credit
+
+            if credit < -debt:
+                # The debt is partially repaid, and the creditor is done.
+                transfers.append(Transfer(debtor, creditor, credit))
+                debt = rounder(debt + credit)
+                heapq.heappop(creditors)
+            else:
+                # The debt is fully repaid, and the creditor may still be
+                # owed by the next debtor.
+                transfers.append(Transfer(debtor, creditor, -debt))
+                credit = rounder(credit + debt)
+                if credit > 0.0:
+                    heapq.heapreplace(creditors, (-credit, creditor))
+                else:
+                    heapq.heappop(creditors)
+                debt = 0.0
+
+    return transfers
+
+# The ways of settling a currency, see _settle and _settle_optimal.
+SETTLE_METHODS = ('greedy', 'optimal')
+
+# The optimal settlement searches all the subsets of the participants left
+# once the pairs that settle each other are set aside, which doubles in time
+# and memory with each participant. Above this many participants, or once
+# the search has taken longer than this many seconds, the greedy settlement
+# is used instead.
+OPTIMAL_MAX_PARTICIPANTS = 20
+OPTIMAL_TIME_BUDGET = 1.0
+
+def _settle_optimal(
+        balance: Sequence[float],
+        exact: bool = False,
+        max_participants: int = OPTIMAL_MAX_PARTICIPANTS,
+        time_budget: float = OPTIMAL_TIME_BUDGET) -> List[Transfer]:
+    """Computes the fewest reimbursements that settle the participants'
+    balances.
+
+    A group of k participants whose balances add up to zero can be settled
+    with k - 1 transfers (e.g. by _settle), and not with fewer, since every
+    transfer settles at most one more participant. Settling the participants
+    therefore takes the fewest transfers when they are split into as many
+    zero-sum groups as possible. _settle doesn't look for such groups, and
+    may make a transfer between two groups that could each settle on their
+    own.
+
+    Pairs of balances that cancel each other out are always a group of their
+    own in some best split, so they are set aside first. The others are
+    split with a dynamic program over their subsets: the most zero-sum groups
+    a subset splits into is the most any of its subsets with one participant
+    less splits into, plus one if the subset itself adds up to zero. Each
+    group is then settled by _settle.
+
+    Args:
+        balance: The rounded net balance of each participant, see _settle.
+        exact: Whether the balance is made of integer minor units.
+        max_participants: The most participants (once the pairs are set
+            aside) the subsets are searched for.
+        time_budget: The most seconds the subsets are searched for.
+
+    Returns:
+        The list of transfers, or the transfers made by _settle if they are
+        just as few or the search is over budget.
+    """
+    greedy: List[Transfer] = _settle(balance, exact)
+    start: float = time.perf_counter()
+
+    # The search is done in integer minor units, as the float balances are
+    # rounded to the cent.
+    units: List[int] = [b if exact else round(b * 100) for b in balance]
+    transfers: List[Transfer] = list()
+    debtors: Dict[int, List[int]] = dict()
+    for i, u in enumerate(units):
+        if u < 0:
+            debtors.setdefault(-u, []).append(i)
+    paired = set()
+    for creditor, u in enumerate(units):
+        if u > 0 and debtors.get(u):
+            debtor: int = debtors[u].pop()
+            transfers.append(Transfer(debtor, creditor, balance[creditor]))
+            paired.update((debtor, creditor))
+
+    ids: List[int] = [i for i, u in enumerate(units)
+                      if u != 0 and i not in paired]
+    if len(ids) > max_participants:
+        return greedy
+    groups: Optional[List[List[int]]] = _zero_sum_groups(
+        [units[i] for i in ids],
+        start + time_budget)
+    if groups is None:
+        return greedy
+
+    for group in groups:
+        transfers.extend(
+            Transfer(ids[group[t.debtor]], ids[group[t.creditor]], t.amount)
+            for t in _settle([balance[ids[k]] for k in group], exact))
+
+    return transfers if len(transfers) < len(greedy) else greedy
+
+def _zero_sum_groups(
+        units: List[int],
+        deadline: float) -> Optional[List[List[int]]]:
+    """Splits the participants into as many zero-sum groups as possible.
+
+    If the balances don't add up to zero (i.e. rounding left a few cents
+    over), the participants that don't fit in any zero-sum group are put in
+    a group of their own.
+
+    Args:
+        units: The balance of each participant, in integer minor units.
+        deadline: The time.perf_counter() past which the search is given up.
+
+    Returns:
+        The groups, as lists of positions in units, or None if the search
+        went past the deadline.
+    """
+    n = len(units)
+    full = 1 << n
+
+    # The sum and size of every subset, each bit of a subset standing for a
+    # participant.
+    sums = np.zeros(full, dtype=np.int64)
+    sizes = np.zeros(full, dtype=np.int8)
+    for i, u in enumerate(units):
+        sums[1 << i:1 << (i + 1)] = sums[:1 << i] + u
+        sizes[1 << i:1 << (i + 1)] = sizes[:1 << i] + 1
+    zero = (sums == 0).astype(np.int8)
+
+    # The subsets are handled by size, all the subsets of a size at once,
+    # since each one only depends on the ones with one participant less.
+    by_size: np.ndarray = np.argsort(sizes, kind='stable')
+    bounds: np.ndarray = np.concatenate(
+        ([0], np.cumsum(np.bincount(sizes, minlength=n + 1))))
+    best = np.zeros(full, dtype=np.int8)
+    for size in range(1, n + 1):
+        if time.perf_counter() > deadline:
+            return None
+        subsets: np.ndarray = by_size[bounds[size]:bounds[size + 1]]
+        most = np.zeros(len(subsets), dtype=np.int8)
+        for i in range(n):
+            # Adding a participant rather than removing them leads to a
+            # bigger subset that is still 0, which does no harm.
+            np.maximum(most, best[subsets ^ (1 << i)], out=most)
+        best[subsets] = most + zero[subsets]
+
+    # The participants are taken out one at a time along the best path, and
+    # the zero-sum subsets met on the way are where the groups split.
+    splits: List[int] = [full - 1]
+    subset = full - 1
+    while subset:
+        rest = best[subset] - zero[subset]
+        for i in range(n):
+            if subset & (1 << i) and best[subset ^ (1 << i)] == rest:
+                subset ^= 1 << i
+                break
+        if subset and zero[subset]:
+            splits.append(subset)
+    splits.append(0)
+
+    return [[i for i in range(n) if (outer ^ inner) & (1 << i)]
+            for outer, inner in zip(splits, splits[1:])]
+
+def _identity(n): return n
+
+def _hround(n: float, r: int = 2) -> float:
+    """Implements half round up."""
+    diff = round((round(n, r+1) - round(n, r)) * 10 ** (r+1))
+    if diff >= 5:
+        return n + (10 - diff) * 10 ** -(r+1)
+    else:
+        return round(n, r)
@@ -0,0 +1,264 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+from concurrent.futures import Executor
+from typing import Dict, List, Optional
+
+from . import _metrics
+from ._accumulator import BalanceAccumulator
+from ._costs import (
+    _costs_table_cleaner, _read_options, _row_errors, _validate_header)
+from ._errors import StateError
+from ._lazy import pd
+from ._types import FilePath, Name
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Bumped whenever the layout of the state file changes.
+STATE_VERSION = 1
+# Number of bytes before the offset kept to check the consumed part of the
+# costs file hasn't been rewritten.
+FINGERPRINT_SIZE = 64
+
+class IncrementalState:
+    """The persisted state of an append-only costs file.
+
+    The state records the balances of each currency along with how much of
+    the costs file has already been folded into them, so that only the rows
+    appended since can be read the next time around.
+
+    Attributes:
+        accumulator: The balances of the rows consumed so far.
+        primary_currency: The primary currency used during the trip.
+        header: The (lowercased) header of the costs file.
+        offset: The number of bytes of the costs file consumed so far.
+        rows: The number of rows of the costs file consumed so far.
+        terminated: Whether the part of the costs file consumed so far ends
+            with a newline.
+        consume: Folds the rows appended to the costs file.
+        save: Writes the state to a file.
+        load: Reads the state from a file.
+    """
+    def __init__(
+            self,
+            accumulator: BalanceAccumulator,
+            primary_currency: str,
+            header: Optional[List[str]] = None,
+            offset: int = 0,
+            rows: int = 0,
+            fingerprint: str = '',
+            terminated: bool = True):
+        """Initializes IncrementalState.
+
+        Args:
+            accumulator: The balances of the rows consumed so far.
+            primary_currency: The primary currency used during the trip.
+            header: The header of the costs file, if any rows were consumed.
+            offset: The number of bytes of the costs file consumed so far.
+            rows: The number of rows of the costs file consumed so far.
+            fingerprint: The hex of the last bytes consumed.
+            terminated: Whether the bytes consumed end with a newline.
+        """
+        self.accumulator = accumulator
+        self.primary_currency = primary_currency
+        self.header = header
+        self.offset = offset
+        self.rows = rows
+        self._fingerprint = fingerprint
+        self.terminated = terminated
+
+    def consume(
+            self,
+            costs_file: FilePath,
+            executor: Optional[Executor] = None) -> int:
+        """Folds the rows appended to the costs file since the last time.
+
+        Only complete rows are consumed, so a row that is still being
+        written will be picked up the next time around. The last row of the
+        costs file doesn't need to end with a newline, as long as it has all
+        its fields (and no quote left open), in which case the next row
+        appended has to start on a line of its own.
+
+        Args:
+            costs_file: The csv file listing all the expenses from the trip.
+            executor: A process pool to compute the balance of each currency
+                in parallel, if any.
+
+        Returns:
+            The number of new rows.
+
+        Raises:
+            FieldError: The costs file is missing required columns.
+            RowError: A cost is missing or not a number.
+            StateError: The consumed part of the costs file has changed.
+        """
+        with open(costs_file, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < self.offset or self._tail(f) != self._fingerprint:
+                raise StateError('The costs file has changed since it was '
+                                 'last read. Please remove the state file.')
+
+            f.seek(self.offset)
+            data: bytes = f.read()
+
+        if not self.terminated and data and not data.startswith(
+                (b'\n', b'\r\n')):
+            raise StateError('The last row of the costs file has changed '
+                             'since it was last read. Please remove the '
+                             'state file.')
+
+        header: Optional[List[str]] = self.header
+        if header is None:
+            header = _validate_header(next(csv.reader(
+                [data.split(b'\n', 1)[0].decode()]), []))
+
+        # Leave out the last row if it isn't complete yet.
+        end: int = _rows_end(data, len(header))
+        if data[end:].strip():
+            logger.warning('the last row of %s is incomplete, leaving it for '
+                           'the next time', costs_file)
+        data = data[:end]
+        if not data.strip():
+            return 0
+
+        with _metrics.timer('read'), \
+                _row_errors(costs_file, header, self.offset):
+            options: Dict = _read_options(header)
+            if self.header is not None:
+                # Only the first rows consumed start with the header.
+                options['header'] = None
+            delta: pd.DataFrame = pd.read_csv(io.BytesIO(data), **options)
+            # The index is the row number of each cost in the whole file.
+            delta.index = pd.RangeIndex(self.rows, self.rows + len(delta))
+            delta = _costs_table_cleaner(delta, self.primary_currency)
+        _metrics.count('rows_parsed', len(delta))
+
+        self.accumulator.add(delta, executor)
+        self.header = header
+        self.offset += len(data)
+        self.rows += len(delta)
+        self.terminated = data.endswith(b'\n')
+        self._fingerprint = (bytes.fromhex(self._fingerprint)
+                             + data)[-FINGERPRINT_SIZE:].hex()
+
+        return len(delta)
+
+    def save(self, state_file: FilePath) -> None:
+        """Writes the state to a file, replacing it atomically.
+
+        Args:
+            state_file: The file to write the state to.
+        """
+        state = {
+            'version': STATE_VERSION,
+            'primary_currency': self.primary_currency,
+            'header': self.header,
+            'offset': self.offset,
+            'rows': self.rows,
+            'fingerprint': self._fingerprint,
+            'terminated': self.terminated,
+            **self.accumulator.to_dict(),
+        }
+
+        temp_file = f'{state_file}.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_file, state_file)
+
+    @classmethod
+    def load(
+            cls,
+            state_file: FilePath,
+            names: List[Name],
+            primary_currency: str,
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None) \
+            -> 'IncrementalState':
+        """Reads the state from a file, or starts a new one if the file
+        doesn't exist.
+
+        Args:
+            state_file: The file to read the state from.
+            names: The participants' names, ordered by participant id.
+            primary_currency: The primary currency used during the trip.
+            exact: Whether to accumulate the balances in integer minor units.
+            minor_digits: Overrides of the number of minor unit digits of
+                each currency, used in exact mode.
+
+        Returns:
+            The state.
+
+        Raises:
+            StateError: The state was saved with different settings.
+        """
+        if not os.path.exists(state_file):
+            return cls(BalanceAccumulator(names, exact, minor_digits),
+                       primary_currency)
+
+        with open(state_file) as f:
+            state: Dict = json.load(f)
+
+        if state.get('version') != STATE_VERSION:
+            raise StateError('The state file was written by another version '
+                             'of reimburser.')
+        if (state['names'] != names
+                or state['primary_currency'] != primary_currency
+                or state['exact'] != exact
+                or state['minor_digits'] != minor_digits):
+            raise StateError('The state file was written for other '
+                             'participants or settings.')
+
+        return cls(
+            BalanceAccumulator.from_dict(state),
+            primary_currency,
+            state['header'],
+            state['offset'],
+            state['rows'],
+            state['fingerprint'],
+            # Older state files only ever consumed complete lines.
+            state.get('terminated', True))
+
+    def _tail(self, f) -> str:
+        """Reads the last bytes consumed from the costs file."""
+        start = max(self.offset - FINGERPRINT_SIZE, 0)
+        f.seek(start)
+        return f.read(self.offset - start).hex()
+
+def _rows_end(data: bytes, fields: int) -> int:
+    """Finds where the complete rows of csv data end.
+
+    The last row doesn't need to end with a newline, as long as it has all
+    its fields and no quoted field left open.
+
+    Args:
+        data: The csv data.
+        fields: The number of fields of a row.
+
+    Returns:
+        The position right after the last complete row.
+    """
+    # Quotes within a field are doubled, so an odd number of them means a
+    # quoted field is still open.
+    closed: bool = data.count(b'"') % 2 == 0
+    end: int = data.rfind(b'\n') + 1
+    if closed and not data[end:].strip():
+        return end
+
+    # The last row starts after the last newline outside of quotes.
+    start = 0
+    quoted = False
+    for match in re.finditer(rb'["\n]', data):
+        if match.group() == b'"':
+            quoted = not quoted
+        elif not quoted:
+            start = match.end()
+    if closed:
+        row: List[str] = next(csv.reader(io.StringIO(
+            data[start:].decode(errors='replace'), newline='')))
+        if len(row) >= fields:
+            return len(data)
+    return start
@@ -1,9 +1,15 @@
-import pandas as pd
+from typing import TYPE_CHECKING, Dict, NewType, Set
 
-from typing import Dict, NewType, Set
+if TYPE_CHECKING:
+    import pandas as pd
+
+    Matrix = NewType('Matrix', pd.DataFrame)
+    Table = NewType('Table', pd.DataFrame)
+else:
+    # pandas isn't imported just for the sake of the annotations.
+    Matrix = NewType('Matrix', object)
+    Table = NewType('Table', object)
 
 Email = NewType('Email', str)
 FilePath = NewType('FilePath', str)
-Matrix = NewType('Matrix', pd.DataFrame)
 Name = NewType('Name', str)
-Table = NewType('Table', pd.DataFrame)
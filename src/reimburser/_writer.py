@@ -1,8 +1,8 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple, Union
 
-import pandas as pd
-
-from ._types import Matrix, Table
+from ._ledger import Ledger
+from ._settlement import Settlement, StatementIndex
+from ._types import Table
 
 def _html_tagger(tag: str, attr_pair: tuple = None,
                 indentation: str ='', long: bool = False):
@@ -23,6 +23,10 @@ def _html_tagger(tag: str, attr_pair: tuple = None,
             return indentation + f'<{beg}>{string}</{end}>'
     return wrap
 
+# Writer attributes the cached html sections are rendered from
+_SHARED_HTML_DEPENDENCIES = frozenset(
+    ['trip_title', 'table', 'settlements', 'summarized'])
+
 # indentation level for html document
 INDENTATION_WIDTH = ' ' * 2
 LEVEL_0 = ''
@@ -57,14 +61,55 @@ attach_tag_td_rjust = _html_tagger(
     indentation=LEVEL_5)
 
 class Writer:
+    """Writes the email content of each participant.
+
+    The reimbursements of each participant are looked up in a statement
+    index, either the one the settlements were indexed into already (see
+    Reimburser.statements), or one built from the settlements the first time
+    it is needed. The sections of the html
+    email that are the same for everyone (the header, the cost table and the
+    reimbursement matrices) are rendered once and cached. Setting any of the
+    attributes they depend on clears the cache; clear_cache should be called
+    after mutating them in place.
+
+    The cost table is rendered from the ledger of the trip, or from a summary
+    of the costs (a pandas DataFrame with the columns [currency,
+    transactions, cost]) when summarized.
+    """
     def __init__(
             self,
             trip_title: str,
-            table: Table,
-            reimbursement_matrices: Dict[str, Matrix]):
+            table: Union[Ledger, Table],
+            settlements: Dict[str, Settlement],
+            summarized: bool = False,
+            statements: Optional[StatementIndex] = None):
+        self._shared_html: Optional[Tuple[str, str]] = None
         self.trip_title = trip_title
         self.table = table
-        self.reimbursement_matrices = reimbursement_matrices
+        self.settlements = settlements
+        # A summarized table only lists the total cost of each currency, as
+        # is the case when the costs file is streamed.
+        self.summarized = summarized
+        self._statements = statements
+
+    def __setattr__(self, name, value):
+        if name in _SHARED_HTML_DEPENDENCIES:
+            self.clear_cache()
+        if name == 'settlements':
+            # The statements of other settlements are indexed anew.
+            super().__setattr__('_statements', None)
+        super().__setattr__(name, value)
+
+    @property
+    def statements(self) -> StatementIndex:
+        """The reimbursements of each participant, across all currencies."""
+        if self._statements is None:
+            self._statements = StatementIndex(self.settlements)
+        return self._statements
+
+    def clear_cache(self) -> None:
+        """Clears the cached html sections shared by all participants."""
+        self._shared_html = None
 
     def write_plaintext_body(self, recipient: str) -> str:
         """Write the plaintext email content for a given recipient.
@@ -85,17 +130,16 @@ class Writer:
         subbody: str = ''
         subbody_debt: List = list()
         subbody_credit: List = list()
-        for currency, reimbs in self.reimbursement_matrices.items():
-            debts = reimbs[recipient].dropna()
-            credits = reimbs.loc[recipient].dropna()
-            for creditor, credit in debts.iteritems():
-                #creditor = creditor.rjust(self._max_name_len)
-                amount = f'{credit} {currency}'.ljust(6+1+3)
-                subbody_debt.append('\t' + creditor + ' | ' + amount)
-            for debtor, debt in credits.iteritems():
-                #debtor = debtor.rjust(self._max_name_len)
-                amount = f'{debt} {currency}'.ljust(6+1+3)
-                subbody_credit.append('\t' + debtor + ' | ' + amount)
+        for creditor, credit, currency, digits in self.statements.payables(
+                recipient):
+            #creditor = creditor.rjust(self._max_name_len)
+            amount = f'{credit:.{digits}f} {currency}'.ljust(6+1+3)
+            subbody_debt.append('\t' + creditor + ' | ' + amount)
+        for debtor, debt, currency, digits in self.statements.receivables(
+                recipient):
+            #debtor = debtor.rjust(self._max_name_len)
+            amount = f'{debt:.{digits}f} {currency}'.ljust(6+1+3)
+            subbody_credit.append('\t' + debtor + ' | ' + amount)
 
         if len(subbody_debt) == 1:
             subbody += 'Please reimburse the following participant:\n' \
@@ -130,40 +174,60 @@ class Writer:
         Returns:
             The email content for said recipient.
         """
-        declaration = '<!DOCTYPE html>\n\n'
-        header: str = attach_tag_head(
-            attach_tag_title('reimburser')
-        ) + '\n'
+        header, overview = self._write_shared_html()
         preamble: str = self._write_html_preamble(recipient)
 
         torso: str = self._write_html_torso(recipient)
 
+        body: str = attach_tag_body(
+            preamble + '\n'
+            + torso + '\n'
+            + overview)
+
+        email_content: str = '<!DOCTYPE html>\n\n' \
+            + attach_tag_html(
+                header
+                + body)
+
+        return email_content
+
+    def _write_shared_html(self) -> Tuple[str, str]:
+        """Writes (or fetches from the cache) the html sections that are the
+        same for all participants.
+
+        Returns:
+            The html header, and the overview of all the costs that ends the
+            email body.
+        """
+        if self._shared_html is not None:
+            return self._shared_html
+
+        header: str = attach_tag_head(
+            attach_tag_title('reimburser')
+        ) + '\n'
+
         middle: str = attach_tag_div(
             attach_tag_p('The rest of the email gives an overview '
                 + f'of all the costs from {self.trip_title}:'))
 
-        costs_table: str = self._construct_html_table(self.table)
+        if self.summarized:
+            costs_table: str = self._construct_html_summary(self.table)
+        else:
+            costs_table: str = self._construct_html_table(self.table)
 
         matrices = list()
-        for currency, matrix in self.reimbursement_matrices.items():
+        for currency, settlement in self.settlements.items():
             matrices.append(self._construct_html_matrix(
-                currency, matrix))
+                currency, settlement))
         matrix_tables = f'\n{LEVEL_2}<br>\n'.join(matrices)
 
+        overview: str = middle + '\n' \
+            + costs_table + f'\n{LEVEL_2}<br>\n' \
+            + matrix_tables
 
-        body: str = attach_tag_body(
-            preamble + '\n'
-            + torso + '\n'
-            + middle + '\n'
-            + costs_table + f'\n{LEVEL_2}<br>\n'
-            + matrix_tables)
-
-        email_content: str = declaration \
-            + attach_tag_html(
-                header
-                + body)
-
-        return email_content
+        # Bypasses __setattr__, which would clear the cache right away.
+        object.__setattr__(self, '_shared_html', (header, overview))
+        return self._shared_html
 
     def _write_html_preamble(self, recipient: str) -> str:
         """Writes the introduction to the html email content.
@@ -197,15 +261,14 @@ class Writer:
         torso: str = ''
         debt_statements: List = list()
         credit_statements: List = list()
-        for currency, reimbs in self.reimbursement_matrices.items():
-            debts = reimbs[recipient].dropna()
-            credits = reimbs.loc[recipient].dropna()
-            for creditor, credit in debts.iteritems():
-                debt_statements.append(
-                        attach_tag_li(f'{creditor}, {credit:.2f} {currency}'))
-            for debtor, debt in credits.iteritems():
-                credit_statements.append(
-                        attach_tag_li(f'{debtor}, {debt:.2f} {currency}'))
+        for creditor, credit, currency, digits in self.statements.payables(
+                recipient):
+            debt_statements.append(attach_tag_li(
+                f'{creditor}, {credit:.{digits}f} {currency}'))
+        for debtor, debt, currency, digits in self.statements.receivables(
+                recipient):
+            credit_statements.append(attach_tag_li(
+                f'{debtor}, {debt:.{digits}f} {currency}'))
 
         if len(debt_statements) == 1:
             torso += attach_tag_p('Please reimburse the following '
@@ -235,56 +298,107 @@ class Writer:
 
         return attach_tag_div(torso)
 
-    def _construct_html_table(self, df: Table) -> str:
+    def _construct_html_table(self, ledger: Ledger) -> str:
         """Constructs the trip cost table in HTML.
 
+        The cells of the names, currencies and reimbursers are rendered once
+        each, and looked up by code for every cost.
+
         Args:
-            df: The trip cost table.
+            ledger: The ledger of the trip.
 
         Returns:
             The cost table as an HTML table.
         """
-        string = attach_tag_tr('\n'.join(map(attach_tag_th, df.columns)))
-        stringified_df = _stringify_table(df)
+        columns: List[str] = ['reimbursee', 'cost', 'currency', 'reimbursers']
+        if ledger.notes is not None:
+            columns.append('notes')
+
+        names: List[str] = list(map(attach_tag_td, ledger.names))
+        currencies: List[str] = list(map(attach_tag_td, ledger.currencies))
+        # The -1 code of a blank reimbursers cell points to the last group.
+        groups: List[str] = [attach_tag_td(_add_spaces(group))
+                             for group in ledger.groups]
+        groups.append(attach_tag_td('everyone'))
+
+        rows: List[str] = [attach_tag_tr('\n'.join(map(attach_tag_th,
+                                                        columns)))]
+        for k, (reimbursee, cost, currency, reimbursers) in enumerate(zip(
+                ledger.reimbursee.tolist(),
+                ledger.costs().tolist(),
+                ledger.currency.tolist(),
+                ledger.reimbursers.tolist())):
+            table_content: List[str] = [
+                names[reimbursee],
+                attach_tag_td_rjust(_add_decimals(cost)),
+                currencies[currency],
+                groups[reimbursers],
+            ]
+            if ledger.notes is not None:
+                table_content.append(attach_tag_td(ledger.notes[k]))
+
+            rows.append(attach_tag_tr('\n'.join(table_content)))
+
+        return attach_tag_table(
+            attach_tag_caption(f'All Costs of {self.trip_title}')
+            + '\n'
+            + attach_tag_tbody('\n'.join(rows)))
+
+    def _construct_html_summary(self, df: Table) -> str:
+        """Constructs the trip cost summary in HTML.
+
+        Args:
+            df: The trip cost summary, with the columns [currency,
+                transactions, cost].
 
-        for (i, row_elements) in stringified_df.iterrows():
-            # Commented out code is a bit sleaker, but restrictive
-            #string += '\n' + attach_tag_tr('\n'.join(map(attach_tag_td,
-            #    row_elements)))
-            table_content: List = []
-            for col, val in row_elements.iteritems():
-                if col == 'cost':
-                    table_content.append(attach_tag_td_rjust(val))
-                else:
-                    table_content.append(attach_tag_td(val))
+        Returns:
+            The cost summary as an HTML table.
+        """
+        string = attach_tag_tr('\n'.join(map(attach_tag_th, df.columns)))
 
-            string += '\n' + attach_tag_tr('\n'.join(table_content))
+        for currency, transactions, cost in zip(df['currency'],
+                                                df['transactions'],
+                                                df['cost']):
+            string += '\n' + attach_tag_tr(
+                attach_tag_td(currency)
+                + '\n' + attach_tag_td_rjust(transactions)
+                + '\n' + attach_tag_td_rjust(_add_decimals(cost)))
 
         return attach_tag_table(
-            attach_tag_caption(f'All Costs of {self.trip_title}')
+            attach_tag_caption(f'Summary of All Costs of {self.trip_title}')
             + '\n'
             + attach_tag_tbody(string))
 
-    def _construct_html_matrix(self, currency: str, df: Matrix) -> str:
+    def _construct_html_matrix(
+            self,
+            currency: str,
+            settlement: Settlement) -> str:
         """Constructs a reimbursement matrix for the given currency.
 
+        The matrix is rendered straight from the sparse settlement: every cell
+        is 0.00 except the ones with a transfer.
+
         Args:
             currency: The currency of the cost matrix.
-            df: A cost matrix.
+            settlement: The settlement of said currency.
 
         Returns:
             The reimbursement matrix as an HTML table.
         """
-        stringified_df = df.copy() \
-                            .fillna(value=0.0) \
-                            .applymap(_add_decimals)
+        names: List = settlement.names
+        zero: str = _add_decimals(0.0, settlement.digits)
+        rows: List[List[str]] = [[zero] * len(names) for _ in names]
+        for debtor, creditor, amount in zip(settlement.debtors,
+                                            settlement.creditors,
+                                            settlement.amounts):
+            rows[creditor][debtor] = _add_decimals(amount, settlement.digits)
 
         matrix = attach_tag_tr(
             attach_tag_th('')
             + '\n'
-            + '\n'.join(map(attach_tag_th, df.columns)))
+            + '\n'.join(map(attach_tag_th, names)))
 
-        for (i, row_elements) in stringified_df.iterrows():
+        for i, row_elements in zip(names, rows):
             matrix += '\n' \
                 + attach_tag_tr_rjust_long(attach_tag_th(i)
                                 + '\n'
@@ -295,36 +409,9 @@ class Writer:
             + '\n'
             + attach_tag_tbody(matrix))
 
-def _add_decimals(num): return format(num, '.2f')
-
-def _stringify_table(df: Table) -> pd.DataFrame:
-    """Makes all relevant elements in the cost table a string.
-
-    Args:
-        df: The trip cost table.
-
-    Returns:
-        The trip cost table, a pandas DataFrame, with all elements converted to
-        str.
-    """
-    columns = [
-        'reimbursee',
-        'cost',
-        'currency',
-        'reimbursers',
-    ]
-
-    if 'notes' in df.columns:
-        columns.append('notes')
-
-    side_reimbs = df['reimbursers'].notna()
-    def add_space(string):
-        return ', '.join(map(str.strip, string.split(',')))
-    spaced_reimbursers = df['reimbursers'][side_reimbs].apply(add_space)
-
-    stringified_df = df[columns].fillna(value={'reimbursers': 'everyone'})
-    stringified_df.loc[side_reimbs, 'reimbursers'] = spaced_reimbursers
-
-    stringified_df.loc[:, 'cost'] = stringified_df['cost'].apply(_add_decimals)
+def _add_decimals(num, digits=2): return format(num, f'.{digits}f')
 
-    return stringified_df
+def _add_spaces(reimbursers: str) -> str:
+    """Spaces out the names of a reimbursers cell, e.g. "Bob,Carol" becomes
+    "Bob, Carol"."""
+    return ', '.join(map(str.strip, reimbursers.split(',')))
@@ -1,24 +1,68 @@
-from typing import NewType, Set
+import csv
+from typing import (
+    IO, TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Union)
 
-from ._emailer import Emailer
-from ._types import FilePath
+import numpy as np
+
+from . import _metrics
+from ._accumulator import BalanceAccumulator
+from ._cache import CachedTrip, TripCache
+from ._costs import CSV_ENGINES, _costs_frame_reader, _costs_records_reader
+from ._ledger import Ledger
+from ._parallel import _executor
+from ._settlement import SETTLE_METHODS, Settlement, StatementIndex
+from ._state import IncrementalState
+from ._types import Email, FilePath, Matrix, Name, Table
 from ._reimburser_helper import ReimburserHelper
 
+if TYPE_CHECKING:
+    from ._delivery import DeliveryReport
+
 class Reimburser:
     """Calculates individual reimbursements for a given trip, with the option
     of emailing each participant any credits or debts incurred during the trip.
 
 
     Attributes:
+        ledger: the costs of the trip as compact arrays (see Ledger), or
+            None for streamed and incremental trips.
+        table: the cost table, or a summary of it for streamed and
+            incremental trips.
+        rows: the number of costs of the trip.
+        settlements: a dict mapping a currency code to its settlement, the
+            sparse list of reimbursements.
+        statements: the reimbursements of each participant, across all
+            currencies.
+        reimbursement_matrices: a dict mapping a currency code to its dense
+            cost matrix, built on demand from the settlements.
+        from_frames: calculates the reimbursements of a trip held in
+            DataFrames rather than in csv files.
+        from_records: calculates the reimbursements of a trip held in
+            records or csv streams rather than in csv files.
+        from_balances: settles the balances accumulated from the shards of
+            a trip.
+        update: settles the costs appended to the costs file since the last
+            time, when a state file is used.
+        write_reimbursements: writes all the reimbursements to a csv file.
         send_emails: send out an email to each participant using the given
             email.
+        spool_emails: write an email for each participant into an outbox.
     """
     def __init__(
             self, 
             participants_file: FilePath,
             costs_file: FilePath,
             trip_title: str = 'Fun Trip',
-            primary_currency: str = 'USD'):
+            primary_currency: str = 'USD',
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            stream: bool = False,
+            chunksize: int = 100_000,
+            state_file: Optional[FilePath] = None,
+            workers: Optional[int] = None,
+            settle: str = 'greedy',
+            cache_dir: Optional[FilePath] = None,
+            csv_engine: str = 'c'):
         """Initializes Reimburser.
 
         Args:
@@ -27,27 +71,447 @@ class Reimburser:
             costs_file: A csv file listing all the expenses from the trip. 
             trip_title: The title of the trip.
             primary_currency: The primary currency used during the trip.
+            exact: Whether to compute the reimbursements in integer minor
+                units (e.g. cents) rather than with rounded floats.
+            minor_digits: A dict mapping a currency code to its number of
+                minor unit digits, for currencies that don't have 2 (only
+                used in exact mode).
+            stream: Whether to read the costs file in chunks rather than all
+                at once. The full cost table is then never held in memory,
+                and is replaced by a summary of the costs.
+            chunksize: The number of rows read at a time when streaming.
+            state_file: A file to persist the balances in, for costs files
+                that are only ever appended to. Only the rows appended since
+                the last run are then read, and the cost table is replaced by
+                a summary of the costs.
+            workers: The number of processes the currencies are fanned out
+                to. By default, the currencies are processed one after the
+                other in this process.
+            settle: How to settle each currency. "greedy" repays the largest
+                debts with the largest credits first, which is fast but may
+                make more transfers than needed. "optimal" makes the fewest
+                transfers possible, for currencies with up to 20 or so
+                participants owed or owing money, and falls back on greedy
+                above that.
+            cache_dir: A directory to cache the ledger and the settlements
+                in (see TripCache), so that the same files with the same
+                settings are only ever read and settled once. Streamed and
+                incremental trips aren't cached.
+            csv_engine: The parser costs files over 1 MiB are read with by
+                pandas, either "c" or "pyarrow". pyarrow parses on several
+                threads, but has to be installed.
+
+        Raises:
+            ValueError: settle is neither greedy nor optimal, or csv_engine
+                is neither c nor pyarrow.
         """
+        if settle not in SETTLE_METHODS:
+            raise ValueError('Settle must either be greedy or optimal.')
+        if csv_engine not in CSV_ENGINES:
+            raise ValueError('CSV engine must either be c or pyarrow.')
 
         self.trip_title = trip_title
-        self.emails: Dict[str, str] =  ReimburserHelper.email_getter(
-            participants_file)
-        participants: Set[str] = set(self.emails.keys())
-        (self.table,
-         self.reimbursement_matrices) = ReimburserHelper.reimbs_mats_getter(
-            costs_file, 
-            participants,
-            primary_currency)
+        self.summarized = stream or state_file is not None
+
+        cache: Optional[TripCache] = None
+        cached: Optional[CachedTrip] = None
+        if cache_dir is not None and not self.summarized:
+            cache = TripCache(cache_dir)
+            key: str = cache.key(
+                participants_file,
+                costs_file,
+                primary_currency,
+                exact,
+                minor_digits,
+                settle)
+            cached = cache.load(key)
+
+        if cached is not None:
+            self.emails: Dict[str, str] = cached.emails
+        else:
+            self.emails = ReimburserHelper.email_getter(participants_file)
+        # The participants keep the order of the participants file, so the
+        # participant ids are the same from one run to the next.
+        participants: List[Name] = list(self.emails.keys())
+        self.costs_file = costs_file
+        self.state_file = state_file
+        self.workers = workers
+        self.settle = settle
+        self.ledger: Optional[Ledger] = None
+        self._table: Optional[Table] = None
+        self._state: Optional[IncrementalState] = None
+        if cached is not None:
+            self.ledger = cached.ledger
+            self.settlements = cached.settlements
+        elif self.state_file is not None:
+            self._state = IncrementalState.load(
+                self.state_file,
+                participants,
+                primary_currency,
+                exact,
+                minor_digits)
+            self.update()
+        elif stream:
+            (self.table,
+             self.settlements) = ReimburserHelper.streamed_settlements_getter(
+                costs_file,
+                participants,
+                primary_currency,
+                exact,
+                minor_digits,
+                chunksize,
+                workers,
+                settle)
+        else:
+            (self.ledger,
+             self.settlements) = ReimburserHelper.settlements_getter(
+                costs_file, 
+                participants,
+                primary_currency,
+                exact,
+                minor_digits,
+                workers,
+                settle,
+                csv_engine)
+            if cache is not None:
+                cache.store(key, self.emails, self.ledger, self.settlements)
+
+    @classmethod
+    def from_frames(
+            cls,
+            participants: Union[Dict[Name, Email], Table],
+            costs: Union[Table, np.ndarray, Dict[str, np.ndarray]],
+            trip_title: str = 'Fun Trip',
+            primary_currency: str = 'USD',
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            workers: Optional[int] = None,
+            settle: str = 'greedy') -> 'Reimburser':
+        """Calculates the reimbursements of a trip held in pandas DataFrames
+        (or NumPy arrays), rather than in csv files.
+
+        Args:
+            participants: A dict mapping each participant's name to their
+                email, or a DataFrame with the columns [participant, email].
+            costs: A DataFrame with the columns of the costs file (the case
+                of their names doesn't matter), or a structured NumPy array
+                or dict of arrays with those columns.
+            trip_title: The title of the trip.
+            primary_currency: The primary currency used during the trip.
+            exact: Whether to compute the reimbursements in integer minor
+                units (e.g. cents) rather than with rounded floats.
+            minor_digits: A dict mapping a currency code to its number of
+                minor unit digits (see __init__).
+            workers: The number of processes the currencies are fanned out
+                to.
+            settle: How to settle each currency, either greedy or optimal.
+
+        Returns:
+            The reimbursements of the trip.
+
+        Raises:
+            FieldError: The costs are missing required columns.
+            KeyError: A reimbursee or reimburser is not a participant.
+            RowError: A cost is missing or not a number, or a participant
+                doesn't have exactly an email.
+            ValueError: settle is neither greedy nor optimal.
+        """
+        emails: Dict[Name, Email] = ReimburserHelper.email_records_getter(
+            participants)
+        ledger: Ledger = Ledger.from_frame(
+            _costs_frame_reader(costs, primary_currency),
+            list(emails))
+        return cls._from_ledger(trip_title, emails, ledger, exact,
+                                minor_digits, workers, settle)
+
+    @classmethod
+    def from_records(
+            cls,
+            participants: Union[Dict[Name, Email], Iterable, IO],
+            costs: Union[Iterable, IO],
+            trip_title: str = 'Fun Trip',
+            primary_currency: str = 'USD',
+            exact: bool = False,
+            minor_digits: Optional[Dict[str, int]] = None,
+            workers: Optional[int] = None,
+            settle: str = 'greedy',
+            columns: Optional[Sequence[str]] = None) -> 'Reimburser':
+        """Calculates the reimbursements of a trip whose participants and
+        costs come in as records (e.g. the rows of a query) or csv streams,
+        without pandas and without writing them to files.
+
+        Args:
+            participants: A dict mapping each participant's name to their
+                email, an iterable of (participant, email) pairs, or a csv
+                stream (text or binary) laid out like the participants file.
+            costs: An iterable of dicts keyed by the columns of the costs
+                file, an iterable of sequences whose first one is the header
+                (unless columns is given), or a csv stream laid out like the
+                costs file. Blank cells may also be None or NaN.
+            trip_title: The title of the trip.
+            primary_currency: The primary currency used during the trip.
+            exact: Whether to compute the reimbursements in integer minor
+                units (e.g. cents) rather than with rounded floats.
+            minor_digits: A dict mapping a currency code to its number of
+                minor unit digits (see __init__).
+            workers: The number of processes the currencies are fanned out
+                to.
+            settle: How to settle each currency, either greedy or optimal.
+            columns: The columns of sequence cost records, if their first
+                record isn't the header.
+
+        Returns:
+            The reimbursements of the trip.
+
+        Raises:
+            FieldError: The costs are missing required columns.
+            KeyError: A reimbursee or reimburser is not a participant.
+            RowError: A cost is missing or not a number, or a participant
+                doesn't have exactly an email.
+            ValueError: settle is neither greedy nor optimal.
+        """
+        emails: Dict[Name, Email] = ReimburserHelper.email_records_getter(
+            participants)
+        ledger: Ledger = _costs_records_reader(
+            costs,
+            primary_currency,
+            list(emails),
+            columns)
+        return cls._from_ledger(trip_title, emails, ledger, exact,
+                                minor_digits, workers, settle)
+
+    @classmethod
+    def from_balances(
+            cls,
+            participants: Union[Dict[Name, Email], Iterable, IO],
+            balances: BalanceAccumulator,
+            trip_title: str = 'Fun Trip',
+            workers: Optional[int] = None,
+            settle: str = 'greedy') -> 'Reimburser':
+        """Settles the balances accumulated from the shards of a trip (see
+        BalanceAccumulator), e.g. costs files read on other processes or
+        machines and merged.
+
+        As with a streamed costs file, the cost table is never held in
+        memory, and is replaced by a summary of the costs.
+
+        Args:
+            participants: The participants' emails, as in from_records. They
+                have to be the participants the balances were accumulated
+                for, in the same order.
+            balances: The merged balances of the trip.
+            trip_title: The title of the trip.
+            workers: The number of processes the currencies are fanned out
+                to.
+            settle: How to settle each currency, either greedy or optimal.
+
+        Returns:
+            The reimbursements of the trip.
+
+        Raises:
+            RowError: A participant doesn't have exactly an email.
+            ValueError: The balances are for other participants, or settle
+                is neither greedy nor optimal.
+        """
+        if settle not in SETTLE_METHODS:
+            raise ValueError('Settle must either be greedy or optimal.')
+        emails: Dict[Name, Email] = ReimburserHelper.email_records_getter(
+            participants)
+        if list(emails) != balances.names:
+            raise ValueError('The balances were accumulated for other '
+                             'participants.')
+
+        reimburser: Reimburser = cls.__new__(cls)
+        reimburser.trip_title = trip_title
+        reimburser.summarized = True
+        reimburser.emails = emails
+        reimburser.costs_file = None
+        reimburser.state_file = None
+        reimburser.workers = workers
+        reimburser.settle = settle
+        reimburser.ledger = None
+        reimburser._table = balances.summary()
+        reimburser._state = None
+        with _executor(workers) as executor:
+            reimburser.settlements = balances.settle(executor, settle)
+
+        return reimburser
+
+    @classmethod
+    def _from_ledger(
+            cls,
+            trip_title: str,
+            emails: Dict[Name, Email],
+            ledger: Ledger,
+            exact: bool,
+            minor_digits: Optional[Dict[str, int]],
+            workers: Optional[int],
+            settle: str) -> 'Reimburser':
+        """Settles a ledger read from anything but the csv files, see
+        from_frames and from_records."""
+        if settle not in SETTLE_METHODS:
+            raise ValueError('Settle must either be greedy or optimal.')
+
+        reimburser: Reimburser = cls.__new__(cls)
+        reimburser.trip_title = trip_title
+        reimburser.summarized = False
+        reimburser.emails = emails
+        reimburser.costs_file = None
+        reimburser.state_file = None
+        reimburser.workers = workers
+        reimburser.settle = settle
+        reimburser.ledger = ledger
+        reimburser._table = None
+        reimburser._state = None
+        reimburser.settlements = ReimburserHelper.ledger_settlements_getter(
+            ledger,
+            exact,
+            minor_digits,
+            workers,
+            settle)
+
+        return reimburser
 
     def __repr__(self):
         return f'Reimbursements for {self.trip_title}'
 
-    def send_emails(self) -> None:
+    @property
+    def settlements(self) -> Dict[str, Settlement]:
+        """The settlement of each currency."""
+        return self._settlements
+
+    @settlements.setter
+    def settlements(self, settlements: Dict[str, Settlement]) -> None:
+        # The statements are indexed once per settlement.
+        self._settlements = settlements
+        self.statements = StatementIndex(settlements)
+
+    @property
+    def table(self) -> Table:
+        """The cost table, or a summary of it when summarized."""
+        # The cost table is only built (and pandas only imported) once it is
+        # asked for, the other stages all work off the ledger.
+        if self._table is None and self.ledger is not None:
+            self._table = self.ledger.to_frame()
+        return self._table
+
+    @table.setter
+    def table(self, table: Table) -> None:
+        self._table = table
+
+    @property
+    def rows(self) -> int:
+        """The number of costs of the trip."""
+        if self.summarized:
+            return int(self.table['transactions'].sum())
+        return len(self.ledger)
+
+    @property
+    def reimbursement_matrices(self) -> Dict[str, Matrix]:
+        """The dense cost matrix of each currency."""
+        return {currency: settlement.to_matrix()
+                for currency, settlement in self.settlements.items()}
+
+    def update(self) -> int:
+        """Settles the costs appended to the costs file since the last time,
+        and saves the new balances to the state file.
+
+        Returns:
+            The number of new rows.
+
+        Raises:
+            StateError: The costs file has changed rather than been appended
+                to.
+            ValueError: There is no state file.
+        """
+        if self._state is None:
+            raise ValueError('Updating requires a state file.')
+
+        with _executor(self.workers) as executor:
+            new_rows: int = self._state.consume(self.costs_file, executor)
+            self.settlements = self._state.accumulator.settle(executor,
+                                                              self.settle)
+        self.table = self._state.accumulator.summary()
+        self._state.save(self.state_file)
+
+        return new_rows
+
+    def write_reimbursements(self, reimbursements_file: FilePath) -> int:
+        """Writes all the reimbursements to a csv file.
+
+        The csv file has the columns [currency, debtor, creditor, amount],
+        where the debtor is to pay the creditor the amount.
+
+        Args:
+            reimbursements_file: The csv file to write to.
+
+        Returns:
+            The number of reimbursements written.
+        """
+        num_reimbursements = 0
+        with _metrics.timer('write'), \
+                open(reimbursements_file, 'w', newline='') as csv_f:
+            csv_writer = csv.writer(csv_f)
+            csv_writer.writerow(['currency', 'debtor', 'creditor', 'amount'])
+            for currency, settlement in self.settlements.items():
+                names: List[Name] = settlement.names
+                for debtor, creditor, amount in zip(settlement.debtors,
+                                                    settlement.creditors,
+                                                    settlement.amounts):
+                    csv_writer.writerow([
+                        currency,
+                        names[debtor],
+                        names[creditor],
+                        f'{amount:.{settlement.digits}f}'])
+                num_reimbursements += len(settlement)
+
+        return num_reimbursements
+
+    def send_emails(self, **smtp_settings) -> List['DeliveryReport']:
         """Sends out an email to all participants.
+
+        Args:
+            **smtp_settings: The SMTP settings passed on to Emailer, e.g.
+                smtp_host, smtp_port, connections, rate_limit or retries.
+
+        Returns:
+            The delivery report of each participant.
         """
+        # The email modules are only loaded when emails are sent.
+        from ._emailer import Emailer
+
+        emailer = Emailer(
+            self.trip_title,
+            self.emails,
+            self.table if self.summarized else self.ledger,
+            self.settlements,
+            self.summarized,
+            self.statements,
+            **smtp_settings)
+        return emailer.send()
+
+    def spool_emails(
+            self,
+            outbox_file: FilePath,
+            sender_email: Optional[str] = None) -> int:
+        """Writes an email for each participant into an outbox, to be sent
+        later on with `reimburser deliver`.
+
+        Args:
+            outbox_file: The sqlite file the outbox is kept in.
+            sender_email: The email account to send from, prompted for if not
+                given.
+
+        Returns:
+            The number of emails written.
+        """
+        from ._emailer import Emailer
+
         emailer = Emailer(
             self.trip_title,
             self.emails,
-            self.table,
-            self.reimbursement_matrices)
-        emailer.send()
+            self.table if self.summarized else self.ledger,
+            self.settlements,
+            self.summarized,
+            self.statements)
+        return emailer.spool(outbox_file, sender_email=sender_email)
@@ -0,0 +1,111 @@
+import os
+import smtplib
+import sys
+import threading
+from email.mime.text import MIMEText
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from synthetic import TripSpec, generate_trip  # noqa: E402
+
+@pytest.fixture
+def make_trip(tmp_path):
+    """Writes a synthetic trip, returning its (participants, costs) files."""
+    def make(**spec) -> tuple:
+        directory = tmp_path / f'trip{len(list(tmp_path.iterdir()))}'
+        directory.mkdir()
+        return generate_trip(str(directory), TripSpec(**spec))
+    return make
+
+class FakeSMTPServer:
+    """A stand-in SMTP server, whose connect method is plugged in as the
+    smtp_factory of SMTPPool, Emailer or Outbox.
+
+    Attributes:
+        password: The only password accepted.
+        errors: A dict mapping a recipient's email to the errors sending to
+            it raises, one per attempt, before it goes through.
+        sent: The recipients sent to, in order.
+        connections: Every connection opened.
+        logins: The number of login attempts.
+    """
+    def __init__(self, password: str = 'secret'):
+        self.password = password
+        self.errors = dict()
+        self.sent = list()
+        self.connections = list()
+        self.logins = 0
+        self._lock = threading.Lock()
+
+    def connect(self, host: str, port: int) -> 'FakeSMTP':
+        connection = FakeSMTP(self)
+        with self._lock:
+            self.connections.append(connection)
+        return connection
+
+class FakeSMTP:
+    """A connection to a FakeSMTPServer, standing in for smtplib.SMTP."""
+    def __init__(self, server: FakeSMTPServer):
+        self.server = server
+        self.closed = False
+        self.sent = 0
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user: str, password: str):
+        with self.server._lock:
+            self.server.logins += 1
+        if password != self.server.password:
+            raise smtplib.SMTPAuthenticationError(535, b'Bad credentials')
+
+    def send_message(self, msg):
+        assert not self.closed
+        with self.server._lock:
+            errors = self.server.errors.get(msg['To'])
+            error = errors.pop(0) if errors else None
+            if error is None:
+                self.server.sent.append(msg['To'])
+                self.sent += 1
+        if error is not None:
+            raise error
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def smtp_server():
+    return FakeSMTPServer()
+
+def make_messages(n: int) -> list:
+    """Writes n (recipient, message) pairs, to P0000@example.com, ..."""
+    messages = list()
+    for i in range(n):
+        msg = MIMEText(f'Hello {i}')
+        msg['From'] = 'me@example.com'
+        msg['To'] = f'P{i:04d}@example.com'
+        msg['Subject'] = 'Trip reimbursements'
+        messages.append((f'P{i:04d}', msg))
+    return messages
+
+def transfers(reimbs):
+    """The transfers of each currency, by name."""
+    return {
+        currency: [(settlement.names[debtor], settlement.names[creditor],
+                    round(amount, settlement.digits))
+                   for debtor, creditor, amount in zip(
+                       settlement.debtors.tolist(),
+                       settlement.creditors.tolist(),
+                       settlement.amounts.tolist())]
+        for currency, settlement in reimbs.settlements.items()
+    }
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import transfers
+from reimburser import BalanceAccumulator, Reimburser
+from reimburser._reimburser_helper import ReimburserHelper
+
+def shards(costs_file, n):
+    """Splits a costs file into n files, each starting with the header."""
+    with open(costs_file) as f:
+        header, *rows = f.readlines()
+    files = list()
+    for k in range(n):
+        path = f'{costs_file}.{k}.csv'
+        with open(path, 'w') as f:
+            f.writelines([header] + rows[k::n])
+        files.append(path)
+    return files
+
+def accumulate(participants_file, costs_files, **options):
+    """Accumulates the balances of each costs file on its own."""
+    names = list(ReimburserHelper.email_getter(participants_file))
+    return [ReimburserHelper.balances_getter([costs_file], names, 'USD',
+                                             **options)
+            for costs_file in costs_files]
+
+def merged(accumulators):
+    """Merges copies of the accumulators, left to right."""
+    copies = [BalanceAccumulator.from_dict(a.to_dict()) for a in accumulators]
+    result = copies[0]
+    for accumulator in copies[1:]:
+        result = result.merge(accumulator)
+    return result
+
+def assert_same_balances(a, b):
+    assert list(a.balances) == list(b.balances)
+    for c in a.balances:
+        np.testing.assert_array_equal(a.balances[c], b.balances[c])
+    assert a.transactions == b.transactions
+
+def test_round_trip_exact(make_trip):
+    participants_file, costs_file = make_trip(participants=7, rows=300,
+                                              currencies=3, seed=2)
+    accumulator, = accumulate(participants_file, [costs_file], exact=True,
+                              minor_digits={'USD': 3})
+
+    copy = BalanceAccumulator.from_dict(
+        json.loads(json.dumps(accumulator.to_dict())))
+
+    assert copy.names == accumulator.names
+    assert copy.exact and copy.minor_digits == {'USD': 3}
+    assert_same_balances(copy, accumulator)
+    assert all(b.dtype == np.int64 for b in copy.balances.values())
+    assert copy.totals == pytest.approx(accumulator.totals)
+    settle = [{c: (s.debtors.tolist(), s.creditors.tolist(),
+                   s.amounts.tolist(), s.digits)
+               for c, s in a.settle().items()} for a in (copy, accumulator)]
+    assert settle[0] == settle[1]
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_merge_in_any_order(make_trip, exact):
+    participants_file, costs_file = make_trip(participants=7, rows=300,
+                                              currencies=3, seed=4)
+    a, b, c = accumulate(participants_file, shards(costs_file, 3),
+                         exact=exact)
+
+    orders = [merged([a, b, c]), merged([c, b, a]), merged([b, a, c]),
+              merged([a, merged([b, c])])]
+    for other in orders[1:]:
+        assert sorted(other.balances) == sorted(orders[0].balances)
+        for currency in orders[0].balances:
+            if exact:
+                np.testing.assert_array_equal(other.balances[currency],
+                                              orders[0].balances[currency])
+            else:
+                np.testing.assert_allclose(other.balances[currency],
+                                           orders[0].balances[currency])
+        assert other.transactions == orders[0].transactions
+
+    # Merging leaves the other accumulator as it was.
+    before = BalanceAccumulator.from_dict(b.to_dict())
+    merged([a]).merge(b).merge(c)
+    assert_same_balances(b, before)
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_merged_shards_settle_as_one_pass(make_trip, exact):
+    # Costs that split evenly into cents (yen included), so that no minor
+    # units are left over to rotate differently in the shards.
+    participants_file, costs_file = make_trip(participants=7, rows=300,
+                                              currencies=3, even=True,
+                                              seed=6)
+    minor_digits = {'JPY': 2} if exact else None
+    emails = ReimburserHelper.email_getter(participants_file)
+    accumulator = merged(accumulate(participants_file, shards(costs_file, 4),
+                                    exact=exact, minor_digits=minor_digits))
+
+    reimbs = Reimburser.from_balances(emails, accumulator)
+    single = Reimburser(participants_file, costs_file, exact=exact,
+                        minor_digits=minor_digits)
+    assert transfers(reimbs) == transfers(single)
+    assert reimbs.rows == single.rows == 300
+
+@pytest.mark.parametrize('other', [
+    {'names': ['P0001', 'P0000', 'P0002']},
+    {'exact': True},
+    {'minor_digits': {'USD': 3}},
+])
+def test_merge_rejects_other_settings(other):
+    settings = {'names': ['P0000', 'P0001', 'P0002'], 'exact': False,
+                'minor_digits': None}
+    accumulator = BalanceAccumulator(**settings)
+    with pytest.raises(ValueError):
+        accumulator.merge(BalanceAccumulator(**dict(settings, **other)))
@@ -0,0 +1,115 @@
+import os
+import time
+
+import pytest
+
+from conftest import transfers
+from reimburser import Reimburser
+from reimburser._cache import TripCache
+from reimburser._metrics import Metrics, collecting
+
+def run(participants_file, costs_file, cache_dir, **options):
+    """Settles a trip with the cache, returning it along with the cache
+    counters."""
+    with collecting(Metrics()) as metrics:
+        reimbs = Reimburser(participants_file, costs_file,
+                            cache_dir=cache_dir, **options)
+    return reimbs, {name: n for name, n in metrics.counters.items()
+                    if name.startswith('cache_')}
+
+@pytest.fixture
+def trip(make_trip, tmp_path):
+    participants_file, costs_file = make_trip(participants=6, rows=100,
+                                              currencies=2, seed=1)
+    return participants_file, costs_file, str(tmp_path / 'cache')
+
+@pytest.mark.parametrize('options', [{}, {'exact': True, 'settle': 'optimal'},
+                                     {'exact': True,
+                                      'minor_digits': {'USD': 3}}])
+def test_hit_matches_fresh_run(trip, options):
+    participants_file, costs_file, cache_dir = trip
+    fresh = Reimburser(participants_file, costs_file, **options)
+
+    _, counters = run(participants_file, costs_file, cache_dir, **options)
+    assert counters == {'cache_misses': 1}
+    cached, counters = run(participants_file, costs_file, cache_dir,
+                           **options)
+    assert counters == {'cache_hits': 1}
+
+    assert transfers(cached) == transfers(fresh)
+    assert cached.emails == fresh.emails
+    assert cached.rows == fresh.rows
+    assert [s.digits for s in cached.settlements.values()] \
+        == [s.digits for s in fresh.settlements.values()]
+
+@pytest.mark.parametrize('options', [
+    {'primary_currency': 'EUR'},
+    {'exact': True},
+    {'settle': 'optimal'},
+    {'exact': True, 'minor_digits': {'USD': 3}},
+])
+def test_settings_miss(trip, options):
+    participants_file, costs_file, cache_dir = trip
+    run(participants_file, costs_file, cache_dir)
+
+    _, counters = run(participants_file, costs_file, cache_dir, **options)
+    assert counters == {'cache_misses': 1}
+
+@pytest.mark.parametrize('edited', [0, 1], ids=['participants', 'costs'])
+def test_edited_file_misses(trip, edited):
+    participants_file, costs_file, cache_dir = trip
+    run(participants_file, costs_file, cache_dir)
+
+    path = (participants_file, costs_file)[edited]
+    with open(path) as f:
+        lines = f.readlines()
+    # The same size and modification time, but a different content.
+    stat = os.stat(path)
+    lines[1], lines[2] = lines[2], lines[1]
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    edited_trip, counters = run(participants_file, costs_file, cache_dir)
+    assert counters == {'cache_misses': 1}
+    assert transfers(edited_trip) \
+        == transfers(Reimburser(participants_file, costs_file))
+
+def entries(cache):
+    return sorted(name for name in os.listdir(cache.directory)
+                  if not name.startswith('.'))
+
+def test_evicts_least_recently_used(trip):
+    participants_file, costs_file, cache_dir = trip
+    reimbs = Reimburser(participants_file, costs_file)
+    cache = TripCache(cache_dir)
+    cache.store('a', reimbs.emails, reimbs.ledger, reimbs.settlements)
+    size = sum(os.path.getsize(os.path.join(cache_dir, 'a', name))
+               for name in os.listdir(os.path.join(cache_dir, 'a')))
+
+    # Room for two entries: storing a third evicts the one used least
+    # recently, which is b once a has been read again.
+    cache.max_bytes = 2 * size
+    now = time.time()
+    cache.store('b', reimbs.emails, reimbs.ledger, reimbs.settlements)
+    os.utime(os.path.join(cache_dir, 'a'), (now - 20, now - 20))
+    os.utime(os.path.join(cache_dir, 'b'), (now - 10, now - 10))
+    assert cache.load('a') is not None
+    with collecting(Metrics()) as metrics:
+        cache.store('c', reimbs.emails, reimbs.ledger, reimbs.settlements)
+
+    assert entries(cache) == ['a', 'c']
+    assert metrics.counters['cache_evictions'] == 1
+    assert cache.load('b') is None
+
+def test_evicts_old_entries(trip):
+    participants_file, costs_file, cache_dir = trip
+    reimbs = Reimburser(participants_file, costs_file)
+    cache = TripCache(cache_dir, max_age=60)
+    cache.store('old', reimbs.emails, reimbs.ledger, reimbs.settlements)
+    cache.store('new', reimbs.emails, reimbs.ledger, reimbs.settlements)
+    old = time.time() - 120
+    os.utime(os.path.join(cache_dir, 'old'), (old, old))
+
+    cache.prune()
+    assert entries(cache) == ['new']
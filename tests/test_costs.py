@@ -0,0 +1,64 @@
+import pytest
+
+from reimburser import Reimburser
+from reimburser._costs import CORE_MAX_BYTES
+from reimburser._errors import RowError
+
+HEADER = 'reimbursee,cost,currency,reimbursers,notes'
+
+def write_costs(path, newline, padding, bad_row):
+    """Writes a costs file with padding rows (every other one with a note
+    spanning two lines) before a bad row, returning the line of the bad
+    row."""
+    rows = [HEADER]
+    for k in range(padding):
+        if k % 2:
+            rows.append(f'Bob,2.50,USD,,"first line{newline}second line"')
+        else:
+            rows.append(f'Alice,{k}.25,USD,Alice,lunch')
+    rows += [bad_row, 'Alice,1,USD,,']
+    data = newline.join(rows) + newline
+    path.write_bytes(data.encode())
+    return data[:data.index(bad_row)].count('\n') + 1
+
+@pytest.fixture
+def participants_file(tmp_path):
+    path = tmp_path / 'participants.csv'
+    path.write_text('participant,email\nAlice,a@email.com\nBob,b@email.com\n')
+    return str(path)
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'], ids=['lf', 'crlf'])
+@pytest.mark.parametrize('reader', ['csv', 'pandas', 'stream'])
+def test_bad_cost_line(tmp_path, participants_file, newline, reader):
+    costs_file = tmp_path / 'costs.csv'
+    # About 40 bytes a row, so the pandas reader gets over CORE_MAX_BYTES.
+    padding = 100 if reader == 'csv' else CORE_MAX_BYTES // 32
+    line = write_costs(costs_file, newline, padding, 'Bob,lots,USD,,')
+    if reader == 'pandas':
+        assert costs_file.stat().st_size > CORE_MAX_BYTES
+    else:
+        assert line > padding
+
+    with pytest.raises(RowError) as error:
+        Reimburser(participants_file, str(costs_file),
+                   stream=reader == 'stream', chunksize=1000)
+    assert str(error.value) == f"Line {line} of {costs_file}: the cost " \
+        "'lots' is not a number."
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'], ids=['lf', 'crlf'])
+@pytest.mark.parametrize('stream', [False, True], ids=['file', 'records'])
+def test_multiline_row_line(tmp_path, participants_file, newline, stream):
+    # The row is pointed at by the line it starts on, not the one its note
+    # ends on.
+    costs_file = tmp_path / 'costs.csv'
+    line = write_costs(costs_file, newline, 5, 'Bob,,USD,,"a{0}b{0}c"'
+                       .format(newline))
+
+    with pytest.raises(RowError, match=f'^Line {line} of .*: the cost is '
+                                       'missing'):
+        if stream:
+            with open(costs_file, 'rb') as f:
+                Reimburser.from_records({'Alice': 'a@email.com',
+                                         'Bob': 'b@email.com'}, f)
+        else:
+            Reimburser(participants_file, str(costs_file))
@@ -0,0 +1,156 @@
+import threading
+import time
+from smtplib import (SMTPAuthenticationError, SMTPRecipientsRefused,
+                     SMTPResponseException)
+
+import pytest
+from conftest import make_messages
+
+from reimburser._delivery import Deliverer, SMTPPool
+
+def test_failing_on_report_stops_delivery(smtp_server):
+    pool = SMTPPool('localhost', 25, 'me@example.com', 'secret', size=2,
+                    smtp_factory=smtp_server.connect)
+    deliverer = Deliverer(pool, workers=2, queue_size=2)
+
+    def on_report(k, report):
+        raise RuntimeError('database is locked')
+
+    result = dict()
+
+    def deliver():
+        try:
+            deliverer.deliver(make_messages(20), on_report)
+        except RuntimeError as e:
+            result['error'] = e
+
+    # Before, every sender died and the producer blocked on the full queue
+    # for good.
+    thread = threading.Thread(target=deliver, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert str(result['error']) == 'database is locked'
+    assert len(smtp_server.sent) < 20
+
+def make_deliverer(smtp_server, workers=1, password='secret',
+                   rate_limit=None, retries=3, backoff=0.0):
+    pool = SMTPPool('localhost', 25, 'me@example.com', password,
+                    size=workers, rate_limit=rate_limit,
+                    smtp_factory=smtp_server.connect)
+    return Deliverer(pool, workers, retries, backoff)
+
+def test_connections_are_pooled(smtp_server):
+    deliverer = make_deliverer(smtp_server, workers=3)
+    with deliverer.pool:
+        reports = deliverer.deliver(make_messages(30))
+
+    assert [report.recipient for report in reports] == \
+        [f'P{i:04d}' for i in range(30)]
+    assert all(report.sent and report.attempts == 1 for report in reports)
+    assert 1 <= len(smtp_server.connections) <= 3
+    assert sum(c.sent for c in smtp_server.connections) == 30
+    assert all(c.closed for c in smtp_server.connections)
+
+def test_rate_limit(smtp_server):
+    deliverer = make_deliverer(smtp_server, workers=2, rate_limit=50)
+    start = time.monotonic()
+    deliverer.deliver(make_messages(6))
+
+    # The first message goes right away, the others 1/50 s apart.
+    assert time.monotonic() - start >= 5 / 50
+
+def test_transient_failures_are_retried_with_backoff(smtp_server):
+    smtp_server.errors['P0001@example.com'] = [
+        SMTPResponseException(451, b'Try again later')] * 2
+    deliverer = make_deliverer(smtp_server, backoff=0.05)
+    start = time.monotonic()
+    reports = deliverer.deliver(make_messages(2))
+
+    assert time.monotonic() - start >= 0.05 + 0.1
+    assert [(report.sent, report.attempts) for report in reports] == \
+        [(True, 1), (True, 3)]
+
+def test_retries_run_out(smtp_server):
+    smtp_server.errors['P0000@example.com'] = [
+        SMTPResponseException(451, b'Try again later')] * 3
+    reports = make_deliverer(smtp_server, retries=2).deliver(
+        make_messages(1))
+
+    assert not reports[0].sent
+    assert reports[0].attempts == 3
+    assert reports[0].error.startswith('SMTPResponseException')
+
+def test_permanent_failures_are_reported(smtp_server):
+    smtp_server.errors['P0001@example.com'] = [
+        SMTPRecipientsRefused({'P0001@example.com': (550, b'No such user')})]
+    reports = make_deliverer(smtp_server, workers=2).deliver(
+        make_messages(3))
+
+    assert [(report.recipient, report.sent, report.attempts)
+            for report in reports] == \
+        [('P0000', True, 1), ('P0001', False, 1), ('P0002', True, 1)]
+    assert reports[1].email == 'P0001@example.com'
+    assert 'No such user' in reports[1].error
+
+def test_connection_is_discarded_after_421(smtp_server):
+    smtp_server.errors['P0001@example.com'] = [
+        SMTPResponseException(421, b'Closing connection')]
+    reports = make_deliverer(smtp_server).deliver(make_messages(3))
+
+    assert all(report.sent for report in reports)
+    assert reports[1].attempts == 2
+    first, second = smtp_server.connections
+    assert first.closed
+    assert (first.sent, second.sent) == (1, 2)
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_failed_login_stops_delivery(smtp_server, workers):
+    deliverer = make_deliverer(smtp_server, workers=workers, password='nope')
+    with pytest.raises(SMTPAuthenticationError):
+        deliverer.deliver(make_messages(40))
+
+    assert smtp_server.sent == []
+    # Only the logins already under way when the first one failed.
+    assert 1 <= smtp_server.logins <= workers
+
+def test_emailer_sends_to_every_participant(smtp_server):
+    from reimburser import Reimburser
+    from reimburser._emailer import Emailer
+
+    emails = {'Alice': 'alice@example.com', 'Bob': 'bob@example.com',
+              'Carol': 'carol@example.com'}
+    reimbs = Reimburser.from_records(
+        emails,
+        [{'reimbursee': 'Alice', 'cost': 30.0, 'reimbursers': None},
+         {'reimbursee': 'Bob', 'cost': 12.5, 'reimbursers': 'Bob, Carol'}],
+        trip_title='Lunch')
+    emailer = Emailer(reimbs.trip_title, reimbs.emails, reimbs.ledger,
+                      reimbs.settlements, connections=2,
+                      smtp_factory=smtp_server.connect)
+    reports = emailer.send(sender_email='me@example.com', password='secret')
+
+    assert [(report.recipient, report.sent) for report in reports] == \
+        [('Alice', True), ('Bob', True), ('Carol', True)]
+    assert sorted(smtp_server.sent) == sorted(emails.values())
+
+def test_statements_indexed_once(tmp_path, monkeypatch):
+    from reimburser import Reimburser, _settlement, _writer
+
+    built = list()
+
+    class CountedIndex(_settlement.StatementIndex):
+        def __init__(self, settlements):
+            built.append(settlements)
+            super().__init__(settlements)
+
+    monkeypatch.setattr(_settlement, 'StatementIndex', CountedIndex)
+    monkeypatch.setattr(_writer, 'StatementIndex', CountedIndex)
+    monkeypatch.setattr('reimburser.reimburser.StatementIndex', CountedIndex)
+    reimbs = Reimburser.from_records(
+        {'Alice': 'alice@example.com', 'Bob': 'bob@example.com'},
+        [{'reimbursee': 'Alice', 'cost': 30.0, 'reimbursers': None}])
+    assert reimbs.spool_emails(str(tmp_path / 'outbox.db'),
+                               'me@example.com') == 2
+
+    assert len(built) == 1
@@ -0,0 +1,34 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from reimburser._reimburser_helper import ReimburserHelper
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_vectorized_matches_reference(make_trip, seed):
+    participants_file, costs_file = make_trip(
+        participants=6, rows=120, currencies=2, even=True, seed=seed)
+    names = list(ReimburserHelper.email_getter(participants_file))
+
+    _, vectorized = ReimburserHelper.reimbs_mats_getter(
+        costs_file, names, 'USD', engine='vectorized')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        _, reference = ReimburserHelper.reimbs_mats_getter(
+            costs_file, names, 'USD', engine='reference')
+
+    assert list(vectorized) == list(reference)
+    for currency in reference:
+        expected = reference[currency].loc[names, names].to_numpy()
+        actual = vectorized[currency].loc[names, names].to_numpy()
+        # Both leave the pairs that don't reimburse each other as NaN.
+        np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+        np.testing.assert_allclose(np.nan_to_num(actual),
+                                   np.nan_to_num(expected), atol=0.01)
+
+def test_unknown_engine(make_trip):
+    participants_file, costs_file = make_trip(participants=3, rows=5)
+    with pytest.raises(ValueError):
+        ReimburserHelper.reimbs_mats_getter(
+            costs_file, ['P0000'], 'USD', engine='nope')
@@ -0,0 +1,49 @@
+import pickle
+
+import pytest
+
+from reimburser import _metrics
+from reimburser._metrics import Metrics, collecting
+
+def test_merge():
+    metrics, other = Metrics(), Metrics()
+    with metrics.timer('read'):
+        pass
+    metrics.count('rows_parsed', 10)
+    with other.timer('read'):
+        pass
+    other.count('rows_parsed', 5)
+    other.observe('smtp_send', 0.5)
+
+    metrics.merge(pickle.loads(pickle.dumps(other)))
+
+    assert metrics.timers['read'][1] == 2
+    assert metrics.counters == {'rows_parsed': 15}
+    assert metrics.latencies == {'smtp_send': [0.5]}
+
+def test_collected_only_when_asked():
+    result, metrics = _metrics.collected(False, _metrics.count, 'rows', 3)
+    assert result is None and metrics is None
+
+    result, metrics = _metrics.collected(True, _metrics.count, 'rows', 3)
+    assert metrics.counters == {'rows': 3}
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_batch_metrics_come_back_from_the_workers(make_trip, jobs):
+    from reimburser._batch import Trip, _run_batch
+
+    trips = list()
+    for seed in range(3):
+        participants_file, costs_file = make_trip(rows=200, seed=seed)
+        trips.append(Trip(f'trip {seed}', participants_file, costs_file,
+                          'USD', costs_file + '.out.csv'))
+
+    with collecting(Metrics()) as metrics:
+        results = _run_batch(trips, jobs)
+
+    assert all(result.error is None for result in results)
+    assert metrics.counters['rows_parsed'] == 600
+    assert metrics.counters['transfers'] == \
+        sum(result.reimbursements for result in results)
+    for stage in ('read', 'balances', 'settle', 'write'):
+        assert metrics.timers[stage][1] == 3
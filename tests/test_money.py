@@ -0,0 +1,92 @@
+import argparse
+
+import numpy as np
+import pytest
+
+from reimburser import Reimburser
+from reimburser.__main__ import parse_minor_digits
+from reimburser._money import _minor_digits, _rescale, _split
+from reimburser._writer import Writer
+
+EMAILS = {'Alice': 'a@email.com', 'Bob': 'b@email.com', 'Carol': 'c@email.com'}
+
+def test_split_adds_up():
+    rng = np.random.default_rng(0)
+    amounts = rng.integers(-10_000, 10_000, 500)
+    group_sizes = rng.integers(1, 8, 500)
+    shares = _split(amounts, group_sizes)
+
+    starts = np.cumsum(group_sizes) - group_sizes
+    np.testing.assert_array_equal(np.add.reduceat(shares, starts), amounts)
+    # The shares of an amount are at most a minor unit apart.
+    spread = np.maximum.reduceat(shares, starts) \
+        - np.minimum.reduceat(shares, starts)
+    assert spread.max() <= 1
+
+def test_split_rotates_remainder():
+    # 100 split 3 ways leaves a minor unit over, which each row hands to the
+    # next member of the group.
+    shares = _split(np.array([100, 100, 100]), np.array([3, 3, 3]))
+    np.testing.assert_array_equal(
+        shares.reshape(3, 3), [[34, 33, 33], [33, 34, 33], [33, 33, 34]])
+
+    # The rotation follows the row numbers given, not the positions.
+    shares = _split(np.array([100]), np.array([3]), rows=np.array([2]))
+    np.testing.assert_array_equal(shares, [33, 33, 34])
+
+@pytest.mark.parametrize('amounts, scale, digits, expected', [
+    # Fewer digits than the currency: padded with zeros.
+    ([1234, -5], 0, 2, [123400, -500]),
+    ([1234], 2, 3, [12340]),
+    # More digits: rounded half away from zero.
+    ([1234, 1235, -1235, 1249], 1, 0, [123, 124, -124, 125]),
+    ([10005, -10005, 10004], 4, 3, [1001, -1001, 1000]),
+    ([7], 2, 2, [7]),
+])
+def test_rescale(amounts, scale, digits, expected):
+    rescaled = _rescale(np.array(amounts, dtype=np.int64), scale, digits)
+    np.testing.assert_array_equal(rescaled, expected)
+
+def test_minor_digits():
+    assert _minor_digits('JPY') == 0
+    assert _minor_digits('KWD') == 3
+    assert _minor_digits('EUR') == 2
+    assert _minor_digits('JPY', {'JPY': 2}) == 2
+
+def test_exact_jpy_kwd():
+    costs = [['reimbursee', 'cost', 'currency', 'reimbursers'],
+             ['Alice', '1000', 'JPY', ''],
+             ['Bob', '10.001', 'KWD', ''],
+             ['Carol', '0.5', 'JPY', 'Alice, Carol']]
+    reimbs = Reimburser.from_records(EMAILS, costs, exact=True)
+
+    jpy = reimbs.settlements['JPY']
+    assert jpy.digits == 0
+    # Whole yen (Carol's half a yen rounds up).
+    assert all(amount == int(amount) for amount in jpy.amounts.tolist())
+    kwd = reimbs.settlements['KWD']
+    assert kwd.digits == 3
+    assert sorted(kwd.amounts.tolist()) == [3.333, 3.334]
+
+    writer = Writer('Trip', reimbs.ledger, reimbs.settlements)
+    for body in (writer.write_plaintext_body('Carol'),
+                 writer.write_html_body('Carol')):
+        assert ' JPY' in body and ' KWD' in body
+        assert '.0 JPY' not in body
+        assert '3.334 KWD' in body or '3.333 KWD' in body
+
+def test_exact_minor_digits_override():
+    costs = [['reimbursee', 'cost', 'currency', 'reimbursers'],
+             ['Alice', '10', 'JPY', '']]
+    reimbs = Reimburser.from_records(EMAILS, costs, exact=True,
+                                     minor_digits={'JPY': 2})
+
+    assert reimbs.settlements['JPY'].digits == 2
+    assert sorted(reimbs.settlements['JPY'].amounts.tolist()) \
+        == [3.33, 3.33]
+
+def test_parse_minor_digits():
+    assert parse_minor_digits('jpy=0, KWD=3') == {'JPY': 0, 'KWD': 3}
+    for value in ('JPY', 'JPY=x', '=2', 'JPY=-1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_minor_digits(value)
@@ -0,0 +1,64 @@
+import pytest
+from conftest import make_messages
+
+from reimburser._errors import OutboxError
+from reimburser._outbox import FAILED, PENDING, SENT, Outbox
+
+class Crash(BaseException):
+    """Stands in for the process dying halfway through a delivery."""
+
+def deliver(outbox, smtp_server, **settings):
+    return outbox.deliver('secret', connections=1, retries=0,
+                          smtp_factory=smtp_server.connect, **settings)
+
+def test_resume_after_partial_delivery(tmp_path, smtp_server):
+    messages = make_messages(6)
+    smtp_server.errors['P0003@example.com'] = [Crash()]
+    with Outbox(str(tmp_path / 'outbox.db')) as outbox:
+        assert outbox.put(messages, 'me@example.com') == 6
+        with pytest.raises(Crash):
+            deliver(outbox, smtp_server)
+        assert outbox.counts() == {PENDING: 3, SENT: 3, FAILED: 0}
+
+        reports = deliver(outbox, smtp_server)
+
+    assert [report.recipient for report in reports] == \
+        ['P0003', 'P0004', 'P0005']
+    assert all(report.sent for report in reports)
+    # Nobody got their email twice.
+    assert sorted(smtp_server.sent) == [msg['To'] for _, msg in messages]
+
+def test_retry_failed(tmp_path, smtp_server):
+    from smtplib import SMTPRecipientsRefused
+
+    smtp_server.errors['P0001@example.com'] = [
+        SMTPRecipientsRefused({'P0001@example.com': (550, b'No such user')})]
+    with Outbox(str(tmp_path / 'outbox.db')) as outbox:
+        outbox.put(make_messages(3), 'me@example.com')
+        reports = deliver(outbox, smtp_server)
+        assert [report.sent for report in reports] == [True, False, True]
+        assert outbox.counts() == {PENDING: 0, SENT: 2, FAILED: 1}
+        assert deliver(outbox, smtp_server) == []
+
+        assert outbox.retry_failed() == 1
+        reports = deliver(outbox, smtp_server)
+
+    assert [(report.recipient, report.sent) for report in reports] == \
+        [('P0001', True)]
+    assert smtp_server.sent.count('P0001@example.com') == 1
+
+def test_put_refuses_unsent_emails(tmp_path, smtp_server):
+    with Outbox(str(tmp_path / 'outbox.db')) as outbox:
+        outbox.put(make_messages(2), 'me@example.com')
+        with pytest.raises(OutboxError):
+            outbox.put(make_messages(2), 'me@example.com')
+
+def test_put_after_full_delivery(tmp_path, smtp_server):
+    with Outbox(str(tmp_path / 'outbox.db')) as outbox:
+        outbox.put(make_messages(2), 'me@example.com')
+        deliver(outbox, smtp_server)
+
+        # Running the same trip again spools it anew.
+        assert outbox.put(make_messages(3), 'me@example.com') == 3
+        assert outbox.counts() == {PENDING: 3, SENT: 0, FAILED: 0}
+        assert len(deliver(outbox, smtp_server)) == 3
@@ -0,0 +1,21 @@
+import pytest
+
+from conftest import transfers
+from reimburser import Reimburser
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'exact': True},
+    {'settle': 'optimal', 'exact': True},
+    {'stream': True, 'chunksize': 50},
+])
+def test_workers_match_serial(make_trip, options):
+    participants_file, costs_file = make_trip(participants=8, rows=400,
+                                              currencies=4, seed=8)
+    serial = Reimburser(participants_file, costs_file, **options)
+    parallel = Reimburser(participants_file, costs_file, workers=2,
+                          **options)
+
+    assert len(parallel.settlements) == 4
+    assert transfers(parallel) == transfers(serial)
+    assert parallel.rows == serial.rows
@@ -0,0 +1,67 @@
+import csv
+import io
+
+import pandas as pd
+import pytest
+
+from conftest import transfers
+from reimburser import Reimburser
+from reimburser._errors import RowError
+from reimburser._reimburser_helper import ReimburserHelper
+
+@pytest.fixture(params=[False, True], ids=['floats', 'exact'])
+def trip(request, make_trip):
+    participants_file, costs_file = make_trip(
+        participants=8, rows=200, currencies=3, seed=3)
+    expected = Reimburser(participants_file, costs_file, exact=request.param)
+    return participants_file, costs_file, request.param, transfers(expected)
+
+def test_from_frames_matches_files(trip):
+    participants_file, costs_file, exact, expected = trip
+    emails = ReimburserHelper.email_getter(participants_file)
+
+    reimbs = Reimburser.from_frames(emails, pd.read_csv(costs_file),
+                                    exact=exact)
+    assert transfers(reimbs) == expected
+
+@pytest.mark.parametrize('layout', ['stream', 'rows', 'columns', 'dicts'])
+def test_from_records_matches_files(trip, layout):
+    participants_file, costs_file, exact, expected = trip
+    emails = ReimburserHelper.email_getter(participants_file)
+
+    columns = None
+    with open(costs_file, newline='') as f:
+        if layout == 'stream':
+            costs = io.StringIO(f.read())
+        elif layout == 'dicts':
+            costs = list(csv.DictReader(f))
+        else:
+            costs = list(csv.reader(f))
+            if layout == 'columns':
+                columns, costs = costs[0], costs[1:]
+
+    reimbs = Reimburser.from_records(emails, costs, exact=exact,
+                                     columns=columns)
+    assert transfers(reimbs) == expected
+
+@pytest.mark.parametrize('costs, columns, record', [
+    # The header is the first record.
+    ([['reimbursee', 'cost', 'reimbursers'], ['Alice', '1', ''],
+      ['Bob', 'lots', '']], None, 3),
+    ([['Alice', '1', ''], ['Bob', 'lots', '']],
+     ['reimbursee', 'cost', 'reimbursers'], 2),
+    ([{'reimbursee': 'Alice', 'cost': 1, 'reimbursers': None},
+      {'reimbursee': 'Bob', 'cost': None, 'reimbursers': None}], None, 2),
+    # Empty records are skipped, but still counted.
+    ([['reimbursee', 'cost', 'reimbursers'], [], ['Bob', '', '']], None, 3),
+])
+def test_from_records_error_record(costs, columns, record):
+    emails = {'Alice': 'alice@email.com', 'Bob': 'bob@email.com'}
+    with pytest.raises(RowError, match=f'^Record {record} of <records>'):
+        Reimburser.from_records(emails, costs, columns=columns)
+
+def test_from_records_error_line():
+    emails = {'Alice': 'alice@email.com', 'Bob': 'bob@email.com'}
+    costs = io.StringIO('reimbursee,cost,reimbursers\nAlice,1,\n\nBob,lots,\n')
+    with pytest.raises(RowError, match='^Line 4 of <stream>'):
+        Reimburser.from_records(emails, costs)
@@ -0,0 +1,96 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from reimburser._serve import SettlementServer
+
+JOB = {
+    'participants': {'Alice': 'alice@email.com', 'Bob': 'bob@email.com'},
+    'costs': [{'reimbursee': 'Alice', 'cost': 12.34, 'reimbursers': None},
+              {'reimbursee': 'Bob', 'cost': 42.98,
+               'reimbursers': 'Alice, Bob'}],
+    'title': 'Lunch',
+}
+
+@pytest.fixture(scope='module')
+def server():
+    with SettlementServer(('127.0.0.1', 0), jobs=1, max_bytes=1 << 16) \
+            as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield server
+        server.shutdown()
+        thread.join()
+
+def request(server, method, path, body=None, headers=None):
+    """Sends a request to the server, returning its status and JSON body."""
+    connection = http.client.HTTPConnection(*server.address, timeout=30)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+def test_health(server):
+    assert request(server, 'GET', '/health') \
+        == (200, {'status': 'ok', 'jobs': 1})
+
+def test_settle(server):
+    status, body = request(server, 'POST', '/settle', json.dumps(JOB))
+
+    assert status == 200
+    assert body['title'] == 'Lunch'
+    assert body['settlements']['USD']['transfers'] \
+        == [{'debtor': 'Alice', 'creditor': 'Bob', 'amount': 15.32}]
+    assert body['statements']['Bob']['receivables'] \
+        == [{'counterparty': 'Alice', 'amount': 15.32, 'currency': 'USD'}]
+
+def test_settle_csv(server):
+    job = {'participants': ('participant,email\n'
+                            'Alice,alice@email.com\nBob,bob@email.com\n'),
+           'costs': 'reimbursee,cost,reimbursers\nAlice,10,\n',
+           'exact': True}
+    status, body = request(server, 'POST', '/settle', json.dumps(job))
+
+    assert status == 200
+    assert body['settlements']['USD']['transfers'] \
+        == [{'debtor': 'Bob', 'creditor': 'Alice', 'amount': 5.0}]
+
+@pytest.mark.parametrize('method, path', [('GET', '/settle'),
+                                          ('POST', '/health')])
+def test_no_such_endpoint(server, method, path):
+    status, _ = request(server, method, path, '{}')
+    assert status == 404
+
+@pytest.mark.parametrize('job, error', [
+    ('{"participants":', 'not valid JSON'),
+    ('[]', 'TypeError'),
+    ('{"costs": []}', 'KeyError'),
+    (json.dumps(dict(JOB, settle='fastest')), 'ValueError'),
+    (json.dumps(dict(JOB, costs=[['reimbursee', 'cost', 'reimbursers'],
+                                 ['Alice', 'lots', '']])), 'Record 2'),
+    (json.dumps(dict(JOB, outbox='lunch.db', sender='a@email.com')),
+     'outbox directory'),
+])
+def test_bad_job(server, job, error):
+    status, body = request(server, 'POST', '/settle', job)
+
+    assert status == 400
+    assert error in body['error']
+
+@pytest.mark.parametrize('length, status', [('-1', 400), ('lots', 411),
+                                            (str(1 << 20), 413)])
+def test_bad_length(server, length, status):
+    assert request(server, 'POST', '/settle', '{}',
+                   {'Content-Length': length})[0] == status
+
+def test_failed_job(server, monkeypatch):
+    def settle(job):
+        raise RuntimeError('out of workers')
+    monkeypatch.setattr(server, 'settle', settle)
+
+    assert request(server, 'POST', '/settle', json.dumps(JOB)) \
+        == (500, {'error': 'RuntimeError: out of workers'})
@@ -0,0 +1,88 @@
+import itertools
+import random
+import time
+from functools import lru_cache
+
+import pytest
+
+from settle import grouped_balances
+from reimburser._settlement import _settle, _settle_optimal, _zero_sum_groups
+
+def fewest_transfers(units):
+    """The fewest transfers that settle the balances, found by trying every
+    split of the participants into zero-sum groups."""
+    ids = [i for i, u in enumerate(units) if u != 0]
+
+    @lru_cache(maxsize=None)
+    def most_groups(rest):
+        if not rest:
+            return 0
+        first, others = rest[0], rest[1:]
+        most = -len(units)
+        for size in range(len(others) + 1):
+            for group in itertools.combinations(others, size):
+                if units[first] + sum(units[i] for i in group) == 0:
+                    left = tuple(i for i in others if i not in group)
+                    most = max(most, 1 + most_groups(left))
+        return most
+
+    return len(ids) - most_groups(tuple(ids))
+
+def settled(units, transfers):
+    """The balances left once the transfers are made."""
+    left = list(units)
+    for debtor, creditor, amount in transfers:
+        left[debtor] += amount
+        left[creditor] -= amount
+    return left
+
+@pytest.mark.parametrize('seed', range(5))
+def test_optimal_matches_brute_force(seed):
+    rng = random.Random(seed)
+    for _ in range(20):
+        units = grouped_balances(rng, rng.randint(2, 9), 4)
+        transfers = _settle_optimal(units, exact=True)
+
+        assert settled(units, transfers) == [0] * len(units)
+        assert len(transfers) == fewest_transfers(units)
+        assert len(transfers) <= len(_settle(units, exact=True))
+
+def test_optimal_beats_greedy():
+    # A couple and a group of three who only shared costs among themselves,
+    # but whose largest debt and credit are across groups.
+    units = [10, -7, -3, 8, -8]
+    assert len(_settle(units, exact=True)) == 4
+    assert len(_settle_optimal(units, exact=True)) == 3
+
+def test_zero_sum_groups_leftover():
+    # A cent left over by rounding: the participants that don't fit in a
+    # zero-sum group end up in a group of their own.
+    units = [400, -400, 250, -100, -149]
+    groups = _zero_sum_groups(units, time.perf_counter() + 60)
+
+    assert sorted(i for group in groups for i in group) == list(range(5))
+    assert sorted(map(sorted, groups)) == [[0, 1], [2, 3, 4]]
+
+def test_optimal_leftover():
+    units = [400, 250, -100, -149, -400]
+    transfers = _settle_optimal(units, exact=True)
+
+    assert len(transfers) == 3
+    # Everyone but the creditor the cent is owed to is settled.
+    assert sorted(map(abs, settled(units, transfers))) == [0, 0, 0, 0, 1]
+
+@pytest.mark.parametrize('budget', [{'max_participants': 2},
+                                    {'time_budget': 0}])
+def test_optimal_over_budget_is_greedy(budget):
+    units = [10, -7, -3, 8, -8]
+    greedy = _settle(units, exact=True)
+    assert len(_settle_optimal(units, exact=True)) < len(greedy)
+    assert _settle_optimal(units, exact=True, **budget) == greedy
+    assert _zero_sum_groups(units, time.perf_counter() - 1) is None
+
+def test_optimal_floats():
+    balance = [12.5, -2.5, -12.5, 2.5, 0.0]
+    transfers = _settle_optimal(balance)
+
+    assert len(transfers) == 2
+    assert settled(balance, transfers) == pytest.approx([0.0] * 5)
@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import transfers
+from reimburser import Reimburser
+from reimburser._errors import StateError
+
+PARTICIPANTS = 'participant,email\r\nAlice,a@email.com\r\nBob,b@email.com\r\n'
+HEADER = b'reimbursee,cost,reimbursers\r\n'
+
+@pytest.fixture
+def trip(tmp_path):
+    """Writes the participants file, returning a function that writes the
+    costs file and settles it from scratch."""
+    participants_file = tmp_path / 'participants.csv'
+    participants_file.write_text(PARTICIPANTS, newline='')
+    costs_file = tmp_path / 'costs.csv'
+    state_file = str(tmp_path / 'state.json')
+
+    def settle(data: bytes, **options) -> Reimburser:
+        costs_file.write_bytes(data)
+        return Reimburser(str(participants_file), str(costs_file), **options)
+
+    settle.state_file = state_file
+    return settle
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_appended_rows(make_trip, tmp_path, exact):
+    participants_file, costs_file = make_trip(participants=6, rows=300,
+                                              currencies=2, seed=5)
+    with open(costs_file, 'rb') as f:
+        data = f.read()
+    full = transfers(Reimburser(participants_file, costs_file, exact=exact))
+
+    state_file = str(tmp_path / 'state.json')
+    cut = data.index(b'\n', len(data) // 2) + 1
+    with open(costs_file, 'wb') as f:
+        f.write(data[:cut])
+    first = Reimburser(participants_file, costs_file, exact=exact,
+                       state_file=state_file)
+    with open(costs_file, 'ab') as f:
+        f.write(data[cut:])
+    second = Reimburser(participants_file, costs_file, exact=exact,
+                        state_file=state_file)
+
+    assert 0 < first.rows < second.rows == 300
+    assert transfers(second) == full
+
+def test_rewritten_row(trip):
+    data = HEADER + b'Alice,20,\r\nBob,3,\r\n'
+    trip(data, state_file=trip.state_file)
+
+    with pytest.raises(StateError):
+        trip(data.replace(b'Bob,3', b'Bob,4') + b'Alice,1,\r\n',
+             state_file=trip.state_file)
+
+@pytest.mark.parametrize('last', [b'Bob,4,', b'Bob,4,"Alice,\r\nBob"'])
+def test_no_trailing_newline(trip, last):
+    data = HEADER + b'Alice,20,\r\nBob,3,\r\n' + last
+    full = trip(data)
+    incremental = trip(data, state_file=trip.state_file)
+
+    assert incremental.rows == full.rows == 3
+    assert transfers(incremental) == transfers(full)
+
+    # The next row starts on a line of its own.
+    data += b'\r\nAlice,7,\r\n'
+    assert transfers(trip(data, state_file=trip.state_file)) \
+        == transfers(trip(data))
+
+def test_glued_row(trip):
+    data = HEADER + b'Alice,20,\r\nBob,3,'
+    trip(data, state_file=trip.state_file)
+
+    # Bob,3, became Bob,3,Alice (or Bob,35, ...): the last row consumed has
+    # changed.
+    with pytest.raises(StateError):
+        trip(data + b'Alice\r\n', state_file=trip.state_file)
+
+@pytest.mark.parametrize('partial', [b'Bob,3', b'Bob,3,"Alice,\r\n'])
+def test_incomplete_row(trip, partial):
+    data = HEADER + b'Alice,20,\r\n'
+    incremental = trip(data + partial, state_file=trip.state_file)
+    assert incremental.rows == 1
+
+    # The row is read once it is complete.
+    data += b'Bob,3,\r\n'
+    incremental = trip(data, state_file=trip.state_file)
+    assert incremental.rows == 2
+    assert transfers(incremental) == transfers(trip(data))
@@ -0,0 +1,23 @@
+import pytest
+
+from conftest import transfers
+from reimburser import Reimburser
+
+@pytest.mark.parametrize('exact', [False, True])
+@pytest.mark.parametrize('chunksize', [7, 37, 1000])
+def test_stream_matches_full_read(make_trip, exact, chunksize):
+    participants_file, costs_file = make_trip(participants=9, rows=400,
+                                              currencies=3, seed=7)
+    full = Reimburser(participants_file, costs_file, exact=exact)
+    streamed = Reimburser(participants_file, costs_file, exact=exact,
+                          stream=True, chunksize=chunksize)
+
+    assert streamed.summarized
+    assert transfers(streamed) == transfers(full)
+    assert streamed.rows == full.rows == 400
+    # The summary has the total cost of each currency.
+    totals = dict(zip(streamed.table['currency'], streamed.table['cost']))
+    assert sorted(totals) == sorted(full.settlements)
+    assert sum(totals.values()) \
+        == pytest.approx(float(full.ledger.amount.sum())
+                         / 10 ** full.ledger.scale)